@@ -0,0 +1,299 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from scoring import build_user_vector, score, top_k
+from space_cache import SpaceTopicCache
+
+
+class SpaceIndex:
+    # Random-projection LSH over the space cache's topic matrix.
+    # Each topic gets its own deterministic random projection, so a space's bucket keys depend only
+    # on its topics. `tables` x `bits` hyperplanes hash a space into one bucket per table; `probes`
+    # extra buckets per table (flipping the least certain bits) trade latency for recall.
+    # Candidates are re-scored exactly on their rows of the cached matrix.
+    # Upkeep follows the cache:
+    #   create      -> only the appended rows are hashed, into small pending buckets that are folded
+    #                  into the sorted tables once they reach 1/8 of the index
+    #   end/delete  -> tombstoned through the cache's live mask, dropped when the cache compacts
+    #   reload      -> (another worker changed the catalogue) keys are reused for known spaces
+    # With a path, the keys of every hashed space are saved with the catalogue version they reflect,
+    # so a restart only hashes spaces created since; the file is only ever replaced by a newer version.
+
+    def __init__(self, space_cache, path=None, tables=8, bits=10, probes=2, seed=7):
+        self.space_cache = space_cache
+        self.path = path
+        self.tables = tables
+        self.bits = bits
+        self.probes = probes
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.projections = {}
+        self.powers = 1 << np.arange(bits, dtype=np.int64)
+        self.saved_version = None
+        self.generation = None
+        self._reset()
+
+    def _reset(self):
+        self.topics = []
+        # Keys per cache row; the buffer doubles so a create does not copy the whole index
+        self.buffer = np.zeros((1024, self.tables), dtype=np.int64)
+        self.size = 0
+        self.known = {}
+        self.keys = [np.zeros(0, dtype=np.int64) for _ in range(self.tables)]
+        self.rows = [np.zeros(0, dtype=np.int64) for _ in range(self.tables)]
+        self.pending = [dict() for _ in range(self.tables)]
+        self.pending_rows = 0
+
+    def _projection(self, topic):
+        projection = self.projections.get(topic)
+        if projection is None:
+            rng = np.random.default_rng(zlib.crc32(topic.encode("utf-8")) ^ self.seed)
+            projection = rng.standard_normal(self.tables * self.bits)
+            self.projections[topic] = projection
+        return projection
+
+    def _project(self, matrix):
+        # Rows x (tables * bits), building projections only for the topics these rows use
+        columns = np.unique(matrix.indices)
+        if not len(columns):
+            return np.zeros((matrix.shape[0], self.tables * self.bits))
+        projections = np.vstack([self._projection(self.topics[column]) for column in columns])
+        return np.asarray(matrix[:, columns] @ projections)
+
+    def _hash(self, projected):
+        # (n, tables * bits) projections -> (n, tables) bucket keys
+        bits = (projected.reshape(len(projected), self.tables, self.bits) > 0).astype(np.int64)
+        return bits @ self.powers
+
+    def _sort(self):
+        # Per table: keys sorted once, rows grouped by key, so a probe is a binary search and a slice
+        row_keys = self.buffer[:self.size]
+        for table in range(self.tables):
+            order = np.argsort(row_keys[:, table])
+            self.keys[table] = row_keys[order, table]
+            self.rows[table] = order
+        self.pending = [dict() for _ in range(self.tables)]
+        self.pending_rows = 0
+
+    def _append(self, matrix, space_ids, start, previous=None):
+        # Hash rows start.. of the cache; `previous` is ({space_id: row}, keys) of an earlier numbering
+        # (or the saved file) whose keys are reused
+        new_ids = space_ids[start:]
+        keys = np.zeros((len(new_ids), self.tables), dtype=np.int64)
+        unknown = np.ones(len(new_ids), dtype=bool)
+        if previous:
+            known, known_keys = previous
+            positions = np.fromiter((known.get(space_id, -1) for space_id in new_ids), dtype=np.int64,
+                                    count=len(new_ids))
+            unknown = positions < 0
+            keys[~unknown] = known_keys[positions[~unknown]]
+        if unknown.any():
+            rows = start + np.flatnonzero(unknown)
+            keys[unknown] = self._hash(self._project(matrix[rows]))
+        self.known.update(zip(new_ids, range(start, start + len(new_ids))))
+        if self.size + len(keys) > len(self.buffer):
+            buffer = np.zeros((max(2 * len(self.buffer), self.size + len(keys)), self.tables), dtype=np.int64)
+            buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = buffer
+        self.buffer[self.size:self.size + len(keys)] = keys
+        self.size += len(keys)
+        self.pending_rows += len(new_ids)
+        if self.pending_rows * 8 >= self.size:
+            self._sort()
+            return True
+        for offset, row_keys in enumerate(keys):
+            for table, key in enumerate(row_keys):
+                self.pending[table].setdefault(int(key), []).append(start + offset)
+        return False
+
+    def _refresh(self):
+        cache = self.space_cache
+        with cache.lock:
+            snapshot = cache.snapshot()
+            generation, version = cache.generation, cache.version
+        matrix, space_ids, _, topic_index, _ = snapshot
+        renumbered = generation != self.generation
+        previous = None
+        if renumbered:
+            # Reload or compaction renumbered the rows; spaces no longer in the catalogue are forgotten
+            previous = (self.known, self.buffer)
+            if self.path and self.saved_version is None:
+                previous = self._load() or previous
+            self._reset()
+            self.generation = generation
+        if len(topic_index) > len(self.topics):
+            self.topics.extend(sorted(topic_index, key=topic_index.get)[len(self.topics):])
+        sorted_now = len(space_ids) > self.size and self._append(matrix, space_ids, self.size, previous)
+        # Saved when the tables are re-sorted, so the cost of writing the file is amortized like the sort
+        if (self.path and (renumbered or sorted_now) and version is not None
+                and (self.saved_version is None or version > self.saved_version)):
+            self._save(version, space_ids)
+        return snapshot
+
+    def refresh(self):
+        # Hashes whatever the cache gained since the last call instead of on the next query; returns the snapshot
+        with self.lock:
+            return self._refresh()
+
+    def _load(self):
+        try:
+            with np.load(self.path) as state:
+                if (int(state['tables']), int(state['bits']), int(state['seed'])) != (self.tables, self.bits,
+                                                                                      self.seed):
+                    return None
+                space_ids = state['space_ids'].tolist()
+                keys = state['keys']
+                self.saved_version = int(state['version'])
+        except (OSError, KeyError, ValueError):
+            return None
+        return dict(zip(space_ids, range(len(space_ids)))), keys
+
+    def _save(self, version, space_ids):
+        # Only a newer catalogue replaces the file, so workers on the same version write the same keys
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as state:
+                    if int(state['version']) >= version:
+                        self.saved_version = int(state['version'])
+                        return
+            except (OSError, KeyError, ValueError):
+                pass
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, version=version, tables=self.tables, bits=self.bits, seed=self.seed,
+                     space_ids=np.array(space_ids[:self.size], dtype=str), keys=self.buffer[:self.size])
+        os.replace(tmp_path, self.path)
+        self.saved_version = version
+
+    def candidates(self, user_vector):
+        # Rows of the indexed matrix sharing a probed bucket with the user vector
+        projected = np.zeros(self.tables * self.bits)
+        for column, weight in zip(user_vector.indices, user_vector.data):
+            projected += weight * self._projection(self.topics[column])
+        projected = projected.reshape(self.tables, self.bits)
+        keys = self._hash(projected.reshape(1, -1))[0]
+        found = []
+        for table, key in enumerate(keys):
+            probe_keys = [int(key)]
+            # Multi-probe: flip the bits whose hyperplane the query sits closest to
+            for bit in np.argsort(np.abs(projected[table]))[:self.probes]:
+                probe_keys.append(int(key) ^ (1 << int(bit)))
+            table_keys = self.keys[table]
+            for probe_key in probe_keys:
+                start, end = np.searchsorted(table_keys, [probe_key, probe_key + 1])
+                found.append(self.rows[table][start:end])
+                if probe_key in self.pending[table]:
+                    found.append(np.array(self.pending[table][probe_key], dtype=np.int64))
+        return np.unique(np.concatenate(found)) if found else np.array([], dtype=np.int64)
+
+    def query(self, weights, k, exclude=()):
+        # Same contract as BaseDatabase.rank_spaces_by_topic: [(space_id, score)] best first
+        with self.lock:
+            matrix, space_ids, live, topic_index, row_of = self._refresh()
+            user_vector = build_user_vector(weights, topic_index)
+            if not space_ids or not user_vector.nnz:
+                return []
+            rows = self.candidates(user_vector)
+        for space_id in exclude:
+            row = row_of.get(space_id)
+            if row is not None and row < len(live):
+                live[row] = False
+        rows = rows[live[rows]]
+        similarities = score(matrix[rows], user_vector)
+        return [(space_ids[rows[index]], float(similarities[index])) for index in top_k(similarities, k)]
+
+
+def benchmark(args):
+    # Synthetic catalogue, so this runs without Neo4j: recall@k and latency of LSH vs exact scoring,
+    # both over the same SpaceTopicCache the app serves from
+    rng = random.Random(args.seed)
+    topics = [f"topic{i}" for i in range(args.topics)]
+    weights = [1.0 / (rank + 1) ** 1.1 for rank in range(len(topics))]
+    spaces = [{'id': f"space{i}", 'topics': sorted(set(rng.choices(topics, weights, k=rng.randint(1, 3))))}
+              for i in range(args.spaces)]
+    users = [{topic: rng.random() * 5 for topic in rng.choices(topics, weights, k=rng.randint(1, 8))}
+             for _ in range(args.queries)]
+
+    cache = SpaceTopicCache(lambda: spaces, lambda: 0)
+    matrix, _, _, topic_index, _ = cache.snapshot()
+
+    # Many spaces share a topic set, so recall is tie-aware: a hit is any result scoring at
+    # least the exact k-th best score
+    started = time.perf_counter()
+    exact = []
+    for user in users:
+        scores = score(matrix, build_user_vector(user, topic_index))
+        best = [scores[i] for i in top_k(scores, args.k) if scores[i] > 0]
+        exact.append((len(best), best[-1] if best else 0.0))
+    exact_ms = (time.perf_counter() - started) * 1000 / len(users)
+    print(f"exact: {exact_ms:.2f} ms/query over {len(spaces)} spaces")
+
+    for probes in args.probes:
+        index = SpaceIndex(cache, tables=args.tables, bits=args.bits, probes=probes)
+        started = time.perf_counter()
+        index.refresh()
+        build_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        hits = total = 0
+        for user, (expected, threshold) in zip(users, exact):
+            found = index.query(user, args.k)
+            hits += min(expected, sum(1 for _, value in found if value >= threshold - 1e-9))
+            total += expected
+        ann_ms = (time.perf_counter() - started) * 1000 / len(users)
+        candidates = sum(len(index.candidates(build_user_vector(user, topic_index))) for user in users)
+        print(f"lsh tables={args.tables} bits={args.bits} probes={probes}: recall@{args.k}="
+              f"{hits / total if total else 1.0:.3f}, {ann_ms:.2f} ms/query, "
+              f"{candidates / len(users):.0f} candidates/query, {build_ms:.0f} ms to hash the catalogue")
+
+    # Upkeep: a cold hash that writes the key file, a restart that reads it back, then one create at a time
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "space_index.npz")
+        index = SpaceIndex(cache, path=path, tables=args.tables, bits=args.bits)
+        started = time.perf_counter()
+        index.refresh()
+        cold_ms = (time.perf_counter() - started) * 1000
+        restarted = SpaceIndex(SpaceTopicCache(lambda: spaces, lambda: 0), path=path, tables=args.tables,
+                               bits=args.bits)
+        restarted.space_cache.snapshot()
+        started = time.perf_counter()
+        restarted.refresh()
+        warm_ms = (time.perf_counter() - started) * 1000
+
+        cache_ms = index_ms = 0.0
+        for i in range(args.creates):
+            space = {'id': f"new{i}", 'topics': sorted(set(rng.choices(topics, weights, k=rng.randint(1, 3))))}
+            cache.add_spaces([space], cache.version + 1)
+            started = time.perf_counter()
+            cache.snapshot()
+            cache_ms += (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            index.refresh()
+            index_ms += (time.perf_counter() - started) * 1000
+    print(f"upkeep: {cold_ms:.0f} ms cold, {warm_ms:.0f} ms from the saved keys; per created space "
+          f"{index_ms / max(args.creates, 1):.2f} ms in the index "
+          f"(+{cache_ms / max(args.creates, 1):.2f} ms updating the cache matrix)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LSH space index against exact scoring.")
+    parser.add_argument("--spaces", type=int, default=100000)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--bits", type=int, default=10)
+    parser.add_argument("--probes", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--creates", type=int, default=200, help="spaces created one at a time for upkeep")
+    parser.add_argument("--seed", type=int, default=42)
+    benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
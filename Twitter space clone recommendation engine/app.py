@@ -1,5 +1,11 @@
-from flask import Flask, request, render_template, redirect, url_for, flash, jsonify, session
-from models import Database
+from flask import Flask, request, render_template, redirect, url_for, flash, jsonify, session, Response, \
+    stream_with_context
+from models import Database, DEFAULT_PAGE_SIZE
+from memory_db import MemoryDatabase
+from recommendation import RecommendationService
+from write_behind import WriteBehindQueue
+from presence import SpacePresence
+import json
 import os
 
 
@@ -9,14 +15,73 @@ app.secret_key = os.urandom(24)
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "12345678"
-db = Database(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+TIMELINE_MAX_LENGTH = 800
+CELEBRITY_FOLLOWER_THRESHOLD = 10000
+# Serve behaviour-based candidates from the LSH space index instead of exact scoring. Off by default:
+# `python ann_index.py` puts it at ~1.8x faster than exact on 100k-300k spaces with recall@10 of
+# 0.85-0.96, which is approximate enough to be opt-in. The path keeps its keys across restarts
+SPACE_INDEX_ENABLED = os.environ.get("SPACE_INDEX_ENABLED", "0") == "1"
+SPACE_INDEX_PATH = os.environ.get("SPACE_INDEX_PATH")
+# Cached /space recommendations per user; set a Redis URL when running several workers
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get("RECOMMENDATION_CACHE_SIZE", "10000"))
+RECOMMENDATION_CACHE_TTL = int(os.environ.get("RECOMMENDATION_CACHE_TTL", "60"))
+RECOMMENDATION_CACHE_URL = os.environ.get("RECOMMENDATION_CACHE_URL")
+# Seconds between writes of the trending ranking to the graph; 0 keeps it in this worker only
+TRENDING_SNAPSHOT_INTERVAL = int(os.environ.get("TRENDING_SNAPSHOT_INTERVAL", "300"))
+# "memory" keeps the whole graph in this process (demos and tests); anything else uses Neo4j
+DATABASE_BACKEND = os.environ.get("DATABASE_BACKEND", "neo4j")
+DATABASE_OPTIONS = dict(timeline_max_length=TIMELINE_MAX_LENGTH, celebrity_threshold=CELEBRITY_FOLLOWER_THRESHOLD,
+                        space_index=SPACE_INDEX_ENABLED, space_index_path=SPACE_INDEX_PATH,
+                        recommendation_cache_size=RECOMMENDATION_CACHE_SIZE,
+                        recommendation_cache_ttl=RECOMMENDATION_CACHE_TTL,
+                        recommendation_cache_url=RECOMMENDATION_CACHE_URL,
+                        trending_snapshot_interval=TRENDING_SNAPSHOT_INTERVAL)
+if DATABASE_BACKEND == "memory":
+    db = MemoryDatabase(**DATABASE_OPTIONS)
+else:
+    db = Database(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, ensure_schema=True, **DATABASE_OPTIONS)
+recommender = RecommendationService(db)
+
+# Buffer like/follow toggles and write them in batches from a background thread
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "0") == "1"
+WRITE_BEHIND_BATCH_SIZE = 500
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+WRITE_BEHIND_MAX_ATTEMPTS = 5
+write_queue = WriteBehindQueue(db, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                               max_attempts=WRITE_BEHIND_MAX_ATTEMPTS) if WRITE_BEHIND_ENABLED else None
+
+# Keep live space membership in memory, expire members who stop sending heartbeats and write joins
+# and leaves in batches
+PRESENCE_ENABLED = os.environ.get("PRESENCE_ENABLED", "0") == "1"
+PRESENCE_TTL_SECONDS = 60
+PRESENCE_FLUSH_INTERVAL = 5.0
+presence = SpacePresence(db, ttl=PRESENCE_TTL_SECONDS,
+                         flush_interval=PRESENCE_FLUSH_INTERVAL) if PRESENCE_ENABLED else None
 
 
 @app.route("/", methods=["GET"])
 def index():
     username = session.get("username")
-    posts = db.get_all_posts()  # get all posts
-    return render_template("index.html", username=username, posts=posts)
+    feed = request.args.get("feed", "all")
+    cursor = request.args.get("cursor")
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    try:
+        if feed == "following" and username:
+            page = db.get_following_feed(username, limit=limit, cursor=cursor)
+        else:
+            feed = "all"
+            page = db.get_all_posts(limit=limit, cursor=cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Comments, counts and viewer state for the whole page in one query
+    details = db.hydrate_posts([post["post_id"] for post in page["posts"]], viewer=username)
+    for post in page["posts"]:
+        post.update(details.get(post["post_id"], {}))
+    if write_queue and username:
+        write_queue.overlay_posts(username, page["posts"])
+    return render_template("index.html", username=username, posts=page["posts"],
+                           next_cursor=page["next"], limit=limit, feed=feed)
 
 
 @app.route('/register', methods=['POST', 'GET'])
@@ -108,6 +173,8 @@ def toggle_like():
     data = request.get_json()
     post_id = data["post_id"]
     is_liked = data["is_liked"]
+    if write_queue:
+        return jsonify({"success": True, "is_liked": write_queue.set_like(username, post_id, is_liked)})
     try:
         if is_liked:
             db.like_post(username, post_id)
@@ -126,6 +193,9 @@ def toggle_follow():
     data = request.get_json()
     target_username = data["username"]
     is_following = data["is_following"]
+    if write_queue:
+        return jsonify({"success": True,
+                        "is_following": write_queue.set_follow(username, target_username, is_following)})
     try:
         if is_following:
             db.follow_user(username, target_username)
@@ -149,6 +219,8 @@ def profile(username):
 
     current_user = session.get("username")
     is_following = db.is_following(current_user, username) if current_user else False
+    if write_queue and current_user:
+        is_following, followers = write_queue.following_state(current_user, username, is_following, followers)
 
     return render_template("profile.html", user=user, posts=posts, reposts=reposts, following=following,
                            followers=followers, is_following=is_following)
@@ -174,29 +246,15 @@ def space():
 
     if not username:
         return redirect(url_for("login"))
-    # # Test Node similarity
-    # user_recommendations = db.recommend_spaces_using_similarity(username, top_n=5)
-
-    # 获取用户行为数据 这里开始是运行我设计的
-    user_posts = db.get_user_posts(username)
-    user_follows = db.get_following(username)
-    user_recommendations = []
-
-    # 根据不同用户情况选择推荐方式
-    if not user_posts and not user_follows:
-        # New users, with no behaviour or following anyone, return to the space of the latest release
-        user_recommendations = db.get_latest_spaces(top_n=5)
-    elif not user_posts and user_follows:
-        # Users with followers but no behaviours, recommending spaces that friends have participated in
-        user_recommendations = db.get_recommendations_from_friends(username, top_n=5)
-    else:
-        # Users with behavioural data, using behaviour-based recommendation logic
-        user_recommendations = db.recommend_spaces(username, top_n=5)
-
+    # Cold-start classification, candidates, scoring, filtering and hydration all live in the service
+    recommendations = recommender.recommend(username, top_n=5)
     topics = db.get_all_topics()
+    # Spaces this worker holds the user in; the page sends their heartbeats while it is open
+    present_in = presence.spaces_of(username) if presence else []
 
-
-    return render_template("space.html", username=username, topics=topics, spaces=user_recommendations)
+    return render_template("space.html", username=username, topics=topics, spaces=recommendations["spaces"],
+                           freshness=recommendations["computed_at"], present_in=present_in,
+                           heartbeat_ms=int(PRESENCE_TTL_SECONDS * 1000 / 3))
 
 
 @app.route('/create_space', methods=['POST'])
@@ -228,7 +286,10 @@ def join_space():
     space_id = request.form.get('space_id')
     role = request.form.get('role')
     try:
-        db.join_space(session['username'], space_id, role)
+        if presence:
+            presence.join(session['username'], space_id, role)
+        else:
+            db.join_space(session['username'], space_id, role)
         flash("Successfully joined the space!")
     except ValueError as e:
         flash(str(e))
@@ -241,13 +302,67 @@ def leave_space():
 
     space_id = request.form.get('space_id')
     try:
-        db.leave_space(session['username'], space_id)
+        # Memberships from before this worker started are still left through the graph
+        if not (presence and presence.leave(session['username'], space_id)):
+            db.leave_space(session['username'], space_id)
         flash("Successfully left the space!")
     except ValueError as e:
         flash(str(e))
     return redirect(url_for('space'))
 
 
+@app.route('/space/<space_id>/heartbeat', methods=['POST'])
+def space_heartbeat(space_id):
+    if 'username' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    if not presence:
+        return jsonify({"enabled": False})
+    # present=false means the member expired and should join again
+    return jsonify({"enabled": True, "present": presence.heartbeat(session['username'], space_id),
+                    "ttl": presence.ttl})
+
+
+@app.route('/space/<space_id>/presence', methods=['GET'])
+def space_presence(space_id):
+    # Live counts and participants straight from this worker's memory
+    if not presence:
+        return jsonify({"enabled": False})
+    return jsonify(dict(presence.counts(space_id), enabled=True, space_id=space_id,
+                        participants=presence.participants(space_id)))
+
+
+@app.route('/spaces', methods=['GET'])
+def space_directory():
+    # ?status=live|ended&topic=<name>&limit=<n>&cursor=<next from the previous page>
+    try:
+        page = db.list_spaces(username=session.get("username"), status=request.args.get("status"),
+                              topic=request.args.get("topic"),
+                              limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+                              cursor=request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
+
+
+@app.route('/space/<space_id>/similar', methods=['GET'])
+def similar_spaces(space_id):
+    # People who joined this space also joined these (see collaborative.py)
+    return jsonify(db.get_similar_spaces(space_id, top_n=5, username=session.get("username")))
+
+
+@app.route('/space/trending', methods=['GET'])
+def trending_spaces():
+    # Live spaces ranked by recent joins, current listeners and speakers (see trending.py)
+    username = session.get("username")
+    limit = min(request.args.get("limit", 10, type=int), db.trending.top_k)
+    ranked = db.trending.top(limit) or db.get_trending_snapshot(limit)
+    scores = {space_id: {'trending_score': value} for space_id, value in ranked}
+    # Counters on other workers (and older snapshots) may still rank a space that has since ended
+    return jsonify([space for space in db.hydrate_spaces([space_id for space_id, _ in ranked], viewer=username,
+                                                         extra=scores)
+                    if space['status'] != 'ended'])
+
+
 @app.route('/user_durations', methods=['GET'])
 def user_durations():
     if 'username' not in session:
@@ -267,6 +382,8 @@ def delete_space():
     print(f"Attempting to delete space with id: {space_id} for user: {username}")  # 调试输出
     try:
         db.delete_space(username, space_id)
+        if presence:
+            presence.close_space(space_id)
         print(f"Space {space_id} deleted successfully by user {username}")
         flash("Space deleted successfully.")
     except ValueError as e:
@@ -312,14 +429,74 @@ def end_space():
 
     space_id = request.form.get("space_id")
     try:
-        db.end_space(username, space_id)
-        flash("Space ended successfully.")
+        # Write buffered joins first so end_space finalizes those members too
+        if presence:
+            presence.flush()
+        stats = db.end_space(username, space_id)
+        if presence:
+            presence.close_space(space_id)
+        flash(f"Space ended successfully; {stats['members']} members finalized.")
     except ValueError as e:
         flash(str(e))
     return redirect(url_for("space"))
 
 
 
+def ndjson_response(records):
+    def generate():
+        for record in records:
+            yield json.dumps(record, default=str) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route('/export/posts', methods=['GET'])
+def export_posts():
+    if 'username' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    since = request.args.get("since", type=int)
+    return ndjson_response(db.export_posts(since=since))
+
+
+@app.route('/export/spaces', methods=['GET'])
+def export_spaces():
+    if 'username' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    since = request.args.get("since", type=int)
+    return ndjson_response(db.export_spaces(since=since))
+
+
+@app.route('/metrics/write_behind', methods=['GET'])
+def write_behind_metrics():
+    if not write_queue:
+        return jsonify({"enabled": False})
+    metrics = write_queue.metrics()
+    metrics["enabled"] = True
+    return jsonify(metrics)
+
+
+@app.route('/metrics/presence', methods=['GET'])
+def presence_metrics():
+    if not presence:
+        return jsonify({"enabled": False})
+    metrics = presence.metrics()
+    metrics["enabled"] = True
+    return jsonify(metrics)
+
+
+@app.route('/metrics/recommendation_cache', methods=['GET'])
+def recommendation_cache_metrics():
+    return jsonify(db.recommendation_cache.metrics())
+
+
+@app.route('/metrics/trending', methods=['GET'])
+def trending_metrics():
+    return jsonify(db.trending.metrics())
+
+
+@app.route('/metrics/recommendations', methods=['GET'])
+def recommendation_metrics():
+    return jsonify(recommender.metrics())
+
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5001, debug=True)
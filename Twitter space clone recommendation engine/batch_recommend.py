@@ -0,0 +1,122 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from models import Database
+from scoring import normalize_rows
+
+NEO4J_URI = "bolt://localhost:7687"
+NEO4J_USER = "neo4j"
+NEO4J_PASSWORD = "12345678"
+
+# Set once per worker process by the pool initializer, so the space matrix is shipped once
+worker_space_matrix = None
+
+
+def init_worker(space_matrix):
+    global worker_space_matrix
+    # Transposed once so every block is a sparse (users x topics) @ (topics x spaces) product
+    worker_space_matrix = space_matrix.T.tocsc()
+
+
+def score_block(user_block, excluded_rows, live_mask, top_n):
+    # One blocked multiplication; the product stays sparse, so memory follows the non-zeros
+    product = (user_block @ worker_space_matrix).tocsr()
+    results = []
+    for row in range(product.shape[0]):
+        start, end = product.indptr[row], product.indptr[row + 1]
+        columns = product.indices[start:end]
+        scores = product.data[start:end]
+        keep = live_mask[columns] & ~np.isin(columns, excluded_rows[row])
+        columns, scores = columns[keep], scores[keep]
+        if len(scores) > top_n:
+            best = np.argpartition(-scores, top_n - 1)[:top_n]
+            columns, scores = columns[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        results.append([(int(columns[i]), float(scores[i])) for i in order])
+    return results
+
+
+def load_users(db, topic_index, row_of):
+    # Decayed profiles and live memberships, each pulled in one streamed pass
+    usernames, user_row = [], {}
+    rows, columns, data = [], [], []
+    for record in db.iter_interest_profiles():
+        column = topic_index.get(record['topic'])
+        if column is None or not record['weight']:
+            continue
+        if record['username'] not in user_row:
+            user_row[record['username']] = len(usernames)
+            usernames.append(record['username'])
+        rows.append(user_row[record['username']])
+        columns.append(column)
+        data.append(record['weight'])
+    matrix = csr_matrix((np.array(data, dtype=np.float64), (np.array(rows, dtype=np.int32),
+                                                            np.array(columns, dtype=np.int32))),
+                        shape=(len(usernames), len(topic_index)))
+
+    excluded = [[] for _ in usernames]
+    for record in db.iter_user_space_memberships():
+        user = user_row.get(record['username'])
+        space = row_of.get(record['space_id'])
+        if user is not None and space is not None:
+            excluded[user].append(space)
+    return usernames, normalize_rows(matrix), [np.array(spaces, dtype=np.int64) for spaces in excluded]
+
+
+def run(db, top_n, block_size, workers, write_batch_size):
+    generation = int(time.time())
+    started = time.perf_counter()
+
+    space_matrix, space_ids, live_mask, topic_index, row_of = db.space_cache.snapshot()
+    usernames, user_matrix, excluded = load_users(db, topic_index, row_of)
+    print(f"Loaded {len(usernames)} users x {len(space_ids)} spaces in {time.perf_counter() - started:.1f}s")
+
+    written = 0
+    pending = []
+    computed_at = datetime.now().isoformat()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(space_matrix,)) as executor:
+        blocks = range(0, len(usernames), block_size)
+        futures = [executor.submit(score_block, user_matrix[start:start + block_size],
+                                   excluded[start:start + block_size], live_mask, top_n) for start in blocks]
+        for start, future in zip(blocks, futures):
+            for offset, recommendations in enumerate(future.result()):
+                for rank, (space_row, space_score) in enumerate(recommendations):
+                    pending.append({'username': usernames[start + offset], 'space_id': space_ids[space_row],
+                                    'score': space_score, 'rank': rank})
+            if len(pending) >= write_batch_size:
+                db.write_recommendations(pending, generation, computed_at)
+                written += len(pending)
+                pending = []
+    if pending:
+        db.write_recommendations(pending, generation, computed_at)
+        written += len(pending)
+
+    removed = db.prune_recommendations(generation)
+    elapsed = time.perf_counter() - started
+    print(f"Generation {generation}: wrote {written} recommendations, removed {removed} stale ones "
+          f"in {elapsed:.1f}s")
+    return generation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute top-N space recommendations for all active users.")
+    parser.add_argument("--uri", default=NEO4J_URI)
+    parser.add_argument("--user", default=NEO4J_USER)
+    parser.add_argument("--password", default=NEO4J_PASSWORD)
+    parser.add_argument("--top-n", type=int, default=20)
+    parser.add_argument("--block-size", type=int, default=1000, help="users per matrix multiplication")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--write-batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db = Database(args.uri, args.user, args.password)
+    run(db, args.top_n, args.block_size, args.workers, args.write_batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import math
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from collaborative import build_attendance_matrix, item_neighbours
+from memory_db import MemoryDatabase
+from models import CF_BLEND_WEIGHT, TRENDING_BLEND_WEIGHT
+from recommendation import RecommendationService
+
+HOUR = 3600
+DAY = 24 * HOUR
+ROLES = ["listener", "speaker", "moderator"]
+ROLE_ODDS = [0.8, 0.15, 0.05]
+
+
+def generate_graph(users=1000, spaces=200, topics=100, posts_per_user=5, follows_per_user=10,
+                   joins_per_user=4, likes_per_user=10, days=30, seed=42):
+    # Seeded synthetic graph. Every user has a few favourite topics drawn from a Zipf-like
+    # distribution; posts, follows and joins lean towards them so that recommendations are learnable.
+    rng = random.Random(seed)
+    topic_names = [f"topic{i}" for i in range(topics)]
+    topic_odds = [1.0 / (rank + 1) ** 1.1 for rank in range(topics)]
+    period = days * DAY
+
+    usernames = [f"user{i}" for i in range(users)]
+    favourites = {username: set(rng.choices(topic_names, topic_odds, k=rng.randint(1, 5))) for username in usernames}
+    fans = defaultdict(list)
+    for username, liked_topics in favourites.items():
+        for topic in liked_topics:
+            fans[topic].append(username)
+
+    follows = set()
+    for username in usernames:
+        for _ in range(rng.randint(0, 2 * follows_per_user)):
+            # Mostly people sharing a favourite topic, sometimes anyone
+            if rng.random() < 0.7:
+                target = rng.choice(fans[rng.choice(sorted(favourites[username]))])
+            else:
+                target = rng.choice(usernames)
+            if target != username:
+                follows.add((username, target))
+
+    posts = []
+    for username in usernames:
+        for _ in range(rng.randint(0, 2 * posts_per_user)):
+            tags = {rng.choice(sorted(favourites[username])) if rng.random() < 0.8 else
+                    rng.choices(topic_names, topic_odds)[0] for _ in range(rng.randint(1, 3))}
+            posts.append({'id': f"post{len(posts)}", 'username': username, 'tags': sorted(tags),
+                          'timestamp': rng.uniform(0, period)})
+
+    followees = defaultdict(list)
+    for username, target in sorted(follows):
+        followees[username].append(target)
+    posts_by = defaultdict(list)
+    for post in posts:
+        posts_by[post['username']].append(post)
+    likes = []
+    for username in usernames:
+        feed = [post for target in followees[username] for post in posts_by[target]]
+        for post in rng.sample(feed, min(len(feed), rng.randint(0, 2 * likes_per_user))):
+            likes.append({'username': username, 'post_id': post['id'],
+                          'timestamp': rng.uniform(post['timestamp'], period)})
+
+    space_rows = []
+    spaces_with = defaultdict(list)
+    for i in range(spaces):
+        space = {'id': f"space{i}", 'host': rng.choice(usernames),
+                 'topics': sorted(set(rng.choices(topic_names, topic_odds, k=rng.randint(1, 3)))),
+                 'created_at': rng.uniform(0, period * 0.7)}
+        space_rows.append(space)
+        for topic in space['topics']:
+            spaces_with[topic].append(space)
+
+    joins = []
+    joined_by = defaultdict(list)
+    for username in usernames:
+        seen = set()
+        for _ in range(rng.randint(0, 2 * joins_per_user)):
+            mode = rng.random()
+            if mode < 0.6:
+                options = spaces_with.get(rng.choice(sorted(favourites[username])))
+                space = rng.choice(options) if options else rng.choice(space_rows)
+            elif mode < 0.8 and followees[username]:
+                friend_spaces = joined_by.get(rng.choice(followees[username]))
+                space = rng.choice(friend_spaces) if friend_spaces else rng.choice(space_rows)
+            else:
+                space = rng.choice(space_rows)
+            if space['id'] in seen or space['host'] == username:
+                continue
+            seen.add(space['id'])
+            joined_at = rng.uniform(space['created_at'], period)
+            left_at = joined_at + rng.expovariate(1.0) * HOUR if rng.random() < 0.7 else None
+            joins.append({'username': username, 'space_id': space['id'],
+                          'role': rng.choices(ROLES, ROLE_ODDS)[0], 'joined_at': joined_at,
+                          'left_at': left_at if left_at is not None and left_at < period else None})
+            joined_by[username].append(space)
+
+    return {'users': usernames, 'follows': sorted(follows), 'posts': posts, 'likes': likes,
+            'spaces': space_rows, 'joins': joins, 'period': period}
+
+
+def temporal_split(graph, cutoff_fraction=0.8):
+    # Everything before the cutoff is training history; JOINED_AS edges after it are what we try to predict
+    cutoff = graph['period'] * cutoff_fraction
+    train = {
+        'now': cutoff,
+        'users': graph['users'],
+        'follows': graph['follows'],
+        'posts': [post for post in graph['posts'] if post['timestamp'] < cutoff],
+        'likes': [like for like in graph['likes'] if like['timestamp'] < cutoff],
+        'spaces': [space for space in graph['spaces'] if space['created_at'] < cutoff],
+        'joins': [dict(join, left_at=join['left_at'] if join['left_at'] and join['left_at'] < cutoff else None)
+                  for join in graph['joins'] if join['joined_at'] < cutoff],
+    }
+    known = {space['id'] for space in train['spaces']}
+    already = {(join['username'], join['space_id']) for join in train['joins']}
+    test = defaultdict(set)
+    for join in graph['joins']:
+        if (join['joined_at'] >= cutoff and join['space_id'] in known
+                and (join['username'], join['space_id']) not in already):
+            test[join['username']].add(join['space_id'])
+    return train, dict(test)
+
+
+def load_database(train, trending_window=DAY):
+    # The training history written through MemoryDatabase's bulk loaders, shifted so the split time
+    # is the moment of loading. Then the offline jobs the app relies on: profile rebuild, item-item
+    # neighbours (collaborative.py) and the trending warm-up a worker does on start. Likes are stamped
+    # at load time because like_posts_bulk takes no timestamp. The trending window is wider than the
+    # app's default because the synthetic graph has far fewer joins per hour.
+    shift = time.time() - train['now']
+
+    def iso(at):
+        return datetime.fromtimestamp(shift + at).isoformat()
+
+    db = MemoryDatabase(trending_window=trending_window, trending_bucket=HOUR)
+    db.create_users_bulk([{'username': username} for username in train['users']])
+    db.follow_users_bulk([{'username': username, 'target': target} for username, target in train['follows']],
+                         backfill=False)
+    db.add_posts_bulk([{'id': post['id'], 'username': post['username'], 'tags': post['tags'],
+                        'text': " ".join(f"#{tag}" for tag in post['tags']), 'timestamp': shift + post['timestamp']}
+                       for post in train['posts']], fan_out=False)
+    db.like_posts_bulk(train['likes'])
+    db.create_spaces_bulk([{'id': space['id'], 'host': space['host'], 'name': space['id'], 'topics': space['topics'],
+                            'created_at': iso(space['created_at'])} for space in train['spaces']])
+    db.join_spaces_bulk([{'username': join['username'], 'space_id': join['space_id'], 'role': join['role'],
+                          'joined_at': iso(join['joined_at']),
+                          'left_at': iso(join['left_at']) if join['left_at'] is not None else None}
+                         for join in train['joins']])
+    db.rebuild_user_profiles()
+    matrix, space_ids = build_attendance_matrix(db.iter_space_engagements())
+    db.write_space_similarities([{'space_id': space_ids[row], 'neighbour_id': space_ids[column], 'score': value}
+                                 for row, similar in item_neighbours(matrix) for column, value in similar],
+                                generation=0)
+    db.trending.warm(db.iter_recent_space_joins(iso(train['now'] - trending_window)))
+    return db
+
+
+def co_attendance_candidates(db):
+    # Item-CF scores on their own; the app only serves them blended into behaviour_candidates
+    def co_attendance_candidates(user, limit):
+        scores = db.get_item_cf_scores(user['username'], limit)
+        return {'co_attendance': scores} if scores else {}, {}
+    return co_attendance_candidates
+
+
+def service_strategy(source=None, cf_blend_weight=0.0, trending_blend_weight=0.0, space_index=False):
+    # A strategy is a RecommendationService over the loaded database with every state's sources
+    # replaced by `source(service)`; None keeps the app's per-state pipeline. run() skips the
+    # recommendation cache so each call does the full classify -> hydrate work.
+    def factory(db):
+        db.cf_blend_weight = cf_blend_weight
+        db.trending_blend_weight = trending_blend_weight
+        db.space_index = None
+        if space_index:
+            db.enable_space_index()
+            db.space_index.refresh()
+        db.space_cache.snapshot()
+        service = RecommendationService(db)
+        if source is not None:
+            service.sources = {state: [source(service)] for state in service.sources}
+
+        def recommend(username, k):
+            return [space['id'] for space in service.run(username, k)['spaces']]
+        return recommend
+    return factory
+
+
+# Each strategy takes the loaded database and returns recommend(username, k) -> [space_id]
+STRATEGIES = {
+    'latest': service_strategy(lambda service: service.latest_candidates),
+    'friends': service_strategy(lambda service: service.friend_candidates),
+    'topic': service_strategy(lambda service: service.behaviour_candidates),
+    'topic_lsh': service_strategy(lambda service: service.behaviour_candidates, space_index=True),
+    'co_attendance': service_strategy(lambda service: co_attendance_candidates(service.db)),
+    'trending': service_strategy(lambda service: service.trending_candidates),
+    'blend': service_strategy(lambda service: service.behaviour_candidates, cf_blend_weight=CF_BLEND_WEIGHT,
+                              trending_blend_weight=TRENDING_BLEND_WEIGHT),
+    'served': service_strategy(cf_blend_weight=CF_BLEND_WEIGHT, trending_blend_weight=TRENDING_BLEND_WEIGHT),
+}
+
+
+def evaluate(recommend, test, k):
+    # Mean recall@k and NDCG@k (binary relevance) over users with held-out joins
+    recall = ndcg = 0.0
+    for username, relevant in test.items():
+        ranked = recommend(username, k)
+        gains = [1.0 if space_id in relevant else 0.0 for space_id in ranked]
+        recall += sum(gains) / len(relevant)
+        ideal = sum(1.0 / math.log2(position + 2) for position in range(min(k, len(relevant))))
+        ndcg += sum(gain / math.log2(position + 2) for position, gain in enumerate(gains)) / ideal
+    return recall / len(test), ndcg / len(test)
+
+
+def measure(factory, db, queries, k):
+    # Build + query latency percentiles, then the same work again under tracemalloc for peak memory
+    started = time.perf_counter()
+    recommend = factory(db)
+    build_seconds = time.perf_counter() - started
+    latencies = []
+    for username in queries:
+        started = time.perf_counter()
+        recommend(username, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    recommend_traced = factory(db)
+    for username in queries:
+        recommend_traced(username, k)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return recommend, {'build_s': build_seconds, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                       'peak_mb': peak / (1024 * 1024)}
+
+
+def run(args):
+    for users in args.users:
+        graph = generate_graph(users=users, spaces=max(1, int(users * args.spaces_per_user)), topics=args.topics,
+                               posts_per_user=args.posts_per_user, follows_per_user=args.follows_per_user,
+                               joins_per_user=args.joins_per_user, days=args.days, seed=args.seed)
+        train, test = temporal_split(graph, args.cutoff)
+        started = time.perf_counter()
+        db = load_database(train)
+        load_seconds = time.perf_counter() - started
+        rng = random.Random(args.seed)
+        queries = rng.sample(graph['users'], min(args.queries, len(graph['users'])))
+        evaluated = dict(rng.sample(sorted(test.items()), min(args.eval_users, len(test))))
+        print(f"\n{users} users, {len(graph['spaces'])} spaces, {len(graph['posts'])} posts, "
+              f"{len(graph['joins'])} joins; {len(evaluated)} users with held-out joins; "
+              f"loaded in {load_seconds:.1f}s")
+        print(f"{'strategy':<14}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'peak MB':>9}"
+              f"{'recall@' + str(args.k):>11}{'ndcg@' + str(args.k):>9}")
+        for name in args.strategies:
+            recommend, timing = measure(STRATEGIES[name], db, queries, args.k)
+            recall, ndcg = evaluate(recommend, evaluated, args.k) if evaluated else (0.0, 0.0)
+            print(f"{name:<14}{timing['build_s']:>9.2f}{timing['p50_ms']:>9.3f}{timing['p95_ms']:>9.3f}"
+                  f"{timing['p99_ms']:>9.3f}{timing['peak_mb']:>9.1f}{recall:>11.3f}{ndcg:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and evaluate space recommendation strategies "
+                                                 "on a seeded synthetic graph.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000], help="graph sizes to run")
+    parser.add_argument("--spaces-per-user", type=float, default=0.2)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--posts-per-user", type=int, default=5)
+    parser.add_argument("--follows-per-user", type=int, default=10)
+    parser.add_argument("--joins-per-user", type=int, default=4)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--cutoff", type=float, default=0.8, help="fraction of the period used as history")
+    parser.add_argument("--strategies", nargs="+", choices=sorted(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument("--queries", type=int, default=500, help="users timed per strategy")
+    parser.add_argument("--eval-users", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import math
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+from models import Database, ROLE_WEIGHTS
+
+NEO4J_URI = "bolt://localhost:7687"
+NEO4J_USER = "neo4j"
+NEO4J_PASSWORD = "12345678"
+
+
+def engagement_weight(kind, role, hours):
+    # Role weight, damped by how long the user stayed so a quick drop-in still counts
+    role_weight = ROLE_WEIGHTS['host'] if kind == 'HOSTS' else ROLE_WEIGHTS.get(role, 1)
+    return role_weight * (1 + math.log1p(max(hours or 0, 0)))
+
+
+def build_attendance_matrix(engagements):
+    # Sparse user x space matrix; repeat sessions in the same space add up
+    user_row, space_column, space_ids = {}, {}, []
+    rows, columns, data = [], [], []
+    for record in engagements:
+        if record['username'] not in user_row:
+            user_row[record['username']] = len(user_row)
+        if record['space_id'] not in space_column:
+            space_column[record['space_id']] = len(space_ids)
+            space_ids.append(record['space_id'])
+        rows.append(user_row[record['username']])
+        columns.append(space_column[record['space_id']])
+        data.append(engagement_weight(record['kind'], record['role'], record['hours']))
+    matrix = csr_matrix((np.array(data, dtype=np.float64), (np.array(rows, dtype=np.int32),
+                                                            np.array(columns, dtype=np.int32))),
+                        shape=(len(user_row), len(space_ids)))
+    matrix.sum_duplicates()
+    return matrix, space_ids
+
+
+def item_neighbours(matrix, top_m=50, min_score=0.01, block_size=2000):
+    # Cosine item-item similarity truncated to the top-M neighbours per space, computed a
+    # block of spaces at a time so the full space x space product is never materialized
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    items = (matrix @ diags(1.0 / norms)).tocsc()
+    items_t = items.T.tocsr()
+    for start in range(0, items.shape[1], block_size):
+        block = (items_t[start:start + block_size] @ items).tocsr()
+        for offset in range(block.shape[0]):
+            row = start + offset
+            begin, end = block.indptr[offset], block.indptr[offset + 1]
+            columns, scores = block.indices[begin:end], block.data[begin:end]
+            keep = (columns != row) & (scores >= min_score)
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > top_m:
+                best = np.argpartition(-scores, top_m - 1)[:top_m]
+                columns, scores = columns[best], scores[best]
+            if len(scores):
+                yield row, list(zip(columns.tolist(), scores.tolist()))
+
+
+def run(db, top_m, min_score, block_size, write_batch_size):
+    generation = int(time.time())
+    started = time.perf_counter()
+    matrix, space_ids = build_attendance_matrix(db.iter_space_engagements())
+    print(f"Loaded {matrix.shape[0]} users x {matrix.shape[1]} spaces ({matrix.nnz} engagements) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    written = 0
+    pending = []
+    for row, neighbours in item_neighbours(matrix, top_m, min_score, block_size):
+        pending.extend({'space_id': space_ids[row], 'neighbour_id': space_ids[column], 'score': value}
+                       for column, value in neighbours)
+        if len(pending) >= write_batch_size:
+            db.write_space_similarities(pending, generation)
+            written += len(pending)
+            pending = []
+    if pending:
+        db.write_space_similarities(pending, generation)
+        written += len(pending)
+
+    removed = db.prune_generation("SIMILAR_SPACE", generation)
+    print(f"Generation {generation}: wrote {written} similarities, removed {removed} stale ones "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute item-item space similarities from co-attendance.")
+    parser.add_argument("--uri", default=NEO4J_URI)
+    parser.add_argument("--user", default=NEO4J_USER)
+    parser.add_argument("--password", default=NEO4J_PASSWORD)
+    parser.add_argument("--neighbours", type=int, default=50, help="similar spaces kept per space")
+    parser.add_argument("--min-score", type=float, default=0.01)
+    parser.add_argument("--block-size", type=int, default=2000)
+    parser.add_argument("--write-batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db = Database(args.uri, args.user, args.password)
+    run(db, args.neighbours, args.min_score, args.block_size, args.write_batch_size)
+
+
+if __name__ == "__main__":
+    main()
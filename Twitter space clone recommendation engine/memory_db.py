@@ -0,0 +1,1023 @@
+import heapq
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from models import (BaseDatabase, DEDUPE_RELATIONSHIPS, DEFAULT_PAGE_SIZE, END_SPACE_BATCH_SIZE, FEED_COMMENT_LIMIT,
+                    INTEREST_WEIGHTS, MAX_PAGE_SIZE, MEMBER_SAMPLE_SIZE, PRECOMPUTED_RELATIONSHIPS, ROLE_WEIGHTS,
+                    SPACE_ROLES, SPACE_STATUS_FILTERS, decode_cursor, encode_cursor)
+
+
+def seconds_since(iso, now):
+    return (now - datetime.fromisoformat(iso)).total_seconds()
+
+
+class MemoryDatabase(BaseDatabase):
+    # The Database interface over plain dicts, for tests, benchmarks and single-node demos.
+    # Nodes are dicts indexed by their unique key (username, post/comment/space id, topic name)
+    # and each relationship type is an adjacency dict, kept in both directions where a query
+    # walks it backwards. Results match the Cypher in models.Database row for row.
+    # One re-entrant lock serializes access; cache and index hooks run outside it because the
+    # space cache calls back into get_space_vectors while holding its own lock.
+
+    def __init__(self, **options):
+        self.lock = threading.RLock()
+        self.users = {}
+        self.posts = {}
+        self.comments = {}
+        self.spaces = {}
+        self.topics = set()
+        self.published = defaultdict(list)
+        self.reposted = defaultdict(list)
+        self.reposts_of = defaultdict(set)
+        self.post_comments = defaultdict(list)
+        self.likes = defaultdict(dict)
+        self.likers = defaultdict(set)
+        self.following = defaultdict(dict)
+        self.followers = defaultdict(set)
+        self.timelines = defaultdict(dict)
+        self.timeline_owners = defaultdict(set)
+        self.hosted = defaultdict(set)
+        self.members = defaultdict(dict)
+        self.joined = defaultdict(set)
+        self.departures = defaultdict(list)
+        self.interests = defaultdict(dict)
+        self.recommended = defaultdict(dict)
+        self.similar = defaultdict(dict)
+        self.trending_ranks = {}
+        self.catalogue_version = 0
+        super().__init__(**options)
+
+    def ensure_schema(self):
+        # Uniqueness is enforced by the dict keys
+        pass
+
+    # Users
+
+    def create_user(self, username, password, email):
+        self.create_users_bulk([{'username': username, 'password': password, 'email': email}])
+
+    def create_users_bulk(self, users):
+        with self.lock:
+            for user in users:
+                if user['username'] not in self.users:
+                    self.users[user['username']] = {
+                        'username': user['username'],
+                        'password': user.get('password', ''),
+                        'email': user.get('email', ''),
+                        'created_at': user.get('created_at') or datetime.now().isoformat()
+                    }
+
+    def user_exists(self, username):
+        return username in self.users
+
+    def find_user(self, username):
+        return self.users.get(username)
+
+    def get_user(self, username):
+        user = self.users.get(username)
+        return dict(user) if user else None
+
+    # Posts, timelines and feeds
+
+    def add_posts_bulk(self, posts, fan_out=True):
+        created = []
+        with self.lock:
+            for post in posts:
+                if post['username'] not in self.users:
+                    continue
+                now = datetime.fromtimestamp(int(post['timestamp'])) if post.get('timestamp') else datetime.now()
+                post_id = post.get('id') or str(uuid.uuid4())
+                tags = sorted({tag.strip("#") for tag in post.get('tags', ()) if tag.strip("#")})
+                self.posts[post_id] = {'id': post_id, 'text': post['text'], 'timestamp': int(now.timestamp()),
+                                       'date': now.strftime("%Y-%m-%d"), 'author': post['username'],
+                                       'repost': False, 'repost_of': None, 'topics': tags}
+                self.published[post['username']].append(post_id)
+                self.topics.update(tags)
+                created.append({'username': post['username'], 'post_id': post_id})
+
+        self.update_post_interests([dict(record, delta=INTEREST_WEIGHTS['post']) for record in created])
+        if fan_out and created:
+            self.fan_out_posts(created)
+        return [record['post_id'] for record in created]
+
+    def _authored(self, username):
+        # PUBLISHED_ON|REPOSTED
+        return self.published.get(username, []) + self.reposted.get(username, [])
+
+    def _add_to_timeline(self, owner, post_id):
+        self.timelines[owner][post_id] = self.posts[post_id]['timestamp']
+        self.timeline_owners[post_id].add(owner)
+
+    def _remove_from_timeline(self, owner, post_id):
+        self.timelines[owner].pop(post_id, None)
+        self.timeline_owners[post_id].discard(owner)
+
+    def _trim(self, owner):
+        entries = self.timelines.get(owner, {})
+        if len(entries) > self.timeline_max_length:
+            newest = heapq.nlargest(self.timeline_max_length, entries.items(), key=lambda item: (item[1], item[0]))
+            for post_id in set(entries) - {post_id for post_id, _ in newest}:
+                self._remove_from_timeline(owner, post_id)
+
+    def fan_out_posts(self, items):
+        with self.lock:
+            for item in items:
+                if item['username'] not in self.users or item['post_id'] not in self.posts:
+                    continue
+                self._add_to_timeline(item['username'], item['post_id'])
+                if len(self.followers[item['username']]) <= self.celebrity_threshold:
+                    for follower in self.followers[item['username']]:
+                        self._add_to_timeline(follower, item['post_id'])
+        self.trim_timelines(sorted({item['username'] for item in items}))
+
+    def trim_timelines(self, usernames):
+        with self.lock:
+            owners = set()
+            for username in usernames:
+                if username in self.users:
+                    owners.add(username)
+                    owners.update(self.followers[username])
+            for owner in owners:
+                self._trim(owner)
+
+    def backfill_timeline(self, username, target_username):
+        with self.lock:
+            if username not in self.users or target_username not in self.users:
+                return
+            if len(self.followers[target_username]) <= self.celebrity_threshold:
+                newest = heapq.nlargest(self.timeline_max_length, self._authored(target_username),
+                                        key=lambda post_id: self.posts[post_id]['timestamp'])
+                for post_id in newest:
+                    if post_id not in self.timelines[username]:
+                        self._add_to_timeline(username, post_id)
+            self._trim(username)
+
+    def remove_from_timeline(self, username, target_username):
+        with self.lock:
+            for post_id in self._authored(target_username):
+                self._remove_from_timeline(username, post_id)
+
+    def _page(self, post_ids, after_ts, after_id, fetch):
+        # Newest first on (timestamp, id), strictly after the cursor
+        keyed = ((self.posts[post_id]['timestamp'], post_id) for post_id in post_ids)
+        if after_ts is not None:
+            keyed = (key for key in keyed if key < (after_ts, after_id))
+        return [post_id for _, post_id in heapq.nlargest(fetch, keyed)]
+
+    def _feed_row(self, post_id):
+        post = self.posts[post_id]
+        return {'username': post['author'], 'post_id': post_id, 'text': post['text'], 'date': post['date'],
+                'timestamp': post['timestamp'], 'topics': list(post['topics'])}
+
+    def _original_author(self, post):
+        original = self.posts.get(post['repost_of']) if post['repost_of'] else None
+        return original['author'] if original and not original['repost'] else None
+
+    def get_following_feed(self, username, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after_ts, after_id = decode_cursor(cursor) if cursor else (None, None)
+        fetch = limit + 1
+        with self.lock:
+            candidates = set(self._page(self.timelines.get(username, {}), after_ts, after_id, fetch))
+            for followee in self.following.get(username, {}):
+                if len(self.followers[followee]) > self.celebrity_threshold:
+                    candidates.update(self._page(self._authored(followee), after_ts, after_id, fetch))
+            posts = []
+            for post_id in self._page(candidates, None, None, fetch):
+                row = self._feed_row(post_id)
+                row['original_username'] = self._original_author(self.posts[post_id])
+                posts.append(row)
+
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1]['timestamp'], posts[-1]['post_id'])
+        return {'posts': posts, 'next': next_cursor}
+
+    def get_all_posts(self, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after_ts, after_id = decode_cursor(cursor) if cursor else (None, None)
+        with self.lock:
+            published = (post_id for post_id, post in self.posts.items() if not post['repost'])
+            posts = [self._feed_row(post_id) for post_id in self._page(published, after_ts, after_id, limit + 1)]
+
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1]['timestamp'], posts[-1]['post_id'])
+        return {'posts': posts, 'next': next_cursor}
+
+    def get_user_posts(self, username):
+        with self.lock:
+            posts = sorted((self.posts[post_id] for post_id in self.published.get(username, [])),
+                           key=lambda post: -post['timestamp'])
+            return [{'post_id': post['id'], 'text': post['text'], 'date': post['date']} for post in posts]
+
+    def add_comment(self, username, post_id, comment_text):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            if post_id not in self.posts:
+                raise ValueError("Post not found")
+            now = datetime.now()
+            comment_id = str(uuid.uuid4())
+            self.comments[comment_id] = {'id': comment_id, 'text': comment_text, 'timestamp': int(now.timestamp()),
+                                         'date': now.strftime("%Y-%m-%d %H:%M:%S"), 'username': username,
+                                         'post_id': post_id}
+            self.post_comments[post_id].append(comment_id)
+
+    def _comments_on(self, post_id):
+        return sorted((self.comments[comment_id] for comment_id in self.post_comments.get(post_id, [])),
+                      key=lambda comment: comment['timestamp'])
+
+    def get_comments(self, post_id):
+        with self.lock:
+            return [{'username': comment['username'], 'text': comment['text'], 'date': comment['date']}
+                    for comment in self._comments_on(post_id)]
+
+    def hydrate_posts(self, post_ids, viewer=None, comment_limit=FEED_COMMENT_LIMIT):
+        hydrated = {}
+        with self.lock:
+            known_viewer = viewer in self.users
+            for post_id in post_ids:
+                post = self.posts.get(post_id)
+                if post is None:
+                    continue
+                hydrated[post_id] = {
+                    'post_id': post_id,
+                    'comments': [{'id': comment['id'], 'username': comment['username'], 'text': comment['text'],
+                                  'date': comment['date']} for comment in self._comments_on(post_id)[:comment_limit]],
+                    'comment_count': len(self.post_comments.get(post_id, [])),
+                    'like_count': len(self.likers.get(post_id, ())),
+                    'repost_count': len(self.reposts_of.get(post_id, ())),
+                    'viewer_liked': known_viewer and post_id in self.likes[viewer],
+                    'viewer_follows_author': known_viewer and post['author'] in self.following[viewer],
+                }
+        return hydrated
+
+    def repost_post(self, username, post_id):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            original = self.posts.get(post_id)
+            if original is None:
+                raise ValueError("Post not found")
+            now = datetime.now()
+            repost_id = str(uuid.uuid4())
+            self.posts[repost_id] = {'id': repost_id, 'text': original['text'], 'timestamp': int(now.timestamp()),
+                                     'date': now.strftime("%Y-%m-%d"), 'author': username, 'repost': True,
+                                     'repost_of': post_id, 'topics': []}
+            self.reposted[username].append(repost_id)
+            self.reposts_of[post_id].add(repost_id)
+        self.update_post_interests([{'username': username, 'post_id': repost_id,
+                                     'delta': INTEREST_WEIGHTS['repost']}])
+        self.fan_out_post(username, repost_id)
+
+    def get_user_reposts(self, username):
+        with self.lock:
+            rows = []
+            for repost_id in sorted(self.reposted.get(username, []), key=lambda post_id: -self.posts[post_id]['timestamp']):
+                repost = self.posts[repost_id]
+                original = self.posts.get(repost['repost_of']) if repost['repost_of'] else None
+                if original is None or original['repost']:
+                    continue
+                rows.append({'post_id': original['id'], 'text': original['text'], 'original_date': original['date'],
+                             'repost_date': repost['date'], 'original_username': original['author']})
+            return rows
+
+    def delete_post(self, username, post_id):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            post = self.posts.get(post_id)
+            if post is None:
+                raise ValueError("Post not found")
+            if post['repost'] or post['author'] != username:
+                raise ValueError("User is not the author of this post")
+
+            # DETACH DELETE: the post and every edge touching it
+            del self.posts[post_id]
+            self.published[username].remove(post_id)
+            for liker in self.likers.pop(post_id, ()):
+                self.likes[liker].pop(post_id, None)
+            for owner in self.timeline_owners.pop(post_id, ()):
+                self.timelines[owner].pop(post_id, None)
+            for comment_id in self.post_comments.pop(post_id, []):
+                self.comments.pop(comment_id, None)
+            for repost_id in self.reposts_of.pop(post_id, ()):
+                self.posts[repost_id]['repost_of'] = None
+
+    def delete_comment(self, username, comment_id):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            comment = self.comments.get(comment_id)
+            if comment is None:
+                raise ValueError("Comment not found")
+            if comment['username'] != username:
+                raise ValueError("User is not the author of this comment")
+            del self.comments[comment_id]
+            self.post_comments[comment['post_id']].remove(comment_id)
+
+    def export_posts(self, since=None):
+        with self.lock:
+            rows = [{'post_id': post['id'], 'username': post['author'], 'text': post['text'], 'date': post['date'],
+                     'timestamp': post['timestamp'], 'repost_of': post['repost_of'], 'topics': list(post['topics'])}
+                    for post in self.posts.values() if since is None or post['timestamp'] >= since]
+        yield from rows
+
+    def get_all_topics(self):
+        with self.lock:
+            return sorted(self.topics)
+
+    # Likes and follows
+
+    def like_post(self, username, post_id):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            if post_id not in self.posts:
+                raise ValueError("Post not found")
+            created = post_id not in self.likes[username]
+            if created:
+                self.likes[username][post_id] = datetime.now().isoformat()
+                self.likers[post_id].add(username)
+        if created:
+            self.update_post_interests([{'username': username, 'post_id': post_id,
+                                         'delta': INTEREST_WEIGHTS['like']}])
+
+    def unlike_post(self, username, post_id):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            if post_id not in self.posts:
+                raise ValueError("Post not found")
+            removed = self.likes[username].pop(post_id, None) is not None
+            self.likers[post_id].discard(username)
+        if removed:
+            self.update_post_interests([{'username': username, 'post_id': post_id,
+                                         'delta': -INTEREST_WEIGHTS['like']}])
+
+    def like_posts_bulk(self, rows):
+        created = []
+        with self.lock:
+            now = datetime.now().isoformat()
+            for row in rows:
+                if (row['username'] in self.users and row['post_id'] in self.posts
+                        and row['post_id'] not in self.likes[row['username']]):
+                    self.likes[row['username']][row['post_id']] = now
+                    self.likers[row['post_id']].add(row['username'])
+                    created.append({'username': row['username'], 'post_id': row['post_id']})
+        self.update_post_interests([dict(record, delta=INTEREST_WEIGHTS['like']) for record in created])
+
+    def unlike_posts_bulk(self, rows):
+        removed = []
+        with self.lock:
+            for row in rows:
+                if self.likes.get(row['username'], {}).pop(row['post_id'], None) is not None:
+                    self.likers[row['post_id']].discard(row['username'])
+                    removed.append({'username': row['username'], 'post_id': row['post_id']})
+        self.update_post_interests([dict(record, delta=-INTEREST_WEIGHTS['like']) for record in removed])
+
+    def _follow(self, username, target_username, now):
+        if target_username not in self.following[username]:
+            self.following[username][target_username] = now
+            self.followers[target_username].add(username)
+
+    def follow_user(self, username, target_username):
+        with self.lock:
+            if username not in self.users or target_username not in self.users:
+                raise ValueError("User not found")
+            self._follow(username, target_username, datetime.now().isoformat())
+        self.bump_user_activity([username])
+        self.backfill_timeline(username, target_username)
+
+    def unfollow_user(self, username, target_username):
+        with self.lock:
+            if username not in self.users or target_username not in self.users:
+                raise ValueError("User not found")
+            self.following[username].pop(target_username, None)
+            self.followers[target_username].discard(username)
+        self.bump_user_activity([username])
+        self.remove_from_timeline(username, target_username)
+
+    def follow_users_bulk(self, rows, backfill=True):
+        if not rows:
+            return
+        with self.lock:
+            now = datetime.now().isoformat()
+            for row in rows:
+                if row['username'] in self.users and row['target'] in self.users:
+                    self._follow(row['username'], row['target'], now)
+        self.bump_user_activity(row['username'] for row in rows)
+        if backfill:
+            for row in rows:
+                self.backfill_timeline(row['username'], row['target'])
+
+    def unfollow_users_bulk(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            for row in rows:
+                self.following.get(row['username'], {}).pop(row['target'], None)
+                self.followers.get(row['target'], set()).discard(row['username'])
+        self.bump_user_activity(row['username'] for row in rows)
+        for row in rows:
+            self.remove_from_timeline(row['username'], row['target'])
+
+    def get_following(self, username):
+        with self.lock:
+            return list(self.following.get(username, {}))
+
+    def get_followers(self, username):
+        with self.lock:
+            return list(self.followers.get(username, ()))
+
+    def is_following(self, username, target_username):
+        with self.lock:
+            return target_username in self.following.get(username, {})
+
+    def dedupe_relationships(self, rel_type, batch_size=10000):
+        # Adjacency dicts cannot hold parallel edges
+        if rel_type not in DEDUPE_RELATIONSHIPS:
+            raise ValueError(f"Unsupported relationship type: {rel_type}")
+        return 0
+
+    # Spaces
+
+    def create_spaces_bulk(self, spaces):
+        rows = [{
+            'host': space['host'],
+            'id': space.get('id') or str(uuid.uuid4()),
+            'name': space['name'],
+            'description': space.get('description', ''),
+            'created_at': space.get('created_at') or datetime.now().isoformat(),
+            'status': space.get('status'),
+            'ended_at': space.get('ended_at') if space.get('status') == 'ended' else None,
+            'topics': sorted(set(space.get('topics', ())))
+        } for space in spaces]
+        if not rows:
+            return []
+        # Ended spaces with an ended_at get the host edge end_space would have written
+        for row in rows:
+            row['host_duration'] = ((datetime.fromisoformat(row['ended_at']) -
+                                     datetime.fromisoformat(row['created_at'])).total_seconds()
+                                    if row['ended_at'] else None)
+
+        space_ids = []
+        with self.lock:
+            for row in rows:
+                if row['host'] not in self.users:
+                    continue
+                self.spaces[row['id']] = dict(row, host_left_at=row['ended_at'])
+                self._reset_counters(self.spaces[row['id']])
+                self.hosted[row['host']].add(row['id'])
+                self.topics.update(row['topics'])
+                space_ids.append(row['id'])
+        self._spaces_created(rows, set(space_ids))
+        return space_ids
+
+    def join_spaces_bulk(self, memberships):
+        with self.lock:
+            for membership in memberships:
+                username, space_id = membership['username'], membership['space_id']
+                if username not in self.users or space_id not in self.spaces:
+                    continue
+                role = membership.get('role', 'listener')
+                joined_at = membership.get('joined_at') or datetime.now().isoformat()
+                left_at = membership.get('left_at')
+                if left_at:
+                    self.departures[username].append({
+                        'space_id': space_id, 'role': role, 'joined_at': joined_at, 'left_at': left_at,
+                        'duration': (datetime.fromisoformat(left_at) - datetime.fromisoformat(joined_at)).total_seconds()
+                    })
+                elif username not in self.members[space_id] and self.spaces[space_id]['status'] != 'ended':
+                    self.members[space_id][username] = {'role': role, 'joined_at': joined_at}
+                    self.joined[username].add(space_id)
+                    self._count_join(self.spaces[space_id], username, role)
+        self.bump_user_activity(membership['username'] for membership in memberships)
+
+    def leave_spaces_bulk(self, rows):
+        left = []
+        with self.lock:
+            for row in rows:
+                username, space_id = row['username'], row['space_id']
+                membership = self.members.get(space_id, {}).pop(username, None)
+                if membership is None:
+                    continue
+                self.joined[username].discard(space_id)
+                self._count_leave(self.spaces[space_id], username, membership['role'])
+                duration = (datetime.fromisoformat(row['left_at']) -
+                            datetime.fromisoformat(membership['joined_at'])).total_seconds()
+                self.departures[username].append({'space_id': space_id, 'role': membership['role'],
+                                                  'joined_at': membership['joined_at'],
+                                                  'left_at': row['left_at'], 'duration': duration})
+                left.append({'username': username, 'space_id': space_id, 'role': membership['role'],
+                             'duration': duration})
+        self.bump_user_activity(row['username'] for row in rows)
+        return left
+
+    def _reset_counters(self, space):
+        space.update(member_count=0, member_sample=[], **{f"{role}_count": 0 for role in SPACE_ROLES})
+
+    def _count_join(self, space, username, role):
+        space['member_count'] += 1
+        if role in SPACE_ROLES:
+            space[f"{role}_count"] += 1
+        if len(space['member_sample']) < MEMBER_SAMPLE_SIZE:
+            space['member_sample'].append(username)
+
+    def _count_leave(self, space, username, role):
+        space['member_count'] = max(space['member_count'] - 1, 0)
+        if role in SPACE_ROLES:
+            space[f"{role}_count"] = max(space[f"{role}_count"] - 1, 0)
+        space['member_sample'] = [name for name in space['member_sample'] if name != username]
+
+    def list_spaces(self, username=None, status=None, topic=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        if status is not None and status not in SPACE_STATUS_FILTERS:
+            raise ValueError(f"Unknown space status filter: {status}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after = decode_cursor(cursor, str) if cursor else None
+        with self.lock:
+            matching = ((space['created_at'], space['id']) for space in self.spaces.values()
+                        if (status is None or (space['status'] == 'ended') == (status == 'ended'))
+                        and (topic is None or topic in space['topics']))
+            if after is not None:
+                matching = (key for key in matching if key < after)
+            spaces = []
+            for _, space_id in heapq.nlargest(limit + 1, matching):
+                space = self.spaces[space_id]
+                spaces.append({
+                    'id': space_id, 'name': space['name'], 'description': space['description'],
+                    'created_at': space['created_at'], 'status': space['status'], 'host': space['host'],
+                    'topics': list(space['topics']), 'member_count': space['member_count'],
+                    'listener_count': space['listener_count'], 'speaker_count': space['speaker_count'],
+                    'moderator_count': space['moderator_count'], 'member_sample': list(space['member_sample']),
+                    'is_member': username in self.members.get(space_id, {}),
+                    'is_host': username is not None and space['host'] == username,
+                })
+
+        next_cursor = None
+        if len(spaces) > limit:
+            spaces = spaces[:limit]
+            next_cursor = encode_cursor(spaces[-1]['created_at'], spaces[-1]['id'])
+        return {'spaces': spaces, 'next': next_cursor}
+
+    def rebuild_space_counters(self, batch_size=1000):
+        with self.lock:
+            for space_id, space in self.spaces.items():
+                self._reset_counters(space)
+                if space['status'] != 'ended':
+                    for member, membership in self.members[space_id].items():
+                        self._count_join(space, member, membership['role'])
+            return len(self.spaces)
+
+    def export_spaces(self, since=None):
+        since_iso = datetime.fromtimestamp(since).isoformat() if since is not None else None
+        with self.lock:
+            rows = [{'id': space['id'], 'name': space['name'], 'description': space['description'],
+                     'created_at': space['created_at'], 'status': space['status'], 'host': space['host'],
+                     'topics': list(space['topics'])}
+                    for space in self.spaces.values() if since_iso is None or space['created_at'] >= since_iso]
+        yield from rows
+
+    def is_member_of_space(self, username, space_id):
+        with self.lock:
+            return username in self.members.get(space_id, {})
+
+    def _check_host(self, username, space_id):
+        if username not in self.users:
+            raise ValueError("User not found")
+        space = self.spaces.get(space_id)
+        if space is None:
+            raise ValueError("Space not found")
+        if space['host'] != username:
+            raise ValueError(f"User {username} is not the host of space with id: {space_id}")
+        return space
+
+    def delete_space(self, username, space_id):
+        with self.lock:
+            self._check_host(username, space_id)
+            del self.spaces[space_id]
+            self.hosted[username].discard(space_id)
+            for member in self.members.pop(space_id, {}):
+                self.joined[member].discard(space_id)
+            for departures in self.departures.values():
+                departures[:] = [departure for departure in departures if departure['space_id'] != space_id]
+            for recommended in self.recommended.values():
+                recommended.pop(space_id, None)
+            self.similar.pop(space_id, None)
+            self.trending_ranks.pop(space_id, None)
+            for neighbours in self.similar.values():
+                neighbours.pop(space_id, None)
+        self._space_deleted(space_id)
+
+    def join_space(self, username, space_id, role):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            if space_id not in self.spaces:
+                raise ValueError("Space not found")
+            if self.spaces[space_id]['status'] == 'ended':
+                raise ValueError("Space has ended")
+            created = username not in self.members[space_id]
+            if created:
+                self.members[space_id][username] = {'role': role, 'joined_at': datetime.now().isoformat()}
+                self.joined[username].add(space_id)
+                self._count_join(self.spaces[space_id], username, role)
+        if created:
+            self.update_space_interests([{'username': username, 'space_id': space_id,
+                                          'delta': ROLE_WEIGHTS.get(role, 1) * INTEREST_WEIGHTS['join']}])
+            self._space_joined(space_id, role)
+
+    def leave_space(self, username, space_id):
+        with self.lock:
+            if username not in self.users:
+                raise ValueError("User not found")
+            if space_id not in self.spaces:
+                raise ValueError("Space not found")
+            membership = self.members[space_id].pop(username, None)
+            if membership is None:
+                return
+            self.joined[username].discard(space_id)
+            self._count_leave(self.spaces[space_id], username, membership['role'])
+            left_at = datetime.now()
+            duration = (left_at - datetime.fromisoformat(membership['joined_at'])).total_seconds()
+            self.departures[username].append({'space_id': space_id, 'role': membership['role'],
+                                              'joined_at': membership['joined_at'],
+                                              'left_at': left_at.isoformat(), 'duration': duration})
+        self.update_space_interests([{'username': username, 'space_id': space_id,
+                                      'delta': ROLE_WEIGHTS.get(membership['role'], 1) * duration / 3600}])
+        self._space_left(space_id, membership['role'])
+
+    def end_space(self, username, space_id, batch_size=END_SPACE_BATCH_SIZE):
+        # One critical section, so every space ends atomically here; batch_size only matters to Neo4j.
+        # Members move to the LEFT_AS shape and the host's edge gets the same ISO left_at and seconds.
+        with self.lock:
+            space = self._check_host(username, space_id)
+            if not space['created_at']:
+                raise ValueError(f"Space {space_id} does not have a valid created_at time")
+            now = datetime.now()
+            first = space['host_left_at'] is None
+            if first:
+                space['host_left_at'] = now.isoformat()
+                space['host_duration'] = seconds_since(space['created_at'], now)
+            space['ended_at'] = space.get('ended_at') or now.isoformat()
+            space['status'] = 'ended'
+            self._reset_counters(space)
+            members = self._finalize_members(space_id, datetime.fromisoformat(space['ended_at']))
+            stats = {'space_id': space_id, 'ended_at': space['ended_at'], 'host_duration': space['host_duration'],
+                     'members': len(members), 'batches': 1, 'resumed': not first}
+        self._space_ended(space_id)
+        engagement = [{'username': username, 'space_id': space_id,
+                       'delta': ROLE_WEIGHTS['host'] * space['host_duration'] / 3600}] if first else []
+        engagement += [{'username': member, 'space_id': space_id,
+                        'delta': ROLE_WEIGHTS.get(role, 1) * seconds / 3600} for member, role, seconds in members]
+        self.update_space_interests(engagement)
+        return stats
+
+    def _finalize_members(self, space_id, left_at):
+        finalized = []
+        for member, membership in self.members.pop(space_id, {}).items():
+            self.joined[member].discard(space_id)
+            seconds = (left_at - datetime.fromisoformat(membership['joined_at'])).total_seconds()
+            self.departures[member].append({'space_id': space_id, 'role': membership['role'],
+                                            'joined_at': membership['joined_at'], 'left_at': left_at.isoformat(),
+                                            'duration': seconds})
+            finalized.append((member, membership['role'], seconds))
+        return finalized
+
+    def finish_ended_spaces(self, batch_size=END_SPACE_BATCH_SIZE):
+        # end_space cannot stop half-way here, so there is never anything to finish
+        return {'hosts': 0, 'spaces': 0, 'members': 0}
+
+    def get_user_space_durations(self, username):
+        with self.lock:
+            now = datetime.now()
+            rows = []
+            for space_id in self.joined.get(username, ()):
+                membership = self.members[space_id][username]
+                rows.append({'space_name': self.spaces[space_id]['name'], 'role': membership['role'],
+                             'duration': seconds_since(membership['joined_at'], now),
+                             'joined_at': membership['joined_at'], 'left_at': None,
+                             'relationship_type': 'JOINED_AS'})
+            for space_id in self.hosted.get(username, ()):
+                space = self.spaces[space_id]
+                rows.append({'space_name': space['name'], 'role': None,
+                             'duration': space['host_duration'] if space['host_left_at'] is not None
+                             else seconds_since(space['created_at'], now),
+                             'joined_at': space['created_at'], 'left_at': space['host_left_at'],
+                             'relationship_type': 'HOSTS'})
+            for departure in self.departures.get(username, []):
+                rows.append({'space_name': self.spaces[departure['space_id']]['name'], 'role': departure['role'],
+                             'duration': departure['duration'], 'joined_at': departure['joined_at'],
+                             'left_at': departure['left_at'], 'relationship_type': 'LEFT_AS'})
+            return rows
+
+    def _live(self, space_id):
+        space = self.spaces.get(space_id)
+        return space is not None and space['status'] != 'ended'
+
+    def get_space_vectors(self, username=None):
+        with self.lock:
+            mine = self.get_user_space_ids(username) if username is not None else set()
+            return [{'id': space['id'], 'name': space['name'], 'status': space['status'],
+                     'topics': list(space['topics'])}
+                    for space in self.spaces.values()
+                    if space['topics'] and (username is None or (space['status'] != 'ended'
+                                                                 and space['id'] not in mine))]
+
+    def get_space_catalogue_version(self):
+        return self.catalogue_version
+
+    def bump_space_catalogue_version(self):
+        with self.lock:
+            self.catalogue_version += 1
+            version = self.catalogue_version
+        self.recommendation_cache.set_catalogue_version(version)
+        return version
+
+    def get_user_space_ids(self, username):
+        with self.lock:
+            return self.joined.get(username, set()) | self.hosted.get(username, set())
+
+    def hydrate_spaces(self, space_ids, viewer=None, extra=None):
+        spaces = []
+        with self.lock:
+            known_viewer = viewer in self.users
+            for space_id in space_ids:
+                space = self.spaces.get(space_id)
+                if space is None:
+                    continue
+                hydrated = {
+                    'id': space_id, 'name': space['name'],
+                    'description': space['description'] or 'No description available',
+                    'created_at': space['created_at'] or 'Unknown', 'status': space['status'] or 'alive',
+                    'host': space['host'] or 'Unknown', 'member_count': space['member_count'],
+                    'is_member': known_viewer and viewer in self.members.get(space_id, {}),
+                    'is_host': space['host'] is not None and space['host'] == viewer,
+                }
+                hydrated.update((extra or {}).get(space_id, {}))
+                spaces.append(hydrated)
+        return spaces
+
+    def get_latest_space_ids(self, top_n=5):
+        with self.lock:
+            return [space['id'] for space in heapq.nlargest(top_n, self.spaces.values(),
+                                                            key=lambda space: space['created_at'] or '')]
+
+    def get_friend_space_ids(self, username, top_n=5):
+        with self.lock:
+            found = {space_id for followee in self.following.get(username, {})
+                     for space_id in self.joined.get(followee, ())}
+            return heapq.nlargest(top_n, found, key=lambda space_id: self.spaces[space_id]['created_at'] or '')
+
+    def get_similar_spaces(self, space_id, top_n=5, username=None):
+        with self.lock:
+            neighbours = [(neighbour, edge['score']) for neighbour, edge in self.similar.get(space_id, {}).items()
+                          if self._live(neighbour)]
+        best = heapq.nlargest(top_n, neighbours, key=lambda pair: pair[1])
+        scores = {neighbour: {'similarity': value} for neighbour, value in best}
+        return self.hydrate_spaces([neighbour for neighbour, _ in best], viewer=username, extra=scores)
+
+    # Interest profiles
+
+    def _credit(self, totals, now):
+        # INTEREST_UPDATE: deltas summed per (user, topic), then decay the stored score to now, add, clamp at zero
+        for (username, topic), delta in totals.items():
+            profile = self.interests[username]
+            score, updated_at = profile.get(topic, (0.0, now))
+            score = score * 0.5 ** ((now - updated_at) / self.interest_half_life) + delta
+            profile[topic] = (score if score > 0 else 0.0, now)
+
+    def _post_topics(self, post_id):
+        # (:Post)-[:REPOST_OF*0..1]->(:Post)-[:HAS_TOPIC]->(t)
+        post = self.posts[post_id]
+        topics = list(post['topics'])
+        if post['repost_of'] in self.posts:
+            topics += self.posts[post['repost_of']]['topics']
+        return topics
+
+    def update_post_interests(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            totals = defaultdict(float)
+            for row in rows:
+                if row['username'] in self.users and row['post_id'] in self.posts:
+                    for topic in self._post_topics(row['post_id']):
+                        totals[(row['username'], topic)] += row['delta']
+            self._credit(totals, datetime.now().timestamp())
+        self.bump_user_activity(row['username'] for row in rows)
+
+    def update_space_interests(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            totals = defaultdict(float)
+            for row in rows:
+                if row['username'] in self.users and row['space_id'] in self.spaces:
+                    for topic in self.spaces[row['space_id']]['topics']:
+                        totals[(row['username'], topic)] += row['delta']
+            self._credit(totals, datetime.now().timestamp())
+        self.bump_user_activity(row['username'] for row in rows)
+
+    def _decayed(self, username, now):
+        for topic, (score, updated_at) in self.interests.get(username, {}).items():
+            yield topic, score * 0.5 ** ((now - updated_at) / self.interest_half_life)
+
+    def get_user_interest_profile(self, username):
+        with self.lock:
+            return {topic: weight for topic, weight in self._decayed(username, datetime.now().timestamp())
+                    if weight > 0}
+
+    def iter_interest_profiles(self):
+        with self.lock:
+            now = datetime.now().timestamp()
+            rows = [{'username': username, 'topic': topic, 'weight': weight}
+                    for username in list(self.interests) for topic, weight in self._decayed(username, now)]
+        yield from rows
+
+    def calculate_user_topic_vector(self, username):
+        with self.lock:
+            now = datetime.now()
+            vector = defaultdict(float)
+            for space_id in self.joined.get(username, ()):
+                membership = self.members[space_id][username]
+                hours = seconds_since(membership['joined_at'], now) / 3600
+                for topic in self.spaces[space_id]['topics']:
+                    vector[topic] += ROLE_WEIGHTS.get(membership['role'], 1.0) * hours
+            for departure in self.departures.get(username, []):
+                hours = (departure['duration'] or 0) / 3600
+                for topic in self.spaces[departure['space_id']]['topics']:
+                    vector[topic] += ROLE_WEIGHTS.get(departure['role'], 1.0) * hours
+            for post_id in self.published.get(username, []):
+                for topic in self.posts[post_id]['topics']:
+                    vector[topic] += 3.0
+            for post_id in self.reposted.get(username, []):
+                for topic in self._post_topics(post_id):
+                    vector[topic] += 2.0
+            for post_id in self.likes.get(username, {}):
+                for topic in self.posts[post_id]['topics']:
+                    vector[topic] += 1.0
+            return {topic: weight for topic, weight in vector.items() if weight}
+
+    def rebuild_user_profiles(self, batch_size=500):
+        # Every event decayed by its age, as in the Cypher rebuild
+        with self.lock:
+            now = datetime.now()
+            now_ts = now.timestamp()
+
+            def age_of(iso):
+                return (now - datetime.fromisoformat(iso)).total_seconds()
+
+            for username in self.users:
+                events = []
+                for post_id in self.published.get(username, []):
+                    post = self.posts[post_id]
+                    events.append((post['topics'], INTEREST_WEIGHTS['post'], now_ts - post['timestamp']))
+                for post_id in self.reposted.get(username, []):
+                    events.append((self._post_topics(post_id), INTEREST_WEIGHTS['repost'],
+                                   now_ts - self.posts[post_id]['timestamp']))
+                for post_id, created_at in self.likes.get(username, {}).items():
+                    events.append((self.posts[post_id]['topics'], INTEREST_WEIGHTS['like'], age_of(created_at)))
+                for space_id in self.joined.get(username, ()):
+                    space, membership = self.spaces[space_id], self.members[space_id][username]
+                    role_weight = ROLE_WEIGHTS.get(membership['role'], 1.0)
+                    events.append((space['topics'], role_weight * INTEREST_WEIGHTS['join'],
+                                   age_of(membership['joined_at'])))
+                for departure in self.departures.get(username, []):
+                    topics = self.spaces[departure['space_id']]['topics']
+                    role_weight = ROLE_WEIGHTS.get(departure['role'], 1.0)
+                    events.append((topics, role_weight * INTEREST_WEIGHTS['join'], age_of(departure['joined_at'])))
+                    events.append((topics, role_weight * (departure['duration'] or 0) / 3600.0,
+                                   age_of(departure['left_at'])))
+                for space_id in self.hosted.get(username, ()):
+                    space = self.spaces[space_id]
+                    if space['status'] == 'ended':
+                        events.append((space['topics'], ROLE_WEIGHTS['host'] * (space['host_duration'] or 0) / 3600.0,
+                                       age_of(space['host_left_at'])))
+
+                scores = defaultdict(float)
+                for topics, weight, age in events:
+                    for topic in topics:
+                        scores[topic] += weight * 0.5 ** ((age or 0) / self.interest_half_life)
+                self.interests[username] = {topic: (score, now_ts) for topic, score in scores.items() if score > 0}
+            return len(self.users)
+
+    # Offline jobs and recommendation sources
+
+    def iter_user_space_memberships(self):
+        with self.lock:
+            rows = [{'username': username, 'space_id': space_id}
+                    for index in (self.joined, self.hosted) for username, space_ids in index.items()
+                    for space_id in space_ids if self._live(space_id)]
+        yield from rows
+
+    def iter_space_engagements(self):
+        with self.lock:
+            now = datetime.now()
+            rows = []
+            for username, space_ids in self.joined.items():
+                for space_id in space_ids:
+                    membership = self.members[space_id][username]
+                    rows.append({'username': username, 'space_id': space_id, 'kind': 'JOINED_AS',
+                                 'role': membership['role'],
+                                 'hours': seconds_since(membership['joined_at'], now) / 3600.0})
+            for username, departures in self.departures.items():
+                for departure in departures:
+                    rows.append({'username': username, 'space_id': departure['space_id'], 'kind': 'LEFT_AS',
+                                 'role': departure['role'], 'hours': (departure['duration'] or 0) / 3600.0})
+            for username, space_ids in self.hosted.items():
+                for space_id in space_ids:
+                    space = self.spaces[space_id]
+                    seconds = (space['host_duration'] if space['host_left_at'] is not None
+                               else seconds_since(space['created_at'], now))
+                    rows.append({'username': username, 'space_id': space_id, 'kind': 'HOSTS', 'role': None,
+                                 'hours': (seconds or 0) / 3600.0})
+        yield from rows
+
+    def write_recommendations(self, rows, generation, computed_at):
+        with self.lock:
+            for row in rows:
+                if row['username'] in self.users and row['space_id'] in self.spaces:
+                    self.recommended[row['username']][row['space_id']] = {
+                        'score': row['score'], 'rank': row['rank'], 'generation': generation,
+                        'computed_at': computed_at}
+
+    def write_space_similarities(self, rows, generation):
+        with self.lock:
+            for row in rows:
+                if row['space_id'] in self.spaces and row['neighbour_id'] in self.spaces:
+                    self.similar[row['space_id']][row['neighbour_id']] = {'score': row['score'],
+                                                                          'generation': generation}
+
+    def prune_generation(self, rel_type, generation, batch_size=10000):
+        if rel_type not in PRECOMPUTED_RELATIONSHIPS:
+            raise ValueError(f"Not a precomputed relationship type: {rel_type}")
+        edges = self.recommended if rel_type == "RECOMMENDED" else self.similar
+        removed = 0
+        with self.lock:
+            for targets in edges.values():
+                for target in [target for target, edge in targets.items() if edge['generation'] != generation]:
+                    del targets[target]
+                    removed += 1
+        return removed
+
+    def get_item_cf_scores(self, username, top_n=50):
+        with self.lock:
+            mine = self.get_user_space_ids(username)
+            engagements = [(space_id, ROLE_WEIGHTS['host']) for space_id in self.hosted.get(username, ())]
+            engagements += [(space_id, ROLE_WEIGHTS.get(self.members[space_id][username]['role'], 1))
+                            for space_id in self.joined.get(username, ())]
+            engagements += [(departure['space_id'], ROLE_WEIGHTS.get(departure['role'], 1))
+                            for departure in self.departures.get(username, [])]
+            scores = defaultdict(float)
+            for space_id, weight in engagements:
+                for neighbour, edge in self.similar.get(space_id, {}).items():
+                    if neighbour not in mine and self._live(neighbour):
+                        scores[neighbour] += edge['score'] * weight
+        return heapq.nlargest(top_n, scores.items(), key=lambda pair: pair[1])
+
+    def get_precomputed_scores(self, username):
+        with self.lock:
+            edges = sorted(self.recommended.get(username, {}).items(), key=lambda item: item[1]['rank'])
+        if not edges:
+            return [], None
+        return [(space_id, edge['score']) for space_id, edge in edges], edges[0][1]['computed_at']
+
+    def get_user_recommendation_state(self, username):
+        with self.lock:
+            if username not in self.users:
+                return {'activity': 0, 'following': 0, 'space_ids': set()}
+            space_ids = self.get_user_space_ids(username)
+            activity = (len(self.published.get(username, [])) + len(self.reposted.get(username, [])) +
+                        len(self.likes.get(username, {})) + len(self.departures.get(username, [])) + len(space_ids))
+            return {'activity': activity, 'following': len(self.following.get(username, {})),
+                    'space_ids': set(space_ids)}
+
+    def iter_recent_space_joins(self, since):
+        with self.lock:
+            rows = [{'space_id': space_id, 'role': membership['role'], 'joined_at': membership['joined_at'],
+                     'left_at': None}
+                    for space_id, members in self.members.items() if self._live(space_id)
+                    for membership in members.values()]
+            rows += [{'space_id': departure['space_id'], 'role': departure['role'],
+                      'joined_at': departure['joined_at'], 'left_at': departure['left_at']}
+                     for departures in self.departures.values() for departure in departures
+                     if self._live(departure['space_id']) and departure['joined_at'] >= since]
+        yield from rows
+
+    def write_trending_snapshot(self, rows, computed_at):
+        # One process is one worker, so its ranking is the whole ranking
+        with self.lock:
+            self.trending_ranks = {row['space_id']: (row['rank'], row['score']) for row in rows
+                                   if row['space_id'] in self.spaces}
+
+    def get_trending_snapshot(self, top_n=5):
+        with self.lock:
+            ranked = sorted((rank, space_id, value) for space_id, (rank, value) in self.trending_ranks.items()
+                            if self._live(space_id))
+        return [(space_id, value) for _, space_id, value in ranked[:top_n]]
@@ -0,0 +1,73 @@
+import argparse
+
+from models import Database, DEDUPE_RELATIONSHIPS
+
+NEO4J_URI = "bolt://localhost:7687"
+NEO4J_USER = "neo4j"
+NEO4J_PASSWORD = "12345678"
+
+
+def schema(db, args):
+    db.ensure_schema()
+    print("Constraints and indexes are in place")
+
+
+def dedupe(db, args):
+    total = 0
+    for rel_type in args.types or DEDUPE_RELATIONSHIPS:
+        removed = db.dedupe_relationships(rel_type, batch_size=args.batch_size)
+        total += removed
+        print(f"{rel_type}: removed {removed} duplicate relationships")
+    print(f"Total removed: {total}")
+
+
+def rebuild_profiles(db, args):
+    count = db.rebuild_user_profiles(batch_size=args.batch_size)
+    print(f"Rebuilt interest profiles for {count} users")
+
+
+def space_counters(db, args):
+    count = db.rebuild_space_counters(batch_size=args.batch_size)
+    print(f"Rebuilt member counters for {count} spaces")
+
+
+def finish_ended_spaces(db, args):
+    stats = db.finish_ended_spaces(batch_size=args.batch_size)
+    print(f"Converted {stats['hosts']} host edges; finalized {stats['members']} members in {stats['spaces']} spaces")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="One-off maintenance commands for the graph.")
+    parser.add_argument("--uri", default=NEO4J_URI)
+    parser.add_argument("--user", default=NEO4J_USER)
+    parser.add_argument("--password", default=NEO4J_PASSWORD)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    schema_parser = commands.add_parser("schema", help="create the constraints and indexes the app relies on")
+    schema_parser.set_defaults(handler=schema)
+
+    dedupe_parser = commands.add_parser("dedupe", help="collapse duplicate LIKES/FOLLOWS/JOINED_AS edges")
+    dedupe_parser.add_argument("--types", nargs="+", choices=DEDUPE_RELATIONSHIPS)
+    dedupe_parser.add_argument("--batch-size", type=int, default=10000)
+    dedupe_parser.set_defaults(handler=dedupe)
+
+    profiles_parser = commands.add_parser("rebuild-profiles", help="recompute user interest profiles from history")
+    profiles_parser.add_argument("--batch-size", type=int, default=500)
+    profiles_parser.set_defaults(handler=rebuild_profiles)
+
+    counters_parser = commands.add_parser("space-counters", help="backfill the member counters on Space nodes")
+    counters_parser.add_argument("--batch-size", type=int, default=1000)
+    counters_parser.set_defaults(handler=space_counters)
+
+    ended_parser = commands.add_parser("finish-ended-spaces",
+                                       help="finalize members of ended spaces into LEFT_AS, resuming interrupted ends")
+    ended_parser.add_argument("--batch-size", type=int, default=5000)
+    ended_parser.set_defaults(handler=finish_ended_spaces)
+
+    args = parser.parse_args()
+    db = Database(args.uri, args.user, args.password)
+    args.handler(db, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,247 @@ from py2neo import Graph, Node, NodeMatcher, Relationship
 from datetime import datetime
 import uuid
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import base64
+import json
+from scoring import build_user_vector, score, top_k
+from space_cache import SpaceTopicCache
+from ann_index import SpaceIndex
+from rec_cache import LocalBackend, RecommendationCache, RedisBackend
+from trending import TrendingSpaces
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Fan-out-on-write timelines: each user keeps at most this many TIMELINE entries
+TIMELINE_MAX_LENGTH = 800
+# Authors with more followers than this are merged in at read time instead
+CELEBRITY_FOLLOWER_THRESHOLD = 10000
+# Relationship types that should exist at most once between a pair of nodes
+DEDUPE_RELATIONSHIPS = ("LIKES", "FOLLOWS", "JOINED_AS")
+# Seconds between checks of the graph's space catalogue version by each worker
+SPACE_CACHE_REFRESH_SECONDS = 30
+# Interest profiles: points per engagement, decayed with this half-life at read time
+ROLE_WEIGHTS = {"listener": 1, "speaker": 1.5, "moderator": 1.7, "host": 2}
+INTEREST_WEIGHTS = {"post": 3, "repost": 2, "like": 1, "join": 1}
+INTEREST_HALF_LIFE_DAYS = 14
+# Decays an INTERESTED_IN edge to now and adds delta; expects u, t and delta in scope, one row per (u, t),
+# so callers sum a batch's deltas first and no increment reads a score another row is about to overwrite
+INTEREST_UPDATE = """
+MERGE (u)-[i:INTERESTED_IN]->(t)
+ON CREATE SET i.score = 0.0, i.updated_at = $now
+WITH i, i.score * 0.5 ^ (($now - i.updated_at) / $half_life) + delta AS score
+SET i.score = CASE WHEN score > 0 THEN score ELSE 0.0 END, i.updated_at = $now
+"""
+# Number of comments shown inline under each post on a feed page
+FEED_COMMENT_LIMIT = 3
+# Relationships written in generations by the offline jobs and pruned afterwards
+PRECOMPUTED_RELATIONSHIPS = ("RECOMMENDED", "SIMILAR_SPACE")
+# Share of the final space score taken by co-attendance (SIMILAR_SPACE) evidence
+CF_BLEND_WEIGHT = 0.3
+# Per-user recommendation results kept per worker, and how long one may be served
+RECOMMENDATION_CACHE_SIZE = 10000
+RECOMMENDATION_CACHE_TTL = 60
+# Roles with their own member counter on the Space node, and how many member names each space keeps
+SPACE_ROLES = ("listener", "speaker", "moderator")
+MEMBER_SAMPLE_SIZE = 5
+# Maintained Space counters; expect s, username and role in scope and $sample_size as a parameter
+SPACE_JOIN_COUNTERS = """
+s.member_count = coalesce(s.member_count, 0) + 1,
+s.listener_count = coalesce(s.listener_count, 0) + CASE role WHEN 'listener' THEN 1 ELSE 0 END,
+s.speaker_count = coalesce(s.speaker_count, 0) + CASE role WHEN 'speaker' THEN 1 ELSE 0 END,
+s.moderator_count = coalesce(s.moderator_count, 0) + CASE role WHEN 'moderator' THEN 1 ELSE 0 END,
+s.member_sample = CASE WHEN size(coalesce(s.member_sample, [])) < $sample_size
+                       THEN coalesce(s.member_sample, []) + username ELSE s.member_sample END
+"""
+SPACE_LEAVE_COUNTERS = """
+s.member_count = CASE WHEN s.member_count > 0 THEN s.member_count - 1 ELSE 0 END,
+s.listener_count = CASE WHEN role = 'listener' AND s.listener_count > 0
+                        THEN s.listener_count - 1 ELSE coalesce(s.listener_count, 0) END,
+s.speaker_count = CASE WHEN role = 'speaker' AND s.speaker_count > 0
+                       THEN s.speaker_count - 1 ELSE coalesce(s.speaker_count, 0) END,
+s.moderator_count = CASE WHEN role = 'moderator' AND s.moderator_count > 0
+                         THEN s.moderator_count - 1 ELSE coalesce(s.moderator_count, 0) END,
+s.member_sample = [name IN coalesce(s.member_sample, []) WHERE name <> username]
+"""
+# Converts up to $batch_size JOINED_AS edges of s into LEFT_AS ending at left_at; expects s and left_at in scope.
+# end_space used to store whole hours on JOINED_AS itself, and such edges keep their recorded time.
+FINALIZE_MEMBERS = """
+MATCH (m:User)-[r:JOINED_AS]->(s)
+WITH m, r, s, left_at
+LIMIT $batch_size
+WITH m, r, s, left_at, r.role AS role, r.duration IS NULL AS fresh,
+     CASE WHEN r.duration IS NOT NULL THEN r.duration * 3600.0
+          ELSE duration.inSeconds(localdatetime(r.joined_at), localdatetime(left_at)).seconds END AS seconds
+CREATE (m)-[:LEFT_AS {role: role, joined_at: r.joined_at, left_at: left_at, duration: seconds}]->(s)
+DELETE r
+RETURN COLLECT({username: m.username, role: role, seconds: seconds, fresh: fresh}) AS members
+"""
+# JOINED_AS edges finalized per transaction when a space ends; smaller spaces end in a single transaction
+END_SPACE_BATCH_SIZE = 5000
+# Status filters accepted by the space directory
+SPACE_STATUS_FILTERS = ("live", "ended")
+# Trending spaces: sliding window of joins in seconds, its bucket width, and how many spaces are ranked
+TRENDING_WINDOW_SECONDS = 3600
+TRENDING_BUCKET_SECONDS = 60
+TRENDING_TOP_K = 100
+# Share of the final space score taken by trending popularity
+TRENDING_BLEND_WEIGHT = 0.2
+# A worker's share of the graph's trending ranking is dropped after it misses this many snapshots
+TRENDING_STALE_SNAPSHOTS = 3
+
+
+def encode_cursor(timestamp, post_id):
+    raw = json.dumps([timestamp, post_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor, cast=int):
+    try:
+        timestamp, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return cast(timestamp), str(post_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+# Constraints and indexes backing every lookup in this module; all statements are idempotent
+SCHEMA = [
+    "CREATE CONSTRAINT user_username IF NOT EXISTS FOR (u:User) REQUIRE u.username IS UNIQUE",
+    "CREATE CONSTRAINT post_id IF NOT EXISTS FOR (p:Post) REQUIRE p.id IS UNIQUE",
+    "CREATE CONSTRAINT space_id IF NOT EXISTS FOR (s:Space) REQUIRE s.id IS UNIQUE",
+    "CREATE CONSTRAINT comment_id IF NOT EXISTS FOR (c:Comment) REQUIRE c.id IS UNIQUE",
+    "CREATE CONSTRAINT topic_name IF NOT EXISTS FOR (t:Topic) REQUIRE t.name IS UNIQUE",
+    "CREATE CONSTRAINT catalogue_name IF NOT EXISTS FOR (c:Catalogue) REQUIRE c.name IS UNIQUE",
+    "CREATE INDEX post_timestamp IF NOT EXISTS FOR (p:Post) ON (p.timestamp)",
+    "CREATE INDEX space_created_at IF NOT EXISTS FOR (s:Space) ON (s.created_at)",
+    "CREATE INDEX space_status IF NOT EXISTS FOR (s:Space) ON (s.status)",
+    "CREATE INDEX space_trending_rank IF NOT EXISTS FOR (s:Space) ON (s.trending_rank)",
+    "CREATE CONSTRAINT trending_worker_id IF NOT EXISTS FOR (w:TrendingWorker) REQUIRE w.id IS UNIQUE",
+]
+
+
+class BaseDatabase:
+    # Everything that does not depend on where the graph lives: the in-process space and
+    # recommendation caches, the optional ANN index and thin wrappers over the bulk writes.
+    # Database keeps the graph in Neo4j; memory_db.MemoryDatabase keeps it in dicts.
+
+    def __init__(self, timeline_max_length=TIMELINE_MAX_LENGTH, celebrity_threshold=CELEBRITY_FOLLOWER_THRESHOLD,
+                 space_cache_refresh=SPACE_CACHE_REFRESH_SECONDS, interest_half_life_days=INTEREST_HALF_LIFE_DAYS,
+                 space_index=False, space_index_path=None, cf_blend_weight=CF_BLEND_WEIGHT,
+                 recommendation_cache_size=RECOMMENDATION_CACHE_SIZE,
+                 recommendation_cache_ttl=RECOMMENDATION_CACHE_TTL, recommendation_cache_url=None,
+                 trending_window=TRENDING_WINDOW_SECONDS, trending_bucket=TRENDING_BUCKET_SECONDS,
+                 trending_top_k=TRENDING_TOP_K, trending_blend_weight=TRENDING_BLEND_WEIGHT,
+                 trending_snapshot_interval=None):
+        self.timeline_max_length = timeline_max_length
+        self.celebrity_threshold = celebrity_threshold
+        self.interest_half_life = interest_half_life_days * 24 * 3600
+        self.cf_blend_weight = cf_blend_weight
+        self.space_cache = SpaceTopicCache(self.get_space_vectors, self.get_space_catalogue_version,
+                                           refresh_interval=space_cache_refresh)
+        self.space_index = None
+        # A Redis URL shares cached results and activity versions between workers
+        backend = (RedisBackend(recommendation_cache_url) if recommendation_cache_url
+                   else LocalBackend(recommendation_cache_size))
+        self.recommendation_cache = RecommendationCache(backend, self.get_space_catalogue_version,
+                                                        ttl=recommendation_cache_ttl,
+                                                        refresh_interval=space_cache_refresh)
+        self.trending_blend_weight = trending_blend_weight
+        self.trending = TrendingSpaces(window=trending_window, bucket=trending_bucket, top_k=trending_top_k)
+        # Identifies this worker's share of the trending snapshot
+        self.worker_id = str(uuid.uuid4())
+        self.trending_snapshot_interval = None
+        if space_index:
+            self.enable_space_index(path=space_index_path)
+        if trending_snapshot_interval:
+            self.enable_trending_snapshots(trending_snapshot_interval)
+
+    def enable_space_index(self, **options):
+        # Approximate candidate retrieval over the space cache. It follows the cache: creates are hashed
+        # incrementally and ends/deletes go through the live mask, so writes need no extra bookkeeping;
+        # `path` keeps the bucket keys on disk by catalogue version so a restart only hashes new spaces
+        self.space_index = SpaceIndex(self.space_cache, **options)
+
+    def enable_trending_snapshots(self, interval):
+        # Rebuild the counters from stored memberships, then write the ranking to the graph periodically
+        self.trending_snapshot_interval = interval
+        since = datetime.fromtimestamp(datetime.now().timestamp() - self.trending.window).isoformat()
+        self.trending.warm(self.iter_recent_space_joins(since))
+        self.trending.start_snapshots(self.write_trending_snapshot, interval)
 
-class Database:
-    def __init__(self, uri, user, password):
+    def add_post(self, username, text, tags):
+        post_ids = self.add_posts_bulk([{'username': username, 'text': text, 'tags': tags}])
+        if not post_ids:
+            raise ValueError("User not found")
+        return post_ids[0]
+
+    def fan_out_post(self, username, post_id):
+        self.fan_out_posts([{'username': username, 'post_id': post_id}])
+
+    def create_space(self, username, space_name, space_description, topics):
+        space_ids = self.create_spaces_bulk([{'host': username, 'name': space_name,
+                                              'description': space_description, 'topics': topics}])
+        if not space_ids:
+            raise ValueError("User not found")
+        return space_ids[0]
+
+    def _spaces_created(self, rows, created):
+        self.space_cache.add_spaces([{'id': row['id'], 'name': row['name'], 'status': row['status'],
+                                      'topics': row['topics']} for row in rows
+                                     if row['id'] in created and row['topics']],
+                                    self.bump_space_catalogue_version())
+
+    def _space_joined(self, space_id, role):
+        self.trending.record_join(space_id, role)
+
+    def _space_left(self, space_id, role):
+        self.trending.record_leave(space_id, role)
+
+    def _space_ended(self, space_id):
+        self.trending.remove(space_id)
+        self.space_cache.end_space(space_id, self.bump_space_catalogue_version())
+
+    def _space_deleted(self, space_id):
+        self.trending.remove(space_id)
+        self.space_cache.remove_space(space_id, self.bump_space_catalogue_version())
+
+    def bump_user_activity(self, usernames):
+        # Invalidates the users' cached recommendations; called by every write that changes their inputs
+        self.recommendation_cache.bump_users(usernames)
+
+    def prune_recommendations(self, generation, batch_size=10000):
+        return self.prune_generation("RECOMMENDED", generation, batch_size)
+
+    def rank_spaces_by_topic(self, user_vector, top_n, exclude=()):
+        # Cosine ranking over the cached matrix; returns [(space_id, score)] best first
+        space_matrix, space_ids, candidates, topic_index, row_of = self.space_cache.snapshot()
+
+        # Check if space_vectors is empty
+        if not space_ids:
+            return []
+
+        # Prefilter to live spaces the user neither hosts nor has joined
+        for space_id in exclude:
+            row = row_of.get(space_id)
+            if row is not None and row < len(candidates):
+                candidates[row] = False
+
+        similarities = score(space_matrix, build_user_vector(user_vector, topic_index))
+        similarities[~candidates] = -np.inf
+        return [(space_ids[index], float(similarities[index]))
+                for index in top_k(similarities, top_n) if candidates[index]]
+
+
+class Database(BaseDatabase):
+    def __init__(self, uri, user, password, ensure_schema=False, **options):
         self.graph = Graph(uri, auth=(user, password))
         self.matcher = NodeMatcher(self.graph)
+        if ensure_schema:
+            self.ensure_schema()
+        super().__init__(**options)
+
+    def ensure_schema(self):
+        for statement in SCHEMA:
+            self.graph.run(statement)
 
     def create_user(self, username, password, email):
         created_at = datetime.now().isoformat()
@@ -32,54 +267,202 @@ class Database:
         user = self.graph.nodes.match("User", username=username).first()
         return user
 
-    def add_post(self, username, text, tags):
-        user = self.find_user(username)
-        if not user:
-            raise ValueError("User not found")
+    def add_posts_bulk(self, posts, fan_out=True):
+        # Post node, both author relationships, every topic and the author's interest in them in one
+        # statement (one transaction). Requires the schema (ensure_schema): MERGE on Topic.name only keeps
+        # concurrent posts with the same new hashtag on a single node under the topic_name constraint.
+        rows = []
+        for post in posts:
+            now = datetime.fromtimestamp(int(post['timestamp'])) if post.get('timestamp') else datetime.now()
+            rows.append({
+                'username': post['username'],
+                'id': post.get('id') or str(uuid.uuid4()),
+                'text': post['text'],
+                'timestamp': int(now.timestamp()),
+                'date': now.strftime("%Y-%m-%d"),
+                'tags': sorted({tag.strip("#") for tag in post.get('tags', ()) if tag.strip("#")})
+            })
+        if not rows:
+            return []
 
-        post = Node(
-            "Post",
-            id=str(uuid.uuid4()),
-            text=text,
-            timestamp=int(datetime.now().timestamp()),
-            date=datetime.now().strftime("%Y-%m-%d")
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username})
+        CREATE (p:Post {id: row.id, text: row.text, timestamp: row.timestamp, date: row.date})
+        CREATE (u)-[:PUBLISHED_ON {status: true, date: row.date}]->(p)
+        CREATE (p)-[:BY]->(u)
+        FOREACH (tag IN row.tags |
+            MERGE (t:Topic {name: tag})
+            CREATE (p)-[:HAS_TOPIC]->(t)
         )
+        WITH COLLECT({author: u, username: row.username, post_id: p.id, tags: row.tags}) AS created
+        CALL {
+            // Summed per (user, topic) like update_post_interests
+            WITH created
+            UNWIND created AS item
+            UNWIND item.tags AS tag
+            MATCH (t:Topic {name: tag})
+            WITH item.author AS u, t, count(*) * $delta AS delta
+            """ + INTEREST_UPDATE + """
+            RETURN count(*) AS credited
+        }
+        UNWIND created AS item
+        RETURN item.username AS username, item.post_id AS post_id
+        """
+        created = self.graph.run(query, rows=rows, delta=INTEREST_WEIGHTS['post'], now=datetime.now().timestamp(),
+                                 half_life=self.interest_half_life).data()
 
+        self.bump_user_activity(record['username'] for record in created)
+        if fan_out and created:
+            self.fan_out_posts(created)
+        return [record['post_id'] for record in created]
 
+    def fan_out_posts(self, items):
+        # Push posts into the authors' and followers' timelines, unless the author is a celebrity
+        # (size() on a single typed relationship is answered from the degree store, so this check is cheap)
         query = """
-        MATCH (u:User)-[r:PUBLISHED_ON]->(p:Post)
-        WHERE u.username = $username
-        RETURN r, p
-        ORDER BY p.timestamp DESC
-        LIMIT 1
+        UNWIND $items AS item
+        MATCH (author:User {username: item.username}), (p:Post {id: item.post_id})
+        MERGE (author)-[own:TIMELINE]->(p)
+        ON CREATE SET own.timestamp = p.timestamp
+        WITH author, p
+        WHERE size((author)<-[:FOLLOWS]-()) <= $threshold
+        MATCH (f:User)-[:FOLLOWS]->(author)
+        MERGE (f)-[t:TIMELINE]->(p)
+        ON CREATE SET t.timestamp = p.timestamp
         """
-        result = self.graph.run(query, username=username).data()
+        self.graph.run(query, items=items, threshold=self.celebrity_threshold)
+        self.trim_timelines(sorted({item['username'] for item in items}))
+
+    def trim_timelines(self, usernames):
+        # Keep the authors' and followers' timelines bounded, only touching the ones over the limit
+        query = """
+        UNWIND $usernames AS username
+        MATCH (author:User {username: username})
+        OPTIONAL MATCH (f:User)-[:FOLLOWS]->(author)
+        WITH author, COLLECT(f) AS followers
+        UNWIND followers + [author] AS owner
+        WITH DISTINCT owner
+        WHERE size((owner)-[:TIMELINE]->()) > $max_length
+        MATCH (owner)-[t:TIMELINE]->(:Post)
+        WITH owner, t
+        ORDER BY t.timestamp DESC
+        WITH owner, COLLECT(t) AS entries
+        FOREACH (stale IN entries[$max_length..] | DELETE stale)
+        """
+        self.graph.run(query, usernames=list(usernames), max_length=self.timeline_max_length)
+
+    def backfill_timeline(self, username, target_username):
+        # Copy the newest posts of a freshly followed user into the follower's timeline
+        query = """
+        MATCH (me:User {username: $username}), (target:User {username: $target_username})
+        WHERE size((target)<-[:FOLLOWS]-()) <= $threshold
+        CALL {
+            WITH target
+            MATCH (target)-[:PUBLISHED_ON|REPOSTED]->(p:Post)
+            RETURN p
+            ORDER BY p.timestamp DESC
+            LIMIT $max_length
+        }
+        MERGE (me)-[t:TIMELINE]->(p)
+        ON CREATE SET t.timestamp = p.timestamp
+        """
+        self.graph.run(query, username=username, target_username=target_username,
+                       threshold=self.celebrity_threshold, max_length=self.timeline_max_length)
+        query = """
+        MATCH (me:User {username: $username})
+        WHERE size((me)-[:TIMELINE]->()) > $max_length
+        MATCH (me)-[t:TIMELINE]->(:Post)
+        WITH t
+        ORDER BY t.timestamp DESC
+        WITH COLLECT(t) AS entries
+        FOREACH (stale IN entries[$max_length..] | DELETE stale)
+        """
+        self.graph.run(query, username=username, max_length=self.timeline_max_length)
 
+    def remove_from_timeline(self, username, target_username):
+        query = """
+        MATCH (me:User {username: $username})-[t:TIMELINE]->(:Post)<-[:PUBLISHED_ON|REPOSTED]-(:User {username: $target_username})
+        DELETE t
+        """
+        self.graph.run(query, username=username, target_username=target_username)
 
-        rel = Relationship(user, "PUBLISHED_ON", post, status=True,
-                           date=datetime.now().strftime("%Y-%m-%d"))
-        self.graph.create(rel)
-        self.graph.create(Relationship(post, "BY", user))
+    def get_following_feed(self, username, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        # Read the materialized timeline, merging celebrity posts in at read time (fan-out-on-read)
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after_ts, after_id = decode_cursor(cursor) if cursor else (None, None)
 
+        query = """
+        CALL {
+            MATCH (:User {username: $username})-[t:TIMELINE]->(p:Post)
+            WHERE $after_ts IS NULL
+               OR t.timestamp < $after_ts
+               OR (t.timestamp = $after_ts AND p.id < $after_id)
+            RETURN p
+            ORDER BY t.timestamp DESC, p.id DESC
+            LIMIT $fetch
+            UNION
+            MATCH (:User {username: $username})-[:FOLLOWS]->(c:User)
+            WHERE size((c)<-[:FOLLOWS]-()) > $threshold
+            CALL {
+                WITH c
+                MATCH (c)-[:PUBLISHED_ON|REPOSTED]->(p:Post)
+                WHERE $after_ts IS NULL
+                   OR p.timestamp < $after_ts
+                   OR (p.timestamp = $after_ts AND p.id < $after_id)
+                RETURN p
+                ORDER BY p.timestamp DESC, p.id DESC
+                LIMIT $fetch
+            }
+            RETURN p
+        }
+        WITH DISTINCT p
+        ORDER BY p.timestamp DESC, p.id DESC
+        LIMIT $fetch
+        MATCH (u:User)-[:PUBLISHED_ON|REPOSTED]->(p)
+        OPTIONAL MATCH (p)-[:REPOST_OF]->(:Post)<-[:PUBLISHED_ON]-(original:User)
+        OPTIONAL MATCH (p)-[:HAS_TOPIC]->(t:Topic)
+        WITH u, p, original, COLLECT(t.name) AS topics
+        ORDER BY p.timestamp DESC, p.id DESC
+        RETURN u.username AS username, p.id AS post_id, p.text AS text, p.date AS date,
+               p.timestamp AS timestamp, original.username AS original_username, topics
+        """
+        posts = self.graph.run(query, username=username, after_ts=after_ts, after_id=after_id,
+                               fetch=limit + 1, threshold=self.celebrity_threshold).data()
 
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1]['timestamp'], posts[-1]['post_id'])
+        return {'posts': posts, 'next': next_cursor}
 
-        for tag in tags:
-            topic_name = tag.strip("#")
-            topic = self.graph.nodes.match("Topic", name=topic_name).first()
-            if not topic:
-                topic = Node("Topic", name=topic_name)
-                self.graph.create(topic)
-            self.graph.create(Relationship(post, "HAS_TOPIC", topic))
+    def get_all_posts(self, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        # Keyset pagination on (timestamp, id) so each page costs the same no matter how deep
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after_ts, after_id = decode_cursor(cursor) if cursor else (None, None)
 
-    def get_all_posts(self):
         query = """
         MATCH (u:User)-[:PUBLISHED_ON]->(p:Post)
+        WHERE $after_ts IS NULL
+           OR p.timestamp < $after_ts
+           OR (p.timestamp = $after_ts AND p.id < $after_id)
+        WITH u, p
+        ORDER BY p.timestamp DESC, p.id DESC
+        LIMIT $fetch
         OPTIONAL MATCH (p)-[:HAS_TOPIC]->(t:Topic)
         WITH u, p, COLLECT(t.name) AS topics
-        ORDER BY p.timestamp DESC
-        RETURN u.username AS username, p.id AS post_id, p.text AS text, p.date AS date, topics
+        ORDER BY p.timestamp DESC, p.id DESC
+        RETURN u.username AS username, p.id AS post_id, p.text AS text, p.date AS date,
+               p.timestamp AS timestamp, topics
         """
-        return self.graph.run(query).data()
+        # Fetch one extra row to know whether there is a next page
+        posts = self.graph.run(query, after_ts=after_ts, after_id=after_id, fetch=limit + 1).data()
+
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1]['timestamp'], posts[-1]['post_id'])
+        return {'posts': posts, 'next': next_cursor}
 
     def get_user_posts(self, username):
         query = """
@@ -119,16 +502,53 @@ class Database:
         """
         return self.graph.run(query, post_id=post_id).data()
 
-    def like_post(self, username, post_id):
-        user = self.find_user(username)
-        if not user:
-            raise ValueError("User not found")
+    def hydrate_posts(self, post_ids, viewer=None, comment_limit=FEED_COMMENT_LIMIT):
+        # One round trip for a whole feed page instead of a get_comments call per post
+        if not post_ids:
+            return {}
+        query = """
+        OPTIONAL MATCH (viewer:User {username: $viewer})
+        UNWIND $post_ids AS post_id
+        MATCH (p:Post {id: post_id})
+        OPTIONAL MATCH (author:User)-[:PUBLISHED_ON|REPOSTED]->(p)
+        CALL {
+            WITH p
+            OPTIONAL MATCH (u:User)-[:COMMENTED]->(c:Comment)-[:ON]->(p)
+            WITH u, c
+            ORDER BY c.timestamp ASC
+            LIMIT $comment_limit
+            RETURN COLLECT(CASE WHEN c IS NULL THEN NULL
+                           ELSE {id: c.id, username: u.username, text: c.text, date: c.date} END) AS comments
+        }
+        RETURN p.id AS post_id, comments,
+               size((p)<-[:ON]-()) AS comment_count,
+               size((p)<-[:LIKES]-()) AS like_count,
+               size((p)<-[:REPOST_OF]-()) AS repost_count,
+               viewer IS NOT NULL AND EXISTS((viewer)-[:LIKES]->(p)) AS viewer_liked,
+               viewer IS NOT NULL AND author IS NOT NULL AND EXISTS((viewer)-[:FOLLOWS]->(author)) AS viewer_follows_author
+        """
+        result = self.graph.run(query, post_ids=list(post_ids), viewer=viewer,
+                                comment_limit=comment_limit).data()
+        return {record['post_id']: record for record in result}
 
-        post = self.graph.nodes.match("Post", id=post_id).first()
-        if not post:
+    def like_post(self, username, post_id):
+        # MERGE so repeated clicks never add parallel LIKES edges. Edges from before created_at was
+        # recorded have none, so an existing like is told apart from a missing user or post separately.
+        query = """
+        MATCH (u:User {username: $username}), (p:Post {id: $post_id})
+        MERGE (u)-[r:LIKES]->(p)
+        ON CREATE SET r.created_at = $now
+        RETURN true AS found, coalesce(r.created_at = $now, false) AS created
+        """
+        result = self.graph.run(query, username=username, post_id=post_id,
+                                now=datetime.now().isoformat()).data()
+        if not result:
+            if not self.user_exists(username):
+                raise ValueError("User not found")
             raise ValueError("Post not found")
-
-        self.graph.create(Relationship(user, "LIKES", post))
+        if result[0]['created']:
+            self.update_post_interests([{'username': username, 'post_id': post_id,
+                                         'delta': INTEREST_WEIGHTS['like']}])
 
     def unlike_post(self, username, post_id):
         user = self.find_user(username)
@@ -143,42 +563,25 @@ class Database:
         MATCH (u:User)-[r:LIKES]->(p:Post)
         WHERE u.username = $username AND p.id = $post_id
         DELETE r
+        RETURN COUNT(r) AS removed
         """
-        self.graph.run(query, username=username, post_id=post_id)
-
-    def like_post(self, username, post_id):
-        user = self.find_user(username)
-        if not user:
-            raise ValueError("User not found")
-
-        post = self.graph.nodes.match("Post", id=post_id).first()
-        if not post:
-            raise ValueError("Post not found")
-
-        self.graph.create(Relationship(user, "LIKES", post))
-
-    def unlike_post(self, username, post_id):
-        user = self.find_user(username)
-        if not user:
-            raise ValueError("User not found")
-
-        post = self.graph.nodes.match("Post", id=post_id).first()
-        if not post:
-            raise ValueError("Post not found")
-
-        query = """
-               MATCH (u:User)-[r:LIKES]->(p:Post)
-               WHERE u.username = $username AND p.id = $post_id
-               DELETE r
-               """
-        self.graph.run(query, username=username, post_id=post_id)
+        if self.graph.run(query, username=username, post_id=post_id).evaluate():
+            self.update_post_interests([{'username': username, 'post_id': post_id,
+                                         'delta': -INTEREST_WEIGHTS['like']}])
 
     def follow_user(self, username, target_username):
-        user = self.find_user(username)
-        target_user = self.find_user(target_username)
-        if not user or not target_user:
+        query = """
+        MATCH (u:User {username: $username}), (t:User {username: $target_username})
+        MERGE (u)-[r:FOLLOWS]->(t)
+        ON CREATE SET r.created_at = $now
+        RETURN r
+        """
+        result = self.graph.run(query, username=username, target_username=target_username,
+                                now=datetime.now().isoformat()).evaluate()
+        if result is None:
             raise ValueError("User not found")
-        self.graph.create(Relationship(user, "FOLLOWS", target_user))
+        self.bump_user_activity([username])
+        self.backfill_timeline(username, target_username)
 
     def unfollow_user(self, username, target_username):
         user = self.find_user(username)
@@ -192,6 +595,63 @@ class Database:
         DELETE r
         """
         self.graph.run(query, username=username, target_username=target_username)
+        self.bump_user_activity([username])
+        self.remove_from_timeline(username, target_username)
+
+    def like_posts_bulk(self, rows):
+        if not rows:
+            return
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username}), (p:Post {id: row.post_id})
+        MERGE (u)-[r:LIKES]->(p)
+        ON CREATE SET r.created_at = $now
+        WITH row, r
+        WHERE r.created_at = $now
+        RETURN row.username AS username, row.post_id AS post_id
+        """
+        created = self.graph.run(query, rows=rows, now=datetime.now().isoformat()).data()
+        self.update_post_interests([dict(record, delta=INTEREST_WEIGHTS['like']) for record in created])
+
+    def unlike_posts_bulk(self, rows):
+        if not rows:
+            return
+        query = """
+        UNWIND $rows AS row
+        MATCH (:User {username: row.username})-[r:LIKES]->(:Post {id: row.post_id})
+        DELETE r
+        RETURN DISTINCT row.username AS username, row.post_id AS post_id
+        """
+        removed = self.graph.run(query, rows=rows).data()
+        self.update_post_interests([dict(record, delta=-INTEREST_WEIGHTS['like']) for record in removed])
+
+    def follow_users_bulk(self, rows, backfill=True):
+        if not rows:
+            return
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username}), (t:User {username: row.target})
+        MERGE (u)-[r:FOLLOWS]->(t)
+        ON CREATE SET r.created_at = $now
+        """
+        self.graph.run(query, rows=rows, now=datetime.now().isoformat())
+        self.bump_user_activity(row['username'] for row in rows)
+        if backfill:
+            for row in rows:
+                self.backfill_timeline(row['username'], row['target'])
+
+    def unfollow_users_bulk(self, rows):
+        if not rows:
+            return
+        query = """
+        UNWIND $rows AS row
+        MATCH (:User {username: row.username})-[r:FOLLOWS]->(:User {username: row.target})
+        DELETE r
+        """
+        self.graph.run(query, rows=rows)
+        self.bump_user_activity(row['username'] for row in rows)
+        for row in rows:
+            self.remove_from_timeline(row['username'], row['target'])
 
     def get_user(self, username):
         user_node = self.find_user(username)
@@ -240,10 +700,13 @@ class Database:
         self.graph.create(repost)
         self.graph.create(Relationship(user, "REPOSTED", repost))
         self.graph.create(Relationship(repost, "REPOST_OF", original_post))
+        self.update_post_interests([{'username': username, 'post_id': repost["id"],
+                                     'delta': INTEREST_WEIGHTS['repost']}])
+        self.fan_out_post(username, repost["id"])
 
     def get_user_reposts(self, username):
         query = """
-        MATCH (u:User {username: $username})-[:REPOSTED]->(r:Repost)-[:REPOST_OF]->(p:Post)<-[:BY]-(original_user:User)
+        MATCH (u:User {username: $username})-[:REPOSTED]->(r:Post)-[:REPOST_OF]->(p:Post)<-[:PUBLISHED_ON]-(original_user:User)
         RETURN p.id AS post_id, p.text AS text, p.date AS original_date, r.date AS repost_date, original_user.username AS original_username
         ORDER BY r.timestamp DESC
         """
@@ -258,40 +721,216 @@ class Database:
         result = self.graph.run(query, username=username, target_username=target_username).evaluate()
         return result
 
-    def create_space(self, username, space_name, space_description, topics):
-        user = self.find_user(username)
-        if not user:
-            raise ValueError("User not found")
+    def create_spaces_bulk(self, spaces):
+        rows = [{
+            'host': space['host'],
+            'id': space.get('id') or str(uuid.uuid4()),
+            'name': space['name'],
+            'description': space.get('description', ''),
+            'created_at': space.get('created_at') or datetime.now().isoformat(),
+            'status': space.get('status'),
+            'ended_at': space.get('ended_at') if space.get('status') == 'ended' else None,
+            'topics': sorted(set(space.get('topics', ())))
+        } for space in spaces]
+        if not rows:
+            return []
+        # Ended spaces with an ended_at get the host edge end_space would have written
+        for row in rows:
+            row['host_duration'] = ((datetime.fromisoformat(row['ended_at']) -
+                                     datetime.fromisoformat(row['created_at'])).total_seconds()
+                                    if row['ended_at'] else None)
 
-        space = Node(
-            "Space",
-            id=str(uuid.uuid4()),
-            name=space_name,
-            description=space_description,
-            created_at=datetime.now().isoformat()
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.host})
+        CREATE (s:Space {id: row.id, name: row.name, description: row.description, created_at: row.created_at})
+        SET s.status = row.status, s.ended_at = row.ended_at
+        CREATE (u)-[h:HOSTS]->(s)
+        SET h.left_at = row.ended_at, h.duration = row.host_duration
+        FOREACH (topic_name IN row.topics |
+            MERGE (t:Topic {name: topic_name})
+            CREATE (s)-[:HAS_TOPIC]->(t)
+        )
+        RETURN s.id AS space_id
+        """
+        space_ids = [record['space_id'] for record in self.graph.run(query, rows=rows)]
+
+        self._spaces_created(rows, set(space_ids))
+        return space_ids
+
+    def create_users_bulk(self, users):
+        rows = [{
+            'username': user['username'],
+            'password': user.get('password', ''),
+            'email': user.get('email', ''),
+            'created_at': user.get('created_at') or datetime.now().isoformat()
+        } for user in users]
+        query = """
+        UNWIND $rows AS row
+        MERGE (u:User {username: row.username})
+        ON CREATE SET u.password = row.password, u.email = row.email, u.created_at = row.created_at
+        """
+        self.graph.run(query, rows=rows)
+
+    def join_spaces_bulk(self, memberships):
+        # Rows with a left_at become LEFT_AS (the shape leave_space produces), the rest JOINED_AS
+        rows = []
+        for membership in memberships:
+            row = {
+                'username': membership['username'],
+                'space_id': membership['space_id'],
+                'role': membership.get('role', 'listener'),
+                'joined_at': membership.get('joined_at') or datetime.now().isoformat(),
+                'left_at': membership.get('left_at'),
+                'duration': None
+            }
+            if row['left_at']:
+                row['duration'] = (datetime.fromisoformat(row['left_at']) -
+                                   datetime.fromisoformat(row['joined_at'])).total_seconds()
+            rows.append(row)
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username}), (s:Space {id: row.space_id})
+        WITH u, s, row, row.username AS username, row.role AS role
+        // Ended spaces only take finished (LEFT_AS) memberships
+        FOREACH (_ IN CASE WHEN row.left_at IS NULL AND coalesce(s.status, '') <> 'ended' THEN [1] ELSE [] END |
+            MERGE (u)-[r:JOINED_AS]->(s)
+            ON CREATE SET r.role = row.role, r.joined_at = row.joined_at,""" + SPACE_JOIN_COUNTERS + """
         )
+        FOREACH (_ IN CASE WHEN row.left_at IS NULL THEN [] ELSE [1] END |
+            CREATE (u)-[:LEFT_AS {role: row.role, joined_at: row.joined_at,
+                                  left_at: row.left_at, duration: row.duration}]->(s)
+        )
+        """
+        self.graph.run(query, rows=rows, sample_size=MEMBER_SAMPLE_SIZE)
+        self.bump_user_activity(row['username'] for row in rows)
 
-        self.graph.create(space)
-        self.graph.create(Relationship(user, "HOSTS", space))
+    def leave_spaces_bulk(self, rows):
+        # rows: {username, space_id, left_at}; swaps each JOINED_AS for LEFT_AS like leave_space.
+        # Returns the memberships that were open, with their role and duration in seconds.
+        if not rows:
+            return []
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username})-[r:JOINED_AS]->(s:Space {id: row.space_id})
+        WITH u, r, s, row, u.username AS username, r.role AS role,
+             duration.inSeconds(localdatetime(r.joined_at), localdatetime(row.left_at)) AS stayed
+        WITH u, r, s, row, username, role, stayed.seconds + stayed.nanosecondsOfSecond / 1000000000.0 AS duration
+        CREATE (u)-[:LEFT_AS {role: role, joined_at: r.joined_at, left_at: row.left_at, duration: duration}]->(s)
+        DELETE r
+        SET """ + SPACE_LEAVE_COUNTERS + """
+        RETURN username, s.id AS space_id, role, duration
+        """
+        left = self.graph.run(query, rows=rows).data()
+        self.bump_user_activity(row['username'] for row in rows)
+        return left
+
+    def list_spaces(self, username=None, status=None, topic=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        # Space directory, newest first, keyset-paginated on (created_at, id). Counts and the member
+        # sample are read off the Space node, so a page costs the same however big its spaces are.
+        if status is not None and status not in SPACE_STATUS_FILTERS:
+            raise ValueError(f"Unknown space status filter: {status}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after_created, after_id = decode_cursor(cursor, str) if cursor else (None, None)
+
+        # With a topic, start from the Topic node instead of scanning every space
+        match = "MATCH (:Topic {name: $topic})<-[:HAS_TOPIC]-(s:Space)" if topic else "MATCH (s:Space)"
+        query = match + """
+        WHERE ($ended IS NULL OR coalesce(s.status = 'ended', false) = $ended)
+          AND ($after_created IS NULL
+               OR s.created_at < $after_created
+               OR (s.created_at = $after_created AND s.id < $after_id))
+        WITH s
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT $fetch
+        OPTIONAL MATCH (host:User)-[:HOSTS]->(s)
+        RETURN s.id AS id, s.name AS name, s.description AS description, s.created_at AS created_at,
+               s.status AS status, host.username AS host,
+               [(s)-[:HAS_TOPIC]->(t:Topic) | t.name] AS topics,
+               coalesce(s.member_count, 0) AS member_count,
+               coalesce(s.listener_count, 0) AS listener_count,
+               coalesce(s.speaker_count, 0) AS speaker_count,
+               coalesce(s.moderator_count, 0) AS moderator_count,
+               coalesce(s.member_sample, []) AS member_sample
+        ORDER BY s.created_at DESC, s.id DESC
+        """
+        spaces = self.graph.run(query, topic=topic, ended=None if status is None else status == "ended",
+                                after_created=after_created, after_id=after_id, fetch=limit + 1).data()
+
+        next_cursor = None
+        if len(spaces) > limit:
+            spaces = spaces[:limit]
+            next_cursor = encode_cursor(spaces[-1]['created_at'], spaces[-1]['id'])
+
+        # Viewer membership for the whole page in one lookup, walking out from the viewer
+        joined = set()
+        if username and spaces:
+            query = """
+            MATCH (:User {username: $username})-[:JOINED_AS]->(s:Space)
+            WHERE s.id IN $space_ids
+            RETURN s.id AS id
+            """
+            joined = {record['id'] for record in
+                      self.graph.run(query, username=username, space_ids=[space['id'] for space in spaces])}
+        for space in spaces:
+            space['is_member'] = space['id'] in joined
+            space['is_host'] = space['host'] is not None and space['host'] == username
+        return {'spaces': spaces, 'next': next_cursor}
 
-        for topic_name in topics:
-            topic = self.graph.nodes.match("Topic", name=topic_name).first()
-            if not topic:
-                topic = Node("Topic", name=topic_name)
-                self.graph.create(topic)
-            self.graph.create(Relationship(space, "HAS_TOPIC", topic))
+    def rebuild_space_counters(self, batch_size=1000):
+        # Recompute the maintained counters from JOINED_AS edges, for graphs written before they existed.
+        # Ended spaces have no live members and reset to zero.
+        query = """
+        MATCH (s:Space)
+        WHERE id(s) > $after
+        WITH s
+        ORDER BY id(s)
+        LIMIT $batch_size
+        OPTIONAL MATCH (u:User)-[r:JOINED_AS]->(s)
+        WHERE s.status IS NULL OR s.status <> 'ended'
+        WITH s, COLLECT(r.role) AS roles, COLLECT(u.username) AS usernames
+        SET s.member_count = size(roles),
+            s.listener_count = size([role IN roles WHERE role = 'listener']),
+            s.speaker_count = size([role IN roles WHERE role = 'speaker']),
+            s.moderator_count = size([role IN roles WHERE role = 'moderator']),
+            s.member_sample = usernames[..$sample_size]
+        RETURN max(id(s)) AS last_id, COUNT(s) AS updated
+        """
+        after, total = -1, 0
+        while True:
+            result = self.graph.run(query, after=after, batch_size=batch_size, sample_size=MEMBER_SAMPLE_SIZE).data()
+            if not result or not result[0]['updated']:
+                return total
+            after = result[0]['last_id']
+            total += result[0]['updated']
+
+    def export_posts(self, since=None):
+        # Iterate the cursor instead of calling .data() so memory stays flat for any corpus size
+        query = """
+        MATCH (p:Post)
+        WHERE $since IS NULL OR p.timestamp >= $since
+        OPTIONAL MATCH (u:User)-[:PUBLISHED_ON|REPOSTED]->(p)
+        OPTIONAL MATCH (p)-[:REPOST_OF]->(original:Post)
+        RETURN p.id AS post_id, u.username AS username, p.text AS text, p.date AS date,
+               p.timestamp AS timestamp, original.id AS repost_of,
+               [(p)-[:HAS_TOPIC]->(t:Topic) | t.name] AS topics
+        """
+        for record in self.graph.run(query, since=since):
+            yield dict(record)
 
-    def get_all_spaces(self, username):
+    def export_spaces(self, since=None):
+        # created_at is stored as an ISO string, so compare against the ISO form of the epoch cut-off
+        since_iso = datetime.fromtimestamp(since).isoformat() if since is not None else None
         query = """
-        MATCH (s:Space)<-[:HOSTS]-(u:User)
-        OPTIONAL MATCH (s)<-[:JOINED_AS]-(j:User)
-        RETURN s.id AS id, s.name AS name, s.description AS description, s.created_at AS created_at, 
-               u.username AS host, s.status AS status, COLLECT(j.username) AS members, COUNT(j) AS member_count,
-               EXISTS((:User {username: $username})-[:JOINED_AS]->(s)) AS is_member,
-               CASE WHEN u.username = $username THEN True ELSE False END AS is_host
-        ORDER BY s.created_at DESC
+        MATCH (s:Space)
+        WHERE $since IS NULL OR s.created_at >= $since
+        OPTIONAL MATCH (host:User)-[:HOSTS]->(s)
+        RETURN s.id AS id, s.name AS name, s.description AS description, s.created_at AS created_at,
+               s.status AS status, host.username AS host,
+               [(s)-[:HAS_TOPIC]->(t:Topic) | t.name] AS topics
         """
-        return self.graph.run(query, username=username).data()
+        for record in self.graph.run(query, since=since_iso):
+            yield dict(record)
 
     def get_all_topics(self):
         query = """
@@ -343,6 +982,7 @@ class Database:
         """
         self.graph.run(query, space_id=space_id)
         print(f"Space with id: {space_id} successfully deleted")
+        self._space_deleted(space_id)
 
     def delete_post(self, username, post_id):
         user = self.find_user(username)
@@ -404,10 +1044,25 @@ class Database:
         space = self.graph.nodes.match("Space", id=space_id).first()
         if not space:
             raise ValueError("Space not found")
+        if space.get("status") == "ended":
+            raise ValueError("Space has ended")
 
-        joined_at = datetime.now().isoformat()
-        self.graph.create(Relationship(user, "JOINED_AS", space, role=role,
-                                       joined_at=joined_at))
+        # Joining twice keeps the original JOINED_AS edge (and its joined_at) instead of adding another.
+        # The status is checked again here in case the space ended since the lookup above.
+        query = """
+        MATCH (u:User {username: $username}), (s:Space {id: $space_id})
+        WHERE coalesce(s.status, '') <> 'ended'
+        WITH u, s, u.username AS username, $role AS role
+        MERGE (u)-[r:JOINED_AS]->(s)
+        ON CREATE SET r.role = role, r.joined_at = $joined_at,""" + SPACE_JOIN_COUNTERS + """
+        RETURN r.joined_at = $joined_at AS created
+        """
+        created = self.graph.run(query, username=username, space_id=space_id, role=role,
+                                 joined_at=datetime.now().isoformat(), sample_size=MEMBER_SAMPLE_SIZE).evaluate()
+        if created:
+            self.update_space_interests([{'username': username, 'space_id': space_id,
+                                          'delta': ROLE_WEIGHTS.get(role, 1) * INTEREST_WEIGHTS['join']}])
+            self._space_joined(space_id, role)
 
     def leave_space(self, username, space_id):
         user = self.find_user(username)
@@ -431,344 +1086,606 @@ class Database:
             left_at = datetime.now()
             duration = (left_at - joined_at).total_seconds()  # Calculate duration in seconds
 
-            self.graph.separate(relationship)
-            self.graph.create(
-                Relationship(user, "LEFT_AS", space, role=relationship["role"],
-                             joined_at=joined_at.isoformat(),
-                             left_at=left_at.isoformat(), duration=duration))
-
-    def end_space(self, username, space_id):
-        user = self.find_user(username)
-        if not user:
-            raise ValueError("User not found")
-
-        space = self.graph.nodes.match("Space", id=space_id).first()
-        if not space:
-            raise ValueError("Space not found")
-
-
-        space_created_at = space["created_at"]
-        if not space_created_at:
-            raise ValueError(f"Space {space_id} does not have a valid created_at time")
-
-        print(f"Ending space with id: {space_id} for user: {username}. "
-              f"Space created at: {space_created_at}")
-
-
+            # Swap JOINED_AS for LEFT_AS and decrement the counters in one statement; a concurrent
+            # leave that got there first matches nothing here
+            query = """
+            MATCH (u:User {username: $username})-[r:JOINED_AS]->(s:Space {id: $space_id})
+            CREATE (u)-[:LEFT_AS {role: r.role, joined_at: r.joined_at, left_at: $left_at, duration: $duration}]->(s)
+            WITH s, r, u.username AS username, r.role AS role
+            DELETE r
+            SET """ + SPACE_LEAVE_COUNTERS + """
+            RETURN role
+            """
+            left = self.graph.run(query, username=username, space_id=space_id, left_at=left_at.isoformat(),
+                                  duration=duration).data()
+            if not left:
+                return
+            self.update_space_interests([{'username': username, 'space_id': space_id,
+                                          'delta': ROLE_WEIGHTS.get(relationship["role"], 1) * duration / 3600}])
+            self._space_left(space_id, relationship["role"])
+
+    def end_space(self, username, space_id, batch_size=END_SPACE_BATCH_SIZE):
+        # Status, the host's HOSTS edge and the first batch of members in one statement, so a space with
+        # up to batch_size members ends in one transaction; every member gets the LEFT_AS shape
+        # leave_space produces. Larger spaces continue batch by batch, each batch its own transaction.
+        # Calling it again on a space that stopped half-way resumes with the original end time.
         query = """
-        MATCH (u:User {username: $username})-[r:HOSTS]->(s:Space {id: $space_id})
-        RETURN r, u.username AS host_username
+        MATCH (u:User {username: $username})-[h:HOSTS]->(s:Space {id: $space_id})
+        WHERE s.created_at IS NOT NULL
+        WITH u, h, s, h.left_at IS NULL AS first,
+             duration.inSeconds(localdatetime(s.created_at), localdatetime($now)) AS hosted
+        SET s.status = 'ended', s.ended_at = coalesce(s.ended_at, $now),
+            s.member_count = 0, s.listener_count = 0, s.speaker_count = 0, s.moderator_count = 0,
+            s.member_sample = [],
+            h.left_at = coalesce(h.left_at, $now),
+            h.duration = CASE WHEN first THEN hosted.seconds + hosted.nanosecondsOfSecond / 1000000000.0
+                              ELSE h.duration END
+        WITH h, s, first, s.ended_at AS left_at
+        CALL {
+            WITH s, left_at""" + FINALIZE_MEMBERS + """
+        }
+        RETURN first, h.duration AS host_duration, left_at AS ended_at, members
         """
-        result = self.graph.run(query, username=username, space_id=space_id).data()
-
+        result = self.graph.run(query, username=username, space_id=space_id, now=datetime.now().isoformat(),
+                                batch_size=batch_size).data()
         if not result:
+            self._end_space_error(username, space_id)
+        record = result[0]
+        self._space_ended(space_id)
+
+        stats = {'space_id': space_id, 'ended_at': record['ended_at'], 'host_duration': record['host_duration'],
+                 'members': 0, 'batches': 0, 'resumed': not record['first']}
+        if record['first']:
+            self.update_space_interests([{'username': username, 'space_id': space_id,
+                                          'delta': ROLE_WEIGHTS['host'] * (record['host_duration'] or 0) / 3600}])
+        members = record['members']
+        while True:
+            self._credit_finalized(space_id, members)
+            stats['members'] += len(members)
+            stats['batches'] += 1
+            if len(members) < batch_size:
+                return stats
+            members = self._finalize_members(space_id, batch_size)
+
+    def _end_space_error(self, username, space_id):
+        # Only reached when end_space matched nothing; work out which check failed
+        query = """
+        OPTIONAL MATCH (u:User {username: $username})
+        OPTIONAL MATCH (s:Space {id: $space_id})
+        RETURN u IS NOT NULL AS user_found, s IS NOT NULL AS space_found,
+               u IS NOT NULL AND s IS NOT NULL AND EXISTS((u)-[:HOSTS]->(s)) AS is_host
+        """
+        record = self.graph.run(query, username=username, space_id=space_id).data()[0]
+        if not record['user_found']:
+            raise ValueError("User not found")
+        if not record['space_found']:
+            raise ValueError("Space not found")
+        if not record['is_host']:
             raise ValueError(f"User {username} is not the host of space with id: {space_id}")
+        raise ValueError(f"Space {space_id} does not have a valid created_at time")
 
-
+    def _finalize_members(self, space_id, batch_size):
         query = """
-        MATCH (u:User {username: $username})-[r:HOSTS]->(s:Space {id: $space_id})
-        WITH r, s, datetime($created_at) AS created_at_dt
-        SET r.left_at = timestamp(),
-            r.duration = (timestamp() - datetime($created_at).epochMillis)/3600000,  // 转换为小时
-            s.status = "ended"
-        RETURN r.duration AS duration
+        MATCH (s:Space {id: $space_id})
+        WITH s, coalesce(s.ended_at, $now) AS left_at
+        CALL {
+            WITH s, left_at""" + FINALIZE_MEMBERS + """
+        }
+        RETURN members
         """
-        duration_result = self.graph.run(query, username=username, space_id=space_id,
-                                         created_at=space_created_at).data()
-
-
-        print(f"Host duration for {username}: {duration_result}")
-
-
+        result = self.graph.run(query, space_id=space_id, now=datetime.now().isoformat(),
+                                batch_size=batch_size).data()
+        return result[0]['members'] if result else []
+
+    def _credit_finalized(self, space_id, members):
+        # Edges converted from the old hours-on-JOINED_AS shape were credited when that space ended
+        self.update_space_interests([{'username': member['username'], 'space_id': space_id,
+                                      'delta': ROLE_WEIGHTS.get(member['role'], 1) * member['seconds'] / 3600}
+                                     for member in members if member['fresh']])
+
+    def finish_ended_spaces(self, batch_size=END_SPACE_BATCH_SIZE):
+        # Completes spaces an interrupted end_space left with JOINED_AS members, and converts spaces
+        # ended before members were finalized (epoch-millisecond left_at and whole hours on HOSTS)
         query = """
-        MATCH (u:User)-[r:JOINED_AS]->(s:Space {id: $space_id})
-        WHERE r.joined_at IS NOT NULL
-        WITH r, datetime(r.joined_at) AS joined_at_dt
-        SET r.left_at = timestamp(),
-            r.duration = (timestamp() - datetime(r.joined_at).epochMillis)/3600000  // 转换为小时
-        RETURN r.duration AS duration
+        MATCH (:User)-[h:HOSTS]->(s:Space {status: 'ended'})
+        WHERE h.left_at IS NOT NULL AND toString(h.left_at) <> h.left_at
+        WITH h, s, toString(localdatetime(datetime({epochMillis: h.left_at}))) AS left_at
+        SET s.ended_at = coalesce(s.ended_at, left_at), h.left_at = left_at,
+            h.duration = coalesce(h.duration, 0) * 3600.0
+        RETURN COUNT(h)
         """
-        member_duration_result = self.graph.run(query, space_id=space_id).data()
-
-
-        print(f"Member duration for space {space_id}: {member_duration_result}")
-
-
+        hosts = self.graph.run(query).evaluate()
         query = """
-        MATCH (s:Space {id: $space_id})
-        SET s.status = "ended"
+        MATCH (s:Space {status: 'ended'})
+        WHERE EXISTS((s)<-[:JOINED_AS]-())
+        RETURN s.id AS id
         """
-        self.graph.run(query, space_id=space_id)
-
-        print(f"Space with id {space_id} ended successfully by {username}.")
+        stats = {'hosts': hosts, 'spaces': 0, 'members': 0}
+        for space_id in [record['id'] for record in self.graph.run(query)]:
+            while True:
+                members = self._finalize_members(space_id, batch_size)
+                self._credit_finalized(space_id, members)
+                stats['members'] += len(members)
+                if len(members) < batch_size:
+                    break
+            stats['spaces'] += 1
+        return stats
+
+    def dedupe_relationships(self, rel_type, batch_size=10000):
+        # Collapse parallel edges of one type between the same pair of nodes, keeping the earliest.
+        # Works through start nodes in id order so each statement only touches one batch.
+        if rel_type not in DEDUPE_RELATIONSHIPS:
+            raise ValueError(f"Unsupported relationship type: {rel_type}")
+        query = """
+        CALL {
+            MATCH (a:User)
+            WHERE id(a) > $after
+            RETURN a
+            ORDER BY id(a)
+            LIMIT $batch_size
+        }
+        WITH COLLECT(a) AS batch
+        WITH batch, id(batch[-1]) AS last_id
+        UNWIND batch AS a
+        OPTIONAL MATCH (a)-[r:%s]->(b)
+        WITH last_id, a, b, r
+        ORDER BY coalesce(r.created_at, r.joined_at), id(r)
+        WITH last_id, a, b, COLLECT(r) AS rels
+        WITH last_id,
+             sum(CASE WHEN size(rels) > 1 THEN size(rels) - 1 ELSE 0 END) AS removed,
+             COLLECT(CASE WHEN size(rels) > 1 THEN tail(rels) END) AS duplicates
+        FOREACH (rels IN duplicates | FOREACH (dup IN rels | DELETE dup))
+        RETURN last_id, removed
+        """ % rel_type
+
+        after, total = -1, 0
+        while True:
+            result = self.graph.run(query, after=after, batch_size=batch_size).data()
+            if not result:
+                return total
+            after = result[0]['last_id']
+            total += result[0]['removed']
 
     def get_user_space_durations(self, username):
         query = """
         MATCH (u:User {username: $username})-[r]->(s:Space)
         WHERE type(r) IN ['JOINED_AS', 'HOSTS', 'LEFT_AS']
-        RETURN s.name AS space_name, r.role AS role, 
-               CASE 
-                   WHEN r.left_at IS NULL THEN (timestamp() - r.joined_at)/3600
+        WITH s, r, CASE type(r) WHEN 'HOSTS' THEN s.created_at ELSE r.joined_at END AS joined_at
+        RETURN s.name AS space_name, r.role AS role,
+               CASE
+                   WHEN r.left_at IS NULL THEN duration.inSeconds(localdatetime(joined_at), localdatetime($now)).seconds
                    ELSE r.duration
-               END AS duration, 
-               r.joined_at AS joined_at, 
-               r.left_at AS left_at, 
+               END AS duration,
+               joined_at,
+               r.left_at AS left_at,
                type(r) AS relationship_type
         """
-        return self.graph.run(query, username=username).data()
+        return self.graph.run(query, username=username, now=datetime.now().isoformat()).data()
 
-    def get_space_vectors(self):
+    def get_space_vectors(self, username=None):
+        # Topic lists per space; with a username, only live spaces the user neither hosts nor has joined
         query = """
-           MATCH (s:Space)-[:HAS_TOPIC]->(t:Topic)
-           RETURN s.id AS id, s.name AS name, COLLECT(t.name) AS topics
-           """
-        spaces = self.graph.run(query).data()
+        OPTIONAL MATCH (me:User {username: $username})
+        MATCH (s:Space)-[:HAS_TOPIC]->(t:Topic)
+        WHERE $username IS NULL
+           OR ((s.status IS NULL OR s.status <> 'ended')
+               AND (me IS NULL OR NOT EXISTS((me)-[:JOINED_AS|HOSTS]->(s))))
+        RETURN s.id AS id, s.name AS name, s.status AS status, COLLECT(t.name) AS topics
+        """
+        return self.graph.run(query, username=username).data()
 
-        all_topics = {record['name'] for record in
-                      self.graph.run("MATCH (t:Topic) RETURN t.name AS name").data()}
+    def get_space_catalogue_version(self):
+        query = """
+        MATCH (c:Catalogue {name: 'spaces'})
+        RETURN c.version
+        """
+        return self.graph.run(query).evaluate() or 0
 
-        space_vectors = []
-        for space in spaces:
-            vector = {topic: 0 for topic in all_topics}
-            for topic in space['topics']:
-                vector[topic] = 1
-            space_vectors.append({'id': space['id'], 'name': space['name'], 'vector': vector})
+    def bump_space_catalogue_version(self):
+        # Every space write bumps this so other workers know their cached matrix is stale
+        query = """
+        MERGE (c:Catalogue {name: 'spaces'})
+        SET c.version = coalesce(c.version, 0) + 1
+        RETURN c.version
+        """
+        version = self.graph.run(query).evaluate()
+        self.recommendation_cache.set_catalogue_version(version)
+        return version
 
-        return space_vectors
+    def get_user_space_ids(self, username):
+        query = """
+        MATCH (:User {username: $username})-[:JOINED_AS|HOSTS]->(s:Space)
+        RETURN DISTINCT s.id AS id
+        """
+        return {record['id'] for record in self.graph.run(query, username=username)}
 
     def calculate_user_topic_vector(self, username):
-        vector = {}
-        query = "MATCH (t:Topic) RETURN t.name AS topic"
-        result = self.graph.run(query).data()
-        for record in result:
-            vector[record['topic']] = 0
-
-
+        # Sparse {topic: weight} over the topics this user touched, aggregated in one query.
+        # Spaces: role weight x hours (time since joining while a member, the recorded stay after leaving);
+        # each post +3, repost +2 (topics of the reposted post), like +1.
         query = """
-        MATCH (u:User {username: $username})-[j:JOINED_AS]->(s:Space)-[:HAS_TOPIC]->(t:Topic)
-        WITH t.name AS topic, j.role AS role, j.joined_at AS joined_at, j.left_at AS left_at, 
-        j.duration AS duration, s.status AS space_status
-        RETURN topic, role, joined_at, left_at, duration, space_status
+        MATCH (u:User {username: $username})
+        CALL {
+            WITH u
+            MATCH (u)-[j:JOINED_AS|LEFT_AS]->(:Space)-[:HAS_TOPIC]->(t:Topic)
+            WITH t, j, coalesce($role_weights[j.role], 1.0) AS role_weight
+            RETURN t.name AS topic,
+                   role_weight * CASE type(j) WHEN 'LEFT_AS' THEN coalesce(j.duration, 0) / 3600.0
+                       ELSE duration.inSeconds(localdatetime(j.joined_at), localdatetime($now)).seconds / 3600.0
+                   END AS weight
+            UNION ALL
+            WITH u
+            MATCH (u)-[:PUBLISHED_ON]->(:Post)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t.name AS topic, 3.0 AS weight
+            UNION ALL
+            WITH u
+            MATCH (u)-[:REPOSTED]->(:Post)-[:REPOST_OF*0..1]->(:Post)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t.name AS topic, 2.0 AS weight
+            UNION ALL
+            WITH u
+            MATCH (u)-[:LIKES]->(:Post)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t.name AS topic, 1.0 AS weight
+        }
+        RETURN topic, sum(weight) AS weight
         """
-        result = self.graph.run(query, username=username).data()
-
-        role_weight = {"listener": 1, "speaker": 1.5, "moderator": 1.7, "host": 2}
-
-        for record in result:
-            topic = record['topic']
-            role = record['role']
+        result = self.graph.run(query, username=username, now=datetime.now().isoformat(),
+                                role_weights=ROLE_WEIGHTS)
+        return {record['topic']: record['weight'] for record in result if record['weight']}
+
+    def update_post_interests(self, rows):
+        # rows: {username, post_id, delta}; a repost credits the topics of the post it points to
+        if not rows:
+            return
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username}),
+              (:Post {id: row.post_id})-[:REPOST_OF*0..1]->(:Post)-[:HAS_TOPIC]->(t:Topic)
+        WITH u, t, sum(row.delta) AS delta
+        """ + INTEREST_UPDATE
+        self.graph.run(query, rows=rows, now=datetime.now().timestamp(), half_life=self.interest_half_life)
+        self.bump_user_activity(row['username'] for row in rows)
+
+    def update_space_interests(self, rows):
+        # rows: {username, space_id, delta}
+        if not rows:
+            return
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username}), (:Space {id: row.space_id})-[:HAS_TOPIC]->(t:Topic)
+        WITH u, t, sum(row.delta) AS delta
+        """ + INTEREST_UPDATE
+        self.graph.run(query, rows=rows, now=datetime.now().timestamp(), half_life=self.interest_half_life)
+        self.bump_user_activity(row['username'] for row in rows)
+
+    def get_user_interest_profile(self, username):
+        # Decay is applied lazily from each entry's last update, so reads never rewrite the graph
+        query = """
+        MATCH (:User {username: $username})-[i:INTERESTED_IN]->(t:Topic)
+        RETURN t.name AS topic, i.score * 0.5 ^ (($now - i.updated_at) / $half_life) AS weight
+        """
+        result = self.graph.run(query, username=username, now=datetime.now().timestamp(),
+                                half_life=self.interest_half_life)
+        return {record['topic']: record['weight'] for record in result if record['weight'] > 0}
 
+    def rebuild_user_profiles(self, batch_size=500):
+        # Recompute every profile from the full history, each event decayed by its age
+        query = """
+        UNWIND $usernames AS username
+        MATCH (u:User {username: username})
+        OPTIONAL MATCH (u)-[old:INTERESTED_IN]->(:Topic)
+        DELETE old
+        WITH DISTINCT u
+        CALL {
+            WITH u
+            MATCH (u)-[:PUBLISHED_ON]->(p:Post)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t, $weights.post AS weight, $now - p.timestamp AS age
+            UNION ALL
+            WITH u
+            MATCH (u)-[:REPOSTED]->(r:Post)-[:REPOST_OF*0..1]->(:Post)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t, $weights.repost AS weight, $now - r.timestamp AS age
+            UNION ALL
+            WITH u
+            MATCH (u)-[l:LIKES]->(:Post)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t, $weights.like AS weight,
+                   duration.inSeconds(localdatetime(l.created_at), localdatetime($now_iso)).seconds AS age
+            UNION ALL
+            WITH u
+            MATCH (u)-[j:JOINED_AS|LEFT_AS]->(:Space)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t, coalesce($role_weights[j.role], 1.0) * $weights.join AS weight,
+                   duration.inSeconds(localdatetime(j.joined_at), localdatetime($now_iso)).seconds AS age
+            UNION ALL
+            WITH u
+            MATCH (u)-[j:LEFT_AS]->(:Space)-[:HAS_TOPIC]->(t:Topic)
+            RETURN t, coalesce($role_weights[j.role], 1.0) * coalesce(j.duration, 0) / 3600.0 AS weight,
+                   duration.inSeconds(localdatetime(j.left_at), localdatetime($now_iso)).seconds AS age
+            UNION ALL
+            WITH u
+            MATCH (u)-[h:HOSTS]->(:Space {status: 'ended'})-[:HAS_TOPIC]->(t:Topic)
+            // Spaces ended before finish-ended-spaces ran keep epoch-millisecond left_at and whole hours
+            WITH t, h, toString(h.left_at) = h.left_at AS iso
+            RETURN t, $role_weights.host * coalesce(h.duration, 0) / CASE WHEN iso THEN 3600.0 ELSE 1.0 END AS weight,
+                   CASE WHEN iso THEN duration.inSeconds(localdatetime(h.left_at), localdatetime($now_iso)).seconds
+                        ELSE $now - h.left_at / 1000.0 END AS age
+        }
+        WITH u, t, sum(weight * 0.5 ^ (coalesce(age, 0) / $half_life)) AS score
+        WHERE score > 0
+        MERGE (u)-[i:INTERESTED_IN]->(t)
+        SET i.score = score, i.updated_at = $now
+        """
+        users_query = """
+        MATCH (u:User)
+        WHERE id(u) > $after
+        RETURN id(u) AS node_id, u.username AS username
+        ORDER BY id(u)
+        LIMIT $batch_size
+        """
+        after, total = -1, 0
+        while True:
+            batch = self.graph.run(users_query, after=after, batch_size=batch_size).data()
+            if not batch:
+                return total
+            now = datetime.now()
+            self.graph.run(query, usernames=[record['username'] for record in batch],
+                           now=now.timestamp(), now_iso=now.isoformat(), half_life=self.interest_half_life,
+                           weights=INTEREST_WEIGHTS, role_weights=ROLE_WEIGHTS)
+            after = batch[-1]['node_id']
+            total += len(batch)
+
+    def iter_interest_profiles(self):
+        query = """
+        MATCH (u:User)-[i:INTERESTED_IN]->(t:Topic)
+        RETURN u.username AS username, t.name AS topic,
+               i.score * 0.5 ^ (($now - i.updated_at) / $half_life) AS weight
+        """
+        for record in self.graph.run(query, now=datetime.now().timestamp(), half_life=self.interest_half_life):
+            yield dict(record)
 
-            if record['space_status'] == 'ended':
-                duration = record['duration']
-            else:
-                joined_at = datetime.strptime(record['joined_at'], "%Y-%m-%dT%H:%M:%S.%f")
-                duration = (datetime.now() - joined_at).total_seconds() / 3600
+    def iter_user_space_memberships(self):
+        query = """
+        MATCH (u:User)-[:JOINED_AS|HOSTS]->(s:Space)
+        WHERE s.status IS NULL OR s.status <> 'ended'
+        RETURN u.username AS username, s.id AS space_id
+        """
+        for record in self.graph.run(query):
+            yield dict(record)
 
-            weight = role_weight.get(role, 1) * duration
-            vector[topic] += weight
+    def write_recommendations(self, rows, generation, computed_at):
+        query = """
+        UNWIND $rows AS row
+        MATCH (u:User {username: row.username}), (s:Space {id: row.space_id})
+        MERGE (u)-[r:RECOMMENDED]->(s)
+        SET r.score = row.score, r.rank = row.rank, r.generation = $generation, r.computed_at = $computed_at
+        """
+        self.graph.run(query, rows=rows, generation=generation, computed_at=computed_at)
+
+    def prune_generation(self, rel_type, generation, batch_size=10000):
+        # Remove edges from older generations in bounded transactions
+        if rel_type not in PRECOMPUTED_RELATIONSHIPS:
+            raise ValueError(f"Not a precomputed relationship type: {rel_type}")
+        query = f"""
+        MATCH ()-[r:{rel_type}]->()
+        WHERE r.generation <> $generation
+        WITH r
+        LIMIT $batch_size
+        DELETE r
+        RETURN COUNT(*) AS removed
+        """
+        total = 0
+        while True:
+            removed = self.graph.run(query, generation=generation, batch_size=batch_size).evaluate()
+            if not removed:
+                return total
+            total += removed
+
+    def iter_space_engagements(self):
+        # Every user-space engagement with the hours spent; open memberships and live hosts count the time so far
+        query = """
+        MATCH (u:User)-[r:JOINED_AS|LEFT_AS|HOSTS]->(s:Space)
+        RETURN u.username AS username, s.id AS space_id, type(r) AS kind, r.role AS role,
+               CASE
+                   WHEN type(r) = 'LEFT_AS' THEN coalesce(r.duration, 0) / 3600.0
+                   // Hosts of spaces ended before finish-ended-spaces ran keep whole hours
+                   WHEN r.left_at IS NOT NULL
+                       THEN coalesce(r.duration, 0) / CASE WHEN toString(r.left_at) = r.left_at THEN 3600.0 ELSE 1.0 END
+                   ELSE duration.inSeconds(localdatetime(CASE type(r) WHEN 'HOSTS' THEN s.created_at
+                                                                      ELSE r.joined_at END),
+                                           localdatetime($now)).seconds / 3600.0
+               END AS hours
+        """
+        for record in self.graph.run(query, now=datetime.now().isoformat()):
+            yield dict(record)
 
+    def write_space_similarities(self, rows, generation):
+        query = """
+        UNWIND $rows AS row
+        MATCH (s:Space {id: row.space_id}), (n:Space {id: row.neighbour_id})
+        MERGE (s)-[r:SIMILAR_SPACE]->(n)
+        SET r.score = row.score, r.generation = $generation
+        """
+        self.graph.run(query, rows=rows, generation=generation)
 
+    def get_item_cf_scores(self, username, top_n=50):
+        # "People who joined what you joined also joined": neighbours of the user's spaces,
+        # weighted by the role they held, skipping ended spaces and ones they are already in
         query = """
-            MATCH (u:User {username: $username})-[:PUBLISHED_ON]->(p:Post)-[:HAS_TOPIC]->(t:Topic)
-            RETURN t.name AS topic, COUNT(p) AS post_count
-            """
-        result = self.graph.run(query, username=username).data()
-        for record in result:
-            topic = record['topic']
-            vector[topic] += record['post_count'] * 3  # Each posts +3 points
+        MATCH (u:User {username: $username})-[r:JOINED_AS|LEFT_AS|HOSTS]->(:Space)-[sim:SIMILAR_SPACE]->(c:Space)
+        WHERE (c.status IS NULL OR c.status <> 'ended')
+          AND NOT EXISTS((u)-[:JOINED_AS|HOSTS]->(c))
+        WITH c, SUM(sim.score * CASE type(r) WHEN 'HOSTS' THEN $role_weights.host
+                                ELSE coalesce($role_weights[r.role], 1) END) AS score
+        RETURN c.id AS id, score
+        ORDER BY score DESC
+        LIMIT $top_n
+        """
+        return [(record['id'], record['score'])
+                for record in self.graph.run(query, username=username, role_weights=ROLE_WEIGHTS, top_n=top_n)]
 
+    def get_similar_spaces(self, space_id, top_n=5, username=None):
         query = """
-            MATCH (u:User {username: $username})-[:REPOSTED]->(p:Post)-[:HAS_TOPIC]->(t:Topic)
-            RETURN t.name AS topic, COUNT(p) AS repost_count
-            """
-        result = self.graph.run(query, username=username).data()
-        for record in result:
-            topic = record['topic']
-            vector[topic] += record['repost_count'] * 2  # Each repost +2 points
+        MATCH (:Space {id: $space_id})-[sim:SIMILAR_SPACE]->(s:Space)
+        WHERE s.status IS NULL OR s.status <> 'ended'
+        RETURN s.id AS id, sim.score AS similarity
+        ORDER BY similarity DESC
+        LIMIT $top_n
+        """
+        result = self.graph.run(query, space_id=space_id, top_n=top_n).data()
+        scores = {record['id']: {'similarity': record['similarity']} for record in result}
+        return self.hydrate_spaces([record['id'] for record in result], viewer=username, extra=scores)
 
+    def get_precomputed_scores(self, username):
+        # The batch job's ranked output as ([(space_id, score)], computed_at)
         query = """
-            MATCH (u:User {username: $username})-[:LIKES]->(p:Post)-[:HAS_TOPIC]->(t:Topic)
-            RETURN t.name AS topic, COUNT(p) AS like_count
-            """
+        MATCH (:User {username: $username})-[r:RECOMMENDED]->(s:Space)
+        RETURN s.id AS id, r.score AS score, r.computed_at AS computed_at
+        ORDER BY r.rank
+        """
         result = self.graph.run(query, username=username).data()
-        for record in result:
-            topic = record['topic']
-            vector[topic] += record['like_count'] * 1  # each like +1 points
-
-        return vector
-
-
-
-
+        if not result:
+            return [], None
+        return [(record['id'], record['score']) for record in result], result[0]['computed_at']
 
-    def get_user_behavior(self, username):
+    def get_user_recommendation_state(self, username):
+        # Everything the cold-start decision needs in one query: degree counts come from the
+        # node's relationship store instead of expanding every post and like
         query = """
         MATCH (u:User {username: $username})
-        OPTIONAL MATCH (u)-[:PUBLISHED_ON]->(p:Post)    
-        OPTIONAL MATCH (u)-[:REPOSTED]->(r:Post)        
-        OPTIONAL MATCH (u)-[:LIKES]->(liked:Post)       
-        OPTIONAL MATCH (u)-[:JOINED_AS]->(s:Space)      
-        RETURN COUNT(DISTINCT p) AS posts_count, 
-               COUNT(DISTINCT r) AS reposts_count, 
-               COUNT(DISTINCT liked) AS likes_count,
-               COUNT(DISTINCT s) AS spaces_count
+        OPTIONAL MATCH (u)-[:JOINED_AS|HOSTS]->(s:Space)
+        WITH u, COLLECT(DISTINCT s.id) AS space_ids
+        RETURN size((u)-[:PUBLISHED_ON]->()) + size((u)-[:REPOSTED]->()) + size((u)-[:LIKES]->()) +
+               size((u)-[:LEFT_AS]->()) + size(space_ids) AS activity,
+               size((u)-[:FOLLOWS]->()) AS following,
+               space_ids
         """
-        result = self.graph.run(query, username=username).data()
-
-
-        if result and result[0]:
-            return {
-                'posts_count': result[0]['posts_count'],
-                'reposts_count': result[0]['reposts_count'],
-                'likes_count': result[0]['likes_count'],
-                'spaces_count': result[0]['spaces_count']
-            }
-        return None
-
-    def get_user_following_count(self, username):
+        record = self.graph.run(query, username=username).data()
+        if not record:
+            return {'activity': 0, 'following': 0, 'space_ids': set()}
+        return {'activity': record[0]['activity'], 'following': record[0]['following'],
+                'space_ids': set(record[0]['space_ids'])}
+
+    def hydrate_spaces(self, space_ids, viewer=None, extra=None):
+        # Host, status, member count and viewer membership for a ranked id list in one query.
+        # Order follows space_ids; spaces without a host come back with host 'Unknown'.
+        if not space_ids:
+            return []
         query = """
-        MATCH (u:User {username: $username})-[:FOLLOWS]->(f:User)
-        RETURN COUNT(DISTINCT f) AS following_count
+        OPTIONAL MATCH (viewer:User {username: $viewer})
+        UNWIND range(0, size($space_ids) - 1) AS position
+        MATCH (s:Space {id: $space_ids[position]})
+        OPTIONAL MATCH (host:User)-[:HOSTS]->(s)
+        WITH viewer, position, s, COLLECT(host.username)[0] AS host
+        RETURN s.id AS id, s.name AS name, s.description AS description, s.created_at AS created_at,
+               s.status AS status, host,
+               coalesce(s.member_count, 0) AS member_count,
+               viewer IS NOT NULL AND EXISTS((viewer)-[:JOINED_AS]->(s)) AS is_member,
+               host IS NOT NULL AND host = $viewer AS is_host
+        ORDER BY position
         """
-        result = self.graph.run(query, username=username).data()
-
-
-        if result and result[0]:
-            return result[0]['following_count']
-        return 0
-
-    def get_latest_spaces(self, top_n=5):
+        spaces = []
+        for record in self.graph.run(query, space_ids=list(space_ids), viewer=viewer):
+            space = dict(record)
+            space['description'] = space['description'] or 'No description available'
+            space['host'] = space['host'] or 'Unknown'
+            space['created_at'] = space['created_at'] or 'Unknown'
+            space['status'] = space['status'] or 'alive'
+            space.update((extra or {}).get(space['id'], {}))
+            spaces.append(space)
+        return spaces
+
+    def get_latest_space_ids(self, top_n=5):
         query = """
         MATCH (s:Space)
-        RETURN s.id AS id, s.name AS name, s.description AS description, 
-        s.created_at AS created_at, 
-               s.status AS status
+        RETURN s.id AS id
         ORDER BY s.created_at DESC
         LIMIT $top_n
         """
-        return self.graph.run(query, top_n=top_n).data()
+        return [record['id'] for record in self.graph.run(query, top_n=top_n)]
 
-    def get_recommendations_from_friends(self, username, top_n=5):
+    def get_friend_space_ids(self, username, top_n=5):
+        # Spaces the people this user follows have joined, newest first
         query = """
-        MATCH (u:User {username: $username})-[:FOLLOWS]->(friend:User)-[:JOINED_AS]->(s:Space)
-        RETURN s.id AS id, s.name AS name, 
-        s.description AS description, s.created_at AS created_at, 
-               friend.username AS friend, s.status AS status
+        MATCH (u:User {username: $username})-[:FOLLOWS]->(:User)-[:JOINED_AS]->(s:Space)
+        WITH DISTINCT s
+        RETURN s.id AS id
         ORDER BY s.created_at DESC
         LIMIT $top_n
         """
-        return self.graph.run(query, username=username, top_n=top_n).data()
-
-    def recommend_spaces_based_on_behavior(self, username, top_n=5):
-        user_vector = self.calculate_user_topic_vector(username)
-        space_vectors = self.get_space_vectors()
-
-        # Check if space_vectors is empty
-        if not space_vectors:
-            return []
-
-        user_vector_values = np.array([list(user_vector.values())])
-        space_vectors_values = np.array([list(space['vector'].values())
-                                         for space in space_vectors])
-
-
-        similarities = cosine_similarity(user_vector_values, space_vectors_values)[0]
-        top_indices = similarities.argsort()[-top_n:][::-1]
-
-        recommended_spaces = []
-        for index in top_indices:
-            space = space_vectors[index]
-            space_info = self.graph.run("""
-                MATCH (s:Space {id: $space_id})<-[:HOSTS]-(u:User)
-                RETURN s.id AS id, s.name AS name, s.description AS description, s.created_at AS created_at, 
-                       s.status AS status, u.username AS host
-            """, space_id=space['id']).data()[0]
-
-            recommended_spaces.append({
-                'id': space_info['id'],
-                'name': space_info['name'],
-                'description': space_info.get('description', 'No description available'),
-                'host': space_info.get('host', 'Unknown'),
-                'created_at': space_info.get('created_at', 'Unknown'),
-                'status': space_info.get('status', 'alive')
-            })
-
-        return recommended_spaces
-
-    def recommend_spaces(self, username, top_n=5):
-        # Get user behavioural data and number of followers
-        user_behavior = self.get_user_behavior(username)
-        following_count = self.get_user_following_count(username)
-
-        # Determine user behaviour or relationship of interest
-        if user_behavior['posts_count'] == 0 and user_behavior['reposts_count'] == 0 and user_behavior['likes_count'] == 0 and user_behavior['spaces_count'] == 0 and following_count == 0:
-            # New users, with no behaviour or following anyone, return to the space of the latest release
-            return self.get_latest_spaces(top_n=top_n)
-
-        elif user_behavior['posts_count'] == 0 and user_behavior['reposts_count'] == 0 and user_behavior['likes_count'] == 0 and user_behavior['spaces_count'] == 0 and following_count > 0:
-        # Users with followers but no behaviours, recommending spaces that friends have participated in
-            return self.get_recommendations_from_friends(username, top_n=top_n)
-        else:
-        # Users with behavioural data, using behaviour-based recommendation logic
-            return self.recommend_spaces_based_on_behavior(username, top_n)
-
-        # Test Node similarity
-        # return self.recommend_spaces_using_similarity(username, top_n)
-
-    # Neo4j Node similarity
-    # def recommend_spaces_using_similarity(self, username, top_n=5):
-    #
-    #     create_graph_query = """
-    #     CALL gds.graph.project(
-    #       'userSpaceGraph',
-    #       ['User', 'Space'],
-    #       {
-    #         JOINED_AS: {
-    #           type: 'JOINED_AS',orientation: 'UNDIRECTED'
-    #         },
-    #          HOSTS: {
-    #           type: 'HOSTS',orientation: 'UNDIRECTED'
-    #         }
-    #       }
-    #     )
-    #     """
-    #     self.graph.run(create_graph_query)
-    #
-    #
-    #     similarity_query = """
-    #     CALL gds.nodeSimilarity.stream('userSpaceGraph')
-    #     YIELD node1, node2, similarity
-    #     RETURN gds.util.asNode(node1).username AS user1,
-    #            gds.util.asNode(node2).username AS user2,
-    #            similarity
-    #     ORDER BY similarity DESC
-    #     """
-    #
-    #
-    #     results = self.graph.run(similarity_query).data()
-    #
-    #
-    #     similar_users = [record['user2'] for record in results if record['user1'] == username]
-    #
-    #     if not similar_users:
-    #         return []
-    #
-    #
-    #     query = """
-    #     MATCH (u:User)-[:JOINED_AS]->(s:Space)
-    #     WHERE u.username IN $similar_users
-    #     RETURN s.id AS id, s.name AS name, s.description AS description,
-    #            s.created_at AS created_at,
-    #            u.username AS host
-    #     ORDER BY s.created_at DESC
-    #     LIMIT $top_n
-    #     """
-    #
-    #     recommended_spaces = self.graph.run(query, similar_users=similar_users, top_n=top_n).data()
-    #
-    #     return recommended_spaces
+        return [record['id'] for record in self.graph.run(query, username=username, top_n=top_n)]
 
+    def iter_recent_space_joins(self, since):
+        # Current memberships of live spaces plus departures that joined after since, to warm the trending counters
+        query = """
+        MATCH (:User)-[r:JOINED_AS|LEFT_AS]->(s:Space)
+        WHERE (s.status IS NULL OR s.status <> 'ended')
+          AND (type(r) = 'JOINED_AS' OR r.joined_at >= $since)
+        RETURN s.id AS space_id, r.role AS role, r.joined_at AS joined_at,
+               CASE type(r) WHEN 'LEFT_AS' THEN r.left_at END AS left_at
+        """
+        for record in self.graph.run(query, since=since):
+            yield dict(record)
 
+    def write_trending_snapshot(self, rows, computed_at):
+        # Each worker only counts its own events, so it replaces its share (TRENDING_SHARE edges from
+        # its TrendingWorker node) and the ranking stamped on the Space nodes is the sum over workers.
+        # Scores are linear in the counters, so the sum is exact for spaces in every worker's top_k.
+        query = """
+        MERGE (w:TrendingWorker {id: $worker})
+        SET w.computed_at = $computed_at
+        WITH w
+        OPTIONAL MATCH (w)-[old:TRENDING_SHARE]->()
+        DELETE old
+        WITH DISTINCT w
+        CALL {
+            WITH w
+            UNWIND $rows AS row
+            MATCH (s:Space {id: row.space_id})
+            CREATE (w)-[:TRENDING_SHARE {score: row.score}]->(s)
+            RETURN count(*) AS shared
+        }
+        RETURN shared
+        """
+        self.graph.run(query, worker=self.worker_id, rows=rows, computed_at=computed_at)
 
+        # Re-rank from every live share. Setting the lock node first makes concurrent re-rankings
+        # wait for each other instead of clearing each other's ranks.
+        stale_after = TRENDING_STALE_SNAPSHOTS * (self.trending_snapshot_interval or self.trending.window)
+        cutoff = datetime.fromtimestamp(datetime.fromisoformat(computed_at).timestamp() - stale_after).isoformat()
+        query = """
+        MERGE (lock:Catalogue {name: 'trending'})
+        SET lock.computed_at = $computed_at
+        WITH lock
+        CALL {
+            MATCH (stale:TrendingWorker)
+            WHERE stale.computed_at < $cutoff
+            DETACH DELETE stale
+            RETURN count(*) AS dropped
+        }
+        CALL {
+            MATCH (s:Space)
+            WHERE s.trending_rank IS NOT NULL
+            REMOVE s.trending_rank, s.trending_score, s.trending_at
+            RETURN count(*) AS cleared
+        }
+        CALL {
+            MATCH (:TrendingWorker)-[t:TRENDING_SHARE]->(s:Space)
+            WHERE coalesce(s.status, '') <> 'ended'
+            WITH s, sum(t.score) AS score
+            ORDER BY score DESC, s.id
+            LIMIT $top_k
+            RETURN collect({space: s, score: score}) AS ranked
+        }
+        UNWIND range(0, size(ranked) - 1) AS position
+        WITH ranked[position].space AS s, position + 1 AS rank, ranked[position].score AS score
+        SET s.trending_rank = rank, s.trending_score = score, s.trending_at = $computed_at
+        """
+        self.graph.run(query, computed_at=computed_at, cutoff=cutoff, top_k=self.trending.top_k)
 
+    def get_trending_snapshot(self, top_n=5):
+        # The last written ranking as [(space_id, score)], for workers whose own counters are still empty
+        query = """
+        MATCH (s:Space)
+        WHERE s.trending_rank IS NOT NULL AND (s.status IS NULL OR s.status <> 'ended')
+        RETURN s.id AS id, s.trending_score AS score
+        ORDER BY s.trending_rank
+        LIMIT $top_n
+        """
+        return [(record['id'], record['score']) for record in self.graph.run(query, top_n=top_n)]
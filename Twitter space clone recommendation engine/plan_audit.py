@@ -0,0 +1,248 @@
+import argparse
+import ast
+import inspect
+import sys
+import types
+
+from py2neo import Node
+
+import models
+from models import Database
+
+NEO4J_URI = "bolt://localhost:7687"
+NEO4J_USER = "neo4j"
+NEO4J_PASSWORD = "12345678"
+
+# Plan operators that mean a query is not using an index or is joining unrelated rows
+FLAGGED_OPERATORS = {"NodeByLabelScan", "AllNodesScan", "CartesianProduct"}
+# Methods that don't issue application queries of their own
+SKIPPED_METHODS = {"ensure_schema"}
+
+SAMPLE_ARGS = {
+    "username": "audit_user",
+    "target_username": "audit_target",
+    "viewer": "audit_user",
+    "password": "audit",
+    "email": "audit@example.com",
+    "post_id": "audit-post",
+    "post_ids": ["audit-post"],
+    "space_id": "audit-space",
+    "comment_id": "audit-comment",
+    "text": "audit #audit",
+    "comment_text": "audit",
+    "tags": ["audit"],
+    "topics": ["audit"],
+    "space_name": "audit",
+    "space_description": "audit",
+    "role": "listener",
+    "rel_type": "LIKES",
+    "usernames": ["audit_user"],
+    "since": 0,
+    "generation": 0,
+    "computed_at": "2000-01-01T00:00:00",
+    "cursor": None,
+    "items": [{"username": "audit_user", "post_id": "audit-post"}],
+    "rows": [{"username": "audit_user", "post_id": "audit-post", "target": "audit_target"}],
+    "posts": [{"username": "audit_user", "text": "audit", "tags": ["audit"]}],
+    "spaces": [{"host": "audit_user", "name": "audit", "topics": ["audit"]}],
+    "users": [{"username": "audit_user"}],
+    "memberships": [{"username": "audit_user", "space_id": "audit-space"}],
+}
+
+
+def matcher_query(label, keys):
+    # The Cypher NodeMatcher.match(label, **properties).first() sends
+    conditions = " AND ".join(f"_.{key} = ${key}" for key in keys)
+    return f"MATCH (_:{label}){' WHERE ' + conditions if conditions else ''} RETURN _ LIMIT 1"
+
+
+def caller_line():
+    # Line in models.py that issued the statement currently being recorded
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename != models.__file__:
+        frame = frame.f_back
+    return frame.f_lineno if frame is not None else None
+
+
+def call_sites(cls=Database):
+    # Every graph.run, NodeMatcher lookup and OGM write in the class body, keyed by method:
+    # {method: [{'lines': (first, last), 'kind', 'query'}]}. 'query' is the statement rebuilt from
+    # the source when it only depends on module constants, else None.
+    source = inspect.getsource(models)
+    tree = ast.parse(source)
+    body = next(node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == cls.__name__)
+    sites = {}
+    for function in body.body:
+        if not isinstance(function, ast.FunctionDef) or function.name in SKIPPED_METHODS:
+            continue
+        assignments = [node for node in ast.walk(function) if isinstance(node, ast.Assign)
+                       and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)]
+        for call in ast.walk(function):
+            if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Attribute):
+                continue
+            owner = ast.get_source_segment(source, call.func.value)
+            site = {'lines': (call.lineno, call.end_lineno), 'query': None}
+            if call.func.attr == "run" and owner == "self.graph" and call.args:
+                site['kind'] = "run"
+                expression = call.args[0]
+                if isinstance(expression, ast.Name):
+                    earlier = [node for node in assignments
+                               if node.targets[0].id == expression.id and node.lineno < call.lineno]
+                    expression = max(earlier, key=lambda node: node.lineno).value if earlier else None
+                if expression is not None:
+                    try:
+                        site['query'] = eval(ast.get_source_segment(source, expression), vars(models))
+                    except Exception:
+                        pass
+            elif call.func.attr == "match" and owner in ("self.matcher", "self.graph.nodes"):
+                site['kind'] = "match"
+                if call.args and isinstance(call.args[0], ast.Constant):
+                    site['query'] = matcher_query(call.args[0].value, [keyword.arg for keyword in call.keywords])
+            elif call.func.attr in ("create", "separate") and owner == "self.graph":
+                site['kind'] = "ogm"
+            else:
+                continue
+            sites.setdefault(function.name, []).append(site)
+    return sites
+
+
+class StubNodes:
+    # Stands in for graph.nodes / NodeMatcher: EXPLAINs the lookup it replaces, then lets the
+    # existence check pass without touching the database
+    def __init__(self, explain_graph):
+        self.explain_graph = explain_graph
+
+    def match(self, label, **properties):
+        self.explain_graph.record(matcher_query(label, properties), properties)
+        return types.SimpleNamespace(first=lambda: Node(label, **properties))
+
+
+class ExplainGraph:
+    # Runs every statement as EXPLAIN, records the plan and the line that issued it, and drops
+    # OGM writes on the floor
+    def __init__(self, graph):
+        self.graph = graph
+        self.nodes = StubNodes(self)
+        self.statements = []
+
+    def record(self, query, parameters):
+        cursor = self.graph.run("EXPLAIN " + query, **parameters)
+        self.statements.append((caller_line(), query, cursor.plan()))
+        return cursor
+
+    def run(self, query, **parameters):
+        return self.record(query, parameters)
+
+    def create(self, subgraph):
+        pass
+
+    def separate(self, subgraph):
+        pass
+
+
+def plan_operators(plan):
+    # py2neo exposes plans either as objects or as dicts depending on the version
+    if plan is None:
+        return
+    if isinstance(plan, dict):
+        operator = plan.get("operatorType") or plan.get("operator_type")
+        children = plan.get("children", [])
+    else:
+        operator = getattr(plan, "operator_type", None)
+        children = getattr(plan, "children", [])
+    if operator:
+        yield operator.split("@")[0]
+    for child in children:
+        yield from plan_operators(child)
+
+
+def audit(db):
+    # Two passes. Calling each public method with sample arguments audits the statements it reaches
+    # with real parameters; EXPLAIN returns no rows, so branches on evaluate()/data() stop early.
+    # Every call site the calls did not reach is then EXPLAINed from its query string, and the
+    # ones whose query is built at run time are reported as not audited.
+    explain_graph = ExplainGraph(db.graph)
+    db.graph = explain_graph
+    db.matcher = explain_graph.nodes
+
+    errors = {}
+    for name, method in inspect.getmembers(db, inspect.ismethod):
+        if name.startswith("_") or name in SKIPPED_METHODS:
+            continue
+        parameters = inspect.signature(method).parameters.values()
+        missing = [p.name for p in parameters
+                   if p.default is inspect.Parameter.empty and p.name not in SAMPLE_ARGS]
+        if missing:
+            errors[name] = f"no sample value for {', '.join(missing)}"
+            continue
+        arguments = {p.name: SAMPLE_ARGS[p.name] for p in parameters if p.name in SAMPLE_ARGS}
+        try:
+            result = method(**arguments)
+            if inspect.isgenerator(result):
+                list(result)
+        except Exception as e:
+            errors[name] = str(e)
+
+    reached = explain_graph.statements
+    report = {}
+    for name, sites in call_sites(type(db)).items():
+        entries = []
+        for site in sites:
+            first, last = site['lines']
+            runs = [(query, plan) for line, query, plan in reached if line is not None and first <= line <= last]
+            entry = {'line': first, 'kind': site['kind'], 'query': None, 'plan': None, 'audited': None}
+            if runs:
+                entry.update(query=runs[0][0], plan=runs[0][1], audited="run")
+            elif site['query'] is not None:
+                entry['query'] = site['query']
+                try:
+                    entry.update(plan=explain_graph.graph.run("EXPLAIN " + site['query']).plan(), audited="static")
+                except Exception as e:
+                    entry['error'] = str(e)
+            entries.append(entry)
+        report[name] = {'sites': entries, 'error': errors.get(name)}
+    return report
+
+
+def print_report(report):
+    problems = unaudited = 0
+    for name, entry in sorted(report.items()):
+        sites = entry['sites']
+        counts = {how: sum(1 for site in sites if site['audited'] == how) for how in ("run", "static")}
+        missed = [site for site in sites if site['audited'] is None]
+        flagged = []
+        for site in sites:
+            operators = set(plan_operators(site['plan'])) & FLAGGED_OPERATORS
+            if operators:
+                flagged.append((site['line'], " ".join(site['query'].split())[:100], sorted(operators)))
+        status = "FLAGGED" if flagged else "partial" if missed else "ok"
+        print(f"{name}: {len(sites)} call sites ({counts['run']} run, {counts['static']} from source, "
+              f"{len(missed)} not audited), {status}")
+        for line, query, operators in flagged:
+            print(f"    line {line} {', '.join(operators)}: {query}")
+        for site in missed:
+            reason = site.get('error') or ("OGM write" if site['kind'] == "ogm" else "query built at run time")
+            print(f"    line {site['line']} not audited: {reason}")
+        if entry['error'] and (missed or not sites):
+            print(f"    sample call stopped early: {entry['error']}")
+        problems += len(flagged)
+        unaudited += len(missed)
+    print(f"{problems} statements with flagged operators, {unaudited} call sites not audited")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN the Cypher statements issued by Database, flag scans and "
+                                                 "list the call sites that could not be audited.")
+    parser.add_argument("--uri", default=NEO4J_URI)
+    parser.add_argument("--user", default=NEO4J_USER)
+    parser.add_argument("--password", default=NEO4J_PASSWORD)
+    args = parser.parse_args()
+
+    db = Database(args.uri, args.user, args.password)
+    problems = print_report(audit(db))
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
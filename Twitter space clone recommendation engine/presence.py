@@ -0,0 +1,270 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from models import INTEREST_WEIGHTS, ROLE_WEIGHTS, SPACE_ROLES
+
+logger = logging.getLogger(__name__)
+
+
+class SpacePresence:
+    # Live space membership kept in this worker's memory. join/heartbeat/leave only touch dicts;
+    # a background thread expires members whose last heartbeat is older than ttl and writes what
+    # changed to the graph in batches:
+    #   joins      -> members still in the space get their JOINED_AS edge (join_spaces_bulk)
+    #   intervals  -> members who left before their join was written get a single LEFT_AS edge
+    #   leaves     -> written JOINED_AS edges are swapped for LEFT_AS (leave_spaces_bulk)
+    # Interest credits match db.join_space/leave_space and are written with the same batch.
+    # Only members whose client has sent a heartbeat can expire (space.html sends them while open);
+    # the others stay until they leave or the space ends.
+    # State is per worker, so a user's requests for a space should reach the same worker.
+
+    def __init__(self, db, ttl=60, flush_interval=5.0, clock=time.time):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.live = {}
+        self.member_of = defaultdict(set)
+        self.joins = {}
+        self.intervals = []
+        self.leaves = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.stats = {
+            'joins': 0,
+            'heartbeats': 0,
+            'leaves': 0,
+            'expired': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'errors': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name="space-presence", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _check_space(self, space_id):
+        # The cached catalogue answers for most spaces; the rest cost one read on their first join
+        space = self.db.space_cache.get(space_id)
+        if space is None:
+            spaces = self.db.hydrate_spaces([space_id])
+            space = spaces[0] if spaces else None
+        if space is None:
+            raise ValueError("Space not found")
+        if space.get('status') == 'ended':
+            raise ValueError("Space has ended")
+
+    def join(self, username, space_id, role):
+        # Returns False when the user is already in the space; that only refreshes their heartbeat
+        with self.lock:
+            known = space_id in self.live
+            present = username in self.live.get(space_id, {})
+        if not known:
+            self._check_space(space_id)
+        # A JOINED_AS edge from before a restart is adopted as already written, so it is neither
+        # credited again nor re-created; leaving swaps it for LEFT_AS as usual. An edge with a queued
+        # leave belongs to the previous visit and is not adopted.
+        edge = not present and self.db.is_member_of_space(username, space_id)
+        now = self.clock()
+        with self.lock:
+            members = self.live.setdefault(space_id, {})
+            if username in members:
+                members[username]['seen'] = now
+                return False
+            written = edge and not any(row['space_id'] == space_id and row['username'] == username
+                                       for row in self.leaves)
+            joined_at = datetime.fromtimestamp(now).isoformat()
+            members[username] = {'role': role, 'joined_at': joined_at, 'seen': now, 'beating': False}
+            self.member_of[username].add(space_id)
+            if not written:
+                self.joins[(space_id, username)] = {'username': username, 'space_id': space_id, 'role': role,
+                                                    'joined_at': joined_at}
+            self.stats['joins'] += 1
+        self.db._space_joined(space_id, role)
+        return True
+
+    def heartbeat(self, username, space_id):
+        # False means the member expired (or joined on another worker) and should join again
+        now = self.clock()
+        with self.lock:
+            member = self.live.get(space_id, {}).get(username)
+            if member is None:
+                return False
+            member['seen'] = now
+            member['beating'] = True
+            self.stats['heartbeats'] += 1
+            return True
+
+    def leave(self, username, space_id):
+        # False when this worker does not have the user in the space
+        with self.lock:
+            role = self._remove(space_id, username, self.clock())
+            if role is not None:
+                self.stats['leaves'] += 1
+        if role is None:
+            return False
+        self.db._space_left(space_id, role)
+        return True
+
+    def _remove(self, space_id, username, at):
+        members = self.live.get(space_id)
+        member = members.pop(username, None) if members else None
+        if member is None:
+            return None
+        if not members:
+            del self.live[space_id]
+        self._forget(username, space_id)
+        left_at = datetime.fromtimestamp(at).isoformat()
+        row = self.joins.pop((space_id, username), None)
+        if row is not None:
+            self.intervals.append(dict(row, left_at=left_at))
+        else:
+            self.leaves.append({'username': username, 'space_id': space_id, 'role': member['role'],
+                                'joined_at': member['joined_at'], 'left_at': left_at})
+        return member['role']
+
+    def _forget(self, username, space_id):
+        spaces = self.member_of.get(username)
+        if spaces is not None:
+            spaces.discard(space_id)
+            if not spaces:
+                del self.member_of[username]
+
+    def spaces_of(self, username):
+        with self.lock:
+            return sorted(self.member_of.get(username, ()))
+
+    def expire(self):
+        # Members whose heartbeats stopped for longer than ttl leave at their last heartbeat
+        cutoff = self.clock() - self.ttl
+        with self.lock:
+            stale = [(space_id, username, member['seen']) for space_id, members in self.live.items()
+                     for username, member in members.items() if member['beating'] and member['seen'] < cutoff]
+            expired = [(space_id, self._remove(space_id, username, seen)) for space_id, username, seen in stale]
+            self.stats['expired'] += len(expired)
+        for space_id, role in expired:
+            self.db._space_left(space_id, role)
+        return len(expired)
+
+    def close_space(self, space_id):
+        # After end_space/delete_space the graph has settled the space's members; unwritten joins are
+        # dropped so they do not reopen it, finished intervals are still written
+        with self.lock:
+            for username in self.live.pop(space_id, {}):
+                self._forget(username, space_id)
+            for key in [key for key in self.joins if key[0] == space_id]:
+                del self.joins[key]
+
+    def _close_ended(self):
+        # Spaces ended on another worker reach this one through the space cache
+        with self.lock:
+            space_ids = list(self.live)
+        for space_id in space_ids:
+            space = self.db.space_cache.get(space_id)
+            if space is not None and space.get('status') == 'ended':
+                self.close_space(space_id)
+
+    def participants(self, space_id):
+        with self.lock:
+            members = self.live.get(space_id, {})
+            return sorted(({'username': username, 'role': member['role'], 'joined_at': member['joined_at']}
+                           for username, member in members.items()), key=lambda member: member['joined_at'])
+
+    def counts(self, space_id):
+        # Same names as the Space node counters
+        with self.lock:
+            roles = [member['role'] for member in self.live.get(space_id, {}).values()]
+        counts = {f"{role}_count": roles.count(role) for role in SPACE_ROLES}
+        counts['member_count'] = len(roles)
+        return counts
+
+    def pending(self):
+        with self.lock:
+            return len(self.joins) + len(self.intervals) + len(self.leaves)
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+            metrics.update(live_spaces=len(self.live), live_members=sum(len(members) for members in self.live.values()),
+                           pending=len(self.joins) + len(self.intervals) + len(self.leaves), ttl=self.ttl)
+        return metrics
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self._close_ended()
+            except Exception:
+                logger.exception("Presence sweep failed")
+            self.expire()
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                joins, self.joins = self.joins, {}
+                intervals, self.intervals = self.intervals, []
+                leaves, self.leaves = self.leaves, []
+            if not (joins or intervals or leaves):
+                return 0
+
+            credits = [{'username': row['username'], 'space_id': row['space_id'],
+                        'delta': ROLE_WEIGHTS.get(row['role'], 1) * INTEREST_WEIGHTS['join']}
+                       for row in list(joins.values()) + intervals]
+            for row in intervals:
+                duration = (datetime.fromisoformat(row['left_at']) -
+                            datetime.fromisoformat(row['joined_at'])).total_seconds()
+                credits.append({'username': row['username'], 'space_id': row['space_id'],
+                                'delta': ROLE_WEIGHTS.get(row['role'], 1) * duration / 3600})
+
+            started = time.perf_counter()
+            try:
+                # Leaves go first: a member who left and rejoined since the last flush has a leave for
+                # their written JOINED_AS edge and a join for the new visit, which must not merge onto it
+                left = self.db.leave_spaces_bulk(leaves)
+                self.db.join_spaces_bulk(list(joins.values()) + intervals)
+                self.db.update_space_interests(credits + [
+                    {'username': row['username'], 'space_id': row['space_id'],
+                     'delta': ROLE_WEIGHTS.get(row['role'], 1) * row['duration'] / 3600} for row in left])
+            except Exception:
+                self._requeue(joins, intervals, leaves)
+                logger.exception("Presence flush failed")
+                return 0
+            elapsed = time.perf_counter() - started
+
+            flushed = len(joins) + len(intervals) + len(leaves)
+            with self.lock:
+                self.stats['flushed'] += flushed
+                self.stats['flushes'] += 1
+                self.stats['last_flush_seconds'] = elapsed
+                self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+            return flushed
+
+    def _requeue(self, joins, intervals, leaves):
+        # Put the batch back for the next flush. A member who left meanwhile was queued as a leave of a
+        # JOINED_AS edge that was never written, so that leave becomes an interval instead.
+        with self.lock:
+            unwritten = {(row['space_id'], row['username'], row['joined_at']) for row in joins.values()}
+            moved = [row for row in self.leaves if (row['space_id'], row['username'], row['joined_at']) in unwritten]
+            self.leaves = leaves + [row for row in self.leaves
+                                    if (row['space_id'], row['username'], row['joined_at']) not in unwritten]
+            self.intervals = intervals + moved + self.intervals
+            for key, row in joins.items():
+                member = self.live.get(row['space_id'], {}).get(row['username'])
+                if member is not None and member['joined_at'] == row['joined_at']:
+                    self.joins.setdefault(key, row)
+            self.stats['errors'] += 1
+
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.thread.join(timeout=self.flush_interval + 5)
+        # Whoever is still live stays JOINED_AS in the graph; a restart picks them up through leave_space
+        self.flush()
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class LocalBackend:
+    # In-process LRU of cached results plus the per-user activity versions.
+    # Only useful with a single worker; other workers never see this process's bumps.
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.evictions = 0
+
+    def lookup(self, username, top_n):
+        # Returns (user's activity version, cached entry or None)
+        key = (username, top_n)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return self.versions.get(username, 0), entry
+
+    def store(self, username, top_n, entry, ttl):
+        key = (username, top_n)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self, usernames):
+        with self.lock:
+            for username in usernames:
+                self.versions[username] = self.versions.get(username, 0) + 1
+
+    def metrics(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'evictions': self.evictions}
+
+
+class RedisBackend:
+    # Shared between workers: versions are INCR counters and a lookup is one MGET.
+    # Entries expire with the TTL; run Redis with an LRU maxmemory-policy to cap its size.
+
+    def __init__(self, url, prefix="recs:"):
+        if redis is None:
+            raise ImportError("The redis package is required for a shared recommendation cache")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _version_key(self, username):
+        return f"{self.prefix}version:{username}"
+
+    def _entry_key(self, username, top_n):
+        return f"{self.prefix}entry:{username}:{top_n}"
+
+    def lookup(self, username, top_n):
+        version, entry = self.client.mget(self._version_key(username), self._entry_key(username, top_n))
+        return int(version or 0), json.loads(entry) if entry else None
+
+    def store(self, username, top_n, entry, ttl):
+        self.client.set(self._entry_key(username, top_n), json.dumps(entry), ex=max(int(ttl), 1))
+
+    def bump(self, usernames):
+        pipeline = self.client.pipeline(transaction=False)
+        for username in usernames:
+            pipeline.incr(self._version_key(username))
+        pipeline.execute()
+
+    def metrics(self):
+        return {'backend': 'redis'}
+
+
+class RecommendationCache:
+    # Recommendation results per (user, top_n). An entry is only served while the user's
+    # activity version and the space catalogue version still match the ones it was computed
+    # under, so writes invalidate it without ever deleting keys; the TTL bounds how stale
+    # counts inside it (member counts, other users' joins) can get.
+
+    def __init__(self, backend, read_catalogue_version, ttl=60.0, refresh_interval=30.0):
+        self.backend = backend
+        self.read_catalogue_version = read_catalogue_version
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.catalogue = None
+        self.checked_at = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0}
+
+    def catalogue_version(self):
+        # Re-read from the graph at most every refresh_interval; local writes set it directly
+        now = time.monotonic()
+        if self.catalogue is None or now - self.checked_at >= self.refresh_interval:
+            version = self.read_catalogue_version()
+            with self.lock:
+                self.catalogue, self.checked_at = version, now
+        return self.catalogue
+
+    def set_catalogue_version(self, version):
+        with self.lock:
+            self.catalogue, self.checked_at = version, time.monotonic()
+
+    def bump_users(self, usernames):
+        usernames = set(usernames)
+        if usernames:
+            self.backend.bump(usernames)
+
+    def get_or_compute(self, username, top_n, compute):
+        # Versions are read before computing, so a write landing meanwhile makes the stored entry stale
+        user_version, entry = self.backend.lookup(username, top_n)
+        catalogue = self.catalogue_version()
+        if entry is not None:
+            if entry['user_version'] != user_version or entry['catalogue_version'] != catalogue:
+                outcome = 'stale'
+            elif entry['expires_at'] <= time.time():
+                outcome = 'expired'
+            else:
+                outcome = 'hits'
+            with self.lock:
+                self.stats[outcome] += 1
+            if outcome == 'hits':
+                return entry['value']
+        with self.lock:
+            self.stats['misses'] += 1
+
+        value = compute()
+        self.backend.store(username, top_n, {'user_version': user_version, 'catalogue_version': catalogue,
+                                             'expires_at': time.time() + self.ttl, 'value': value}, self.ttl)
+        return value
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+        lookups = metrics['hits'] + metrics['misses']
+        metrics['hit_rate'] = metrics['hits'] / lookups if lookups else 0.0
+        metrics.update(self.backend.metrics())
+        return metrics
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from scoring import blend_scores
+
+NEW = "new"
+SOCIAL = "social"
+ACTIVE = "active"
+STAGES = ("classify", "generate", "score", "filter", "hydrate")
+# Candidates requested per recommendation slot, leaving room for filtering and re-ranking
+CANDIDATE_FACTOR = 4
+
+
+class RecommendationService:
+    # /space recommendations as explicit stages:
+    #   classify  -> one count query picks NEW / SOCIAL / ACTIVE
+    #   generate  -> the state's candidate sources, tried in order; each returns {signal: [(space_id, score)]}
+    #   score     -> one ranked [(space_id, score)] list
+    #   filter    -> drops duplicates, ended spaces and spaces the user is already in
+    #   hydrate   -> display fields for the top_n survivors
+    # Every stage is a constructor argument, and each is timed. The first source whose
+    # candidates survive filtering wins, so e.g. stale precomputed rows fall through to online scoring.
+
+    def __init__(self, db, classifier=None, sources=None, scorer=None, candidate_filter=None, hydrator=None):
+        self.db = db
+        self.classifier = classifier or self.classify
+        self.sources = sources or {
+            NEW: [self.trending_candidates, self.latest_candidates],
+            SOCIAL: [self.friend_candidates, self.trending_candidates, self.latest_candidates],
+            ACTIVE: [self.precomputed_candidates, self.behaviour_candidates],
+        }
+        self.scorer = scorer or self.blend
+        self.candidate_filter = candidate_filter or self.filter_candidates
+        self.hydrator = hydrator or self.hydrate
+        self.lock = threading.Lock()
+        self.stats = {stage: {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0} for stage in STAGES}
+        self.served = {}
+
+    def recommend(self, username, top_n=5):
+        # Returns {'spaces', 'state', 'source', 'computed_at', 'timings'}; repeat views come from the cache
+        return self.db.recommendation_cache.get_or_compute(username, top_n, lambda: self.run(username, top_n))
+
+    def run(self, username, top_n=5):
+        timings = dict.fromkeys(STAGES, 0.0)
+
+        def timed(stage, function, *args):
+            started = time.perf_counter()
+            result = function(*args)
+            timings[stage] += (time.perf_counter() - started) * 1000
+            return result
+
+        user = timed("classify", self.classifier, username)
+        ranked, source, info = [], None, {}
+        for generate in self.sources[user['state']]:
+            signals, info = timed("generate", generate, user, top_n * CANDIDATE_FACTOR)
+            if not signals:
+                continue
+            ranked = timed("filter", self.candidate_filter, user, timed("score", self.scorer, signals))
+            if ranked:
+                source = getattr(generate, '__name__', repr(generate))
+                break
+        spaces = timed("hydrate", self.hydrator, user, ranked[:top_n])
+        self._record(timings, user['state'], source)
+        return {'spaces': spaces, 'state': user['state'], 'source': source,
+                'computed_at': info.get('computed_at'), 'timings': timings}
+
+    def _record(self, timings, state, source):
+        with self.lock:
+            for stage, elapsed in timings.items():
+                stats = self.stats[stage]
+                stats['calls'] += 1
+                stats['total_ms'] += elapsed
+                stats['max_ms'] = max(stats['max_ms'], elapsed)
+            key = f"{state}:{source}"
+            self.served[key] = self.served.get(key, 0) + 1
+
+    def metrics(self):
+        with self.lock:
+            stages = {stage: dict(stats, mean_ms=stats['total_ms'] / stats['calls'] if stats['calls'] else 0.0)
+                      for stage, stats in self.stats.items()}
+            return {'stages': stages, 'served': dict(self.served)}
+
+    def classify(self, username):
+        counts = self.db.get_user_recommendation_state(username)
+        if counts['activity']:
+            state = ACTIVE
+        elif counts['following']:
+            state = SOCIAL
+        else:
+            state = NEW
+        return dict(counts, username=username, state=state)
+
+    def latest_candidates(self, user, limit):
+        space_ids = self.db.get_latest_space_ids(top_n=limit)
+        return {'recency': ranked_by_position(space_ids)} if space_ids else {}, {}
+
+    def friend_candidates(self, user, limit):
+        space_ids = self.db.get_friend_space_ids(user['username'], top_n=limit)
+        return {'friends': ranked_by_position(space_ids)} if space_ids else {}, {}
+
+    def trending_candidates(self, user, limit):
+        # Popular live spaces for users with no history; falls back to the graph snapshot on a fresh worker
+        exclude = user['space_ids']
+        trending = self.db.trending.top(limit, exclude=exclude)
+        if not trending:
+            snapshot = self.db.get_trending_snapshot(limit + len(exclude))
+            trending = [(space_id, value) for space_id, value in snapshot if space_id not in exclude][:limit]
+        return {'trending': trending} if trending else {}, {}
+
+    def precomputed_candidates(self, user, limit):
+        ranked, computed_at = self.db.get_precomputed_scores(user['username'])
+        return {'precomputed': ranked} if ranked else {}, {'computed_at': computed_at}
+
+    def behaviour_candidates(self, user, limit):
+        # The stored profile is O(user's topics); fall back to the history scan until it is backfilled
+        username = user['username']
+        user_vector = self.db.get_user_interest_profile(username) or self.db.calculate_user_topic_vector(username)
+        if self.db.space_index is not None:
+            # Opt-in approximate retrieval from the LSH buckets, re-scored on the cached matrix
+            topic = self.db.space_index.query(user_vector, limit, exclude=user['space_ids'])
+        else:
+            topic = self.db.rank_spaces_by_topic(user_vector, limit, exclude=user['space_ids'])
+        signals = {'topic': topic} if topic else {}
+        if self.db.cf_blend_weight:
+            co_attendance = self.db.get_item_cf_scores(username, limit)
+            if co_attendance:
+                signals['co_attendance'] = co_attendance
+        if self.db.trending_blend_weight:
+            trending = self.db.trending.top(limit, exclude=user['space_ids'])
+            if trending:
+                signals['trending'] = trending
+        return signals, {}
+
+    def blend(self, signals):
+        # Single sources pass through; co-attendance and then trending are mixed into topic similarity
+        # by their configured weights
+        if len(signals) == 1:
+            (ranked,) = signals.values()
+            return ranked
+        ranked = signals.get('topic', [])
+        for signal, weight in (('co_attendance', self.db.cf_blend_weight),
+                               ('trending', self.db.trending_blend_weight)):
+            if signal in signals:
+                ranked = blend_scores(ranked, signals[signal], weight) if ranked else signals[signal]
+        return ranked
+
+    def filter_candidates(self, user, ranked):
+        # Ended status comes from the in-process space cache; hydration re-checks it
+        seen = set(user['space_ids'])
+        kept = []
+        for space_id, value in ranked:
+            if space_id in seen:
+                continue
+            seen.add(space_id)
+            space = self.db.space_cache.get(space_id)
+            if space is not None and space.get('status') == 'ended':
+                continue
+            kept.append((space_id, value))
+        return kept
+
+    def hydrate(self, user, ranked):
+        scores = {space_id: {'score': value} for space_id, value in ranked}
+        return [space for space in self.db.hydrate_spaces([space_id for space_id, _ in ranked],
+                                                          viewer=user['username'], extra=scores)
+                if space['status'] != 'ended']
+
+
+def ranked_by_position(space_ids):
+    # Sources that only give an order get descending scores so scoring keeps that order
+    return [(space_id, 1.0 / (position + 1)) for position, space_id in enumerate(space_ids)]
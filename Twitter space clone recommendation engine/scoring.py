@@ -0,0 +1,70 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def build_topic_index(topic_lists):
+    # Integer ids for every topic that appears, in first-seen order
+    topic_index = {}
+    for topics in topic_lists:
+        for topic in topics:
+            if topic not in topic_index:
+                topic_index[topic] = len(topic_index)
+    return topic_index
+
+
+def normalize_rows(matrix):
+    # L2-normalize each row in place so a dot product is the cosine similarity
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix
+
+
+def build_space_matrix(topic_lists, topic_index):
+    # Binary space x topic CSR matrix with L2-normalized rows
+    indptr = [0]
+    indices = []
+    for topics in topic_lists:
+        ids = sorted({topic_index[topic] for topic in topics if topic in topic_index})
+        indices.extend(ids)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float64)
+    matrix = csr_matrix((data, np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+                        shape=(len(topic_lists), len(topic_index)))
+    return normalize_rows(matrix)
+
+
+def build_user_vector(weights, topic_index):
+    # Sparse 1 x topic row from {topic: weight}; topics no candidate has cannot affect the score
+    items = [(topic_index[topic], weight) for topic, weight in weights.items()
+             if weight and topic in topic_index]
+    columns = np.array([column for column, _ in items], dtype=np.int32)
+    data = np.array([weight for _, weight in items], dtype=np.float64)
+    vector = csr_matrix((data, (np.zeros(len(items), dtype=np.int32), columns)), shape=(1, len(topic_index)))
+    return normalize_rows(vector)
+
+
+def score(space_matrix, user_vector):
+    # Cosine similarity of the user against every row, touching only non-zeros
+    return np.asarray((space_matrix @ user_vector.T).todense()).ravel()
+
+
+def top_k(scores, k):
+    # argpartition is O(n); only the k winners get sorted
+    if k <= 0 or len(scores) == 0:
+        return np.array([], dtype=np.int64)
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def blend_scores(primary, secondary, weight):
+    # Mix two [(id, score)] rankings after scaling each to a max of 1; ids missing from one side score 0 there
+    def scaled(ranked):
+        peak = max((value for _, value in ranked), default=0)
+        return {item: value / peak for item, value in ranked} if peak > 0 else {}
+    first, second = scaled(primary), scaled(secondary)
+    blended = {item: (1 - weight) * first.get(item, 0.0) + weight * second.get(item, 0.0)
+               for item in first.keys() | second.keys()}
+    return sorted(blended.items(), key=lambda pair: (-pair[1], pair[0]))
@@ -0,0 +1,210 @@
+import argparse
+import bisect
+import csv
+import itertools
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+
+from models import Database
+
+NEO4J_URI = "bolt://localhost:7687"
+NEO4J_USER = "neo4j"
+NEO4J_PASSWORD = "12345678"
+
+ROLES = ["listener", "listener", "listener", "speaker", "moderator"]
+LOAD_ORDER = ["users", "follows", "posts", "spaces", "memberships"]
+RETRIES = 3
+
+
+def read_rows(path):
+    # JSONL or CSV, streamed so big files don't have to fit in memory
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                if "tags" in row or "topics" in row:
+                    key = "tags" if "tags" in row else "topics"
+                    row[key] = [tag for tag in (row[key] or "").split("|") if tag]
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_batches(write, rows, batch_size, workers):
+    # Keep at most 2 x workers batches in flight so generators are consumed lazily
+    count = 0
+
+    def attempt(batch):
+        for retry in range(RETRIES):
+            try:
+                write(batch)
+                return len(batch)
+            except Exception:
+                if retry == RETRIES - 1:
+                    raise
+                time.sleep(0.5 * (retry + 1))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for batch in chunked(rows, batch_size):
+            in_flight.add(executor.submit(attempt, batch))
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                count += sum(future.result() for future in done)
+        count += sum(future.result() for future in in_flight)
+    return count
+
+
+class PowerLaw:
+    # Samples indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** alpha
+    def __init__(self, n, alpha, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** alpha for rank in range(n)))
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def synthetic_dataset(args):
+    # Generators are re-created for each entity so the whole graph never sits in memory
+    rng = random.Random(args.seed)
+    users = [f"user{i}" for i in range(args.users)]
+    topics = [f"topic{i}" for i in range(args.topics)]
+    space_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(args.spaces)]
+    now = datetime.now()
+    # (created_at, ended_at) per space, shared by spaces and memberships; ended_at is None for live spaces
+    lifetimes = []
+    for _ in space_ids:
+        created_at = now - timedelta(seconds=rng.randint(0, 30 * 24 * 3600))
+        ended = rng.random() < args.ended_ratio
+        ended_at = min(created_at + timedelta(seconds=rng.randint(1800, 4 * 3600)), now) if ended else None
+        lifetimes.append((created_at, ended_at))
+
+    def gen_users():
+        for username in users:
+            yield {"username": username, "password": "password", "email": f"{username}@example.com"}
+
+    def gen_follows():
+        popularity = PowerLaw(len(users), args.follow_alpha, rng)
+        for username in users:
+            for _ in range(min(len(users) - 1, int(rng.paretovariate(1.5) * args.avg_follows / 3))):
+                target = users[popularity.sample()]
+                if target != username:
+                    yield {"username": username, "target": target}
+
+    def gen_posts():
+        authors = PowerLaw(len(users), 1.0, rng)
+        tags = PowerLaw(len(topics), args.tag_alpha, rng)
+        for _ in range(args.posts):
+            post_tags = {topics[tags.sample()] for _ in range(rng.randint(0, 3))}
+            yield {
+                "username": users[authors.sample()],
+                "text": " ".join(["synthetic post"] + [f"#{tag}" for tag in sorted(post_tags)]),
+                "tags": sorted(post_tags),
+                "timestamp": int((now - timedelta(seconds=rng.randint(0, 30 * 24 * 3600))).timestamp())
+            }
+
+    def gen_spaces():
+        tags = PowerLaw(len(topics), args.tag_alpha, rng)
+        for i, (space_id, (created_at, ended_at)) in enumerate(zip(space_ids, lifetimes)):
+            yield {
+                "id": space_id,
+                "host": rng.choice(users),
+                "name": f"Space {i}",
+                "description": "Synthetic space",
+                "topics": sorted({topics[tags.sample()] for _ in range(rng.randint(1, 3))}),
+                "created_at": created_at.isoformat(),
+                "status": "ended" if ended_at else None,
+                "ended_at": ended_at.isoformat() if ended_at else None
+            }
+
+    def gen_memberships():
+        spaces = PowerLaw(len(space_ids), 1.0, rng)
+        for _ in range(args.memberships):
+            # Members join while the space is open; everyone in an ended space has left by its end
+            index = spaces.sample()
+            created_at, ended_at = lifetimes[index]
+            closes_at = ended_at or now
+            joined_at = created_at + (closes_at - created_at) * rng.random()
+            left_at = None
+            if ended_at or rng.random() < 0.7:
+                left_at = min(joined_at + timedelta(seconds=rng.randint(60, 3 * 3600)), closes_at)
+            yield {
+                "username": rng.choice(users),
+                "space_id": space_ids[index],
+                "role": rng.choice(ROLES),
+                "joined_at": joined_at.isoformat(),
+                "left_at": left_at.isoformat() if left_at else None
+            }
+
+    return {"users": gen_users, "follows": gen_follows, "posts": gen_posts,
+            "spaces": gen_spaces, "memberships": gen_memberships}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load users, follows, posts, spaces and memberships into Neo4j.")
+    parser.add_argument("--uri", default=NEO4J_URI)
+    parser.add_argument("--user", default=NEO4J_USER)
+    parser.add_argument("--password", default=NEO4J_PASSWORD)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--fan-out", action="store_true", help="push imported posts into follower timelines")
+    for entity in LOAD_ORDER:
+        parser.add_argument(f"--{entity}-file", help=f"JSONL or CSV file of {entity}")
+
+    synthetic = parser.add_argument_group("synthetic data")
+    synthetic.add_argument("--synthetic", action="store_true")
+    synthetic.add_argument("--seed", type=int, default=42)
+    synthetic.add_argument("--users", type=int, default=1000)
+    synthetic.add_argument("--avg-follows", type=int, default=20)
+    synthetic.add_argument("--follow-alpha", type=float, default=1.1)
+    synthetic.add_argument("--posts", type=int, default=10000)
+    synthetic.add_argument("--topics", type=int, default=200)
+    synthetic.add_argument("--tag-alpha", type=float, default=1.2)
+    synthetic.add_argument("--spaces", type=int, default=500)
+    synthetic.add_argument("--ended-ratio", type=float, default=0.6)
+    synthetic.add_argument("--memberships", type=int, default=20000)
+    args = parser.parse_args()
+
+    db = Database(args.uri, args.user, args.password, ensure_schema=True)
+    writers = {
+        "users": db.create_users_bulk,
+        "follows": lambda rows: db.follow_users_bulk(rows, backfill=False),
+        "posts": lambda rows: db.add_posts_bulk(rows, fan_out=args.fan_out),
+        "spaces": db.create_spaces_bulk,
+        "memberships": db.join_spaces_bulk,
+    }
+
+    sources = synthetic_dataset(args) if args.synthetic else {}
+    for entity in LOAD_ORDER:
+        path = getattr(args, f"{entity}_file")
+        if path:
+            rows = read_rows(path)
+        elif entity in sources:
+            rows = sources[entity]()
+        else:
+            continue
+
+        started = time.perf_counter()
+        count = run_batches(writers[entity], rows, args.batch_size, args.workers)
+        elapsed = time.perf_counter() - started
+        print(f"{entity}: {count} rows in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
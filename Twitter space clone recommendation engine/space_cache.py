@@ -0,0 +1,146 @@
+import threading
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from scoring import build_space_matrix
+
+
+class SpaceTopicCache:
+    # Process-level copy of the space x topic model (matrix, id maps, space metadata).
+    # Local writes update it in place; a version counter stored in the graph tells each
+    # worker when another process changed the catalogue so it can reload.
+
+    def __init__(self, load_spaces, read_version, refresh_interval=30.0):
+        self.load_spaces = load_spaces
+        self.read_version = read_version
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.version = None
+        self.checked_at = 0.0
+        # Bumped whenever rows are renumbered (reload, compaction), for views that index by row
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        self.topic_index = {}
+        self.space_ids = []
+        self.row_of = {}
+        self.spaces = {}
+        self.rows = []
+        self.live = []
+        self.live_mask = np.zeros(0, dtype=bool)
+        self.tombstones = 0
+        self.matrix = None
+        self.matrix_topics = {}
+        self.dirty = True
+
+    def _add(self, space):
+        for topic in space['topics']:
+            if topic not in self.topic_index:
+                self.topic_index[topic] = len(self.topic_index)
+        self.row_of[space['id']] = len(self.space_ids)
+        self.space_ids.append(space['id'])
+        self.rows.append(list(space['topics']))
+        self.spaces[space['id']] = space
+        self.live.append(space.get('status') != 'ended')
+        self.dirty = True
+
+    def reload(self):
+        with self.lock:
+            version = self.read_version()
+            self._reset()
+            self.generation += 1
+            for space in self.load_spaces():
+                self._add(space)
+            self.version = version
+            self.loaded = True
+            self.checked_at = time.monotonic()
+
+    def _compact(self):
+        # Drop rows of deleted spaces once they make up a quarter of the matrix
+        spaces = [self.spaces[space_id] for space_id in self.space_ids if space_id in self.spaces]
+        topic_index = self.topic_index
+        self._reset()
+        self.generation += 1
+        self.topic_index = topic_index
+        for space in spaces:
+            self._add(space)
+
+    def snapshot(self):
+        # Returns (matrix, space_ids, live mask, topic_index, row_of) consistent with each other
+        with self.lock:
+            now = time.monotonic()
+            if not self.loaded:
+                self.reload()
+            elif now - self.checked_at >= self.refresh_interval:
+                self.checked_at = now
+                if self.read_version() != self.version:
+                    self.reload()
+            if self.tombstones and self.tombstones * 4 >= len(self.space_ids):
+                self._compact()
+            if self.dirty:
+                built = self.matrix.shape[0] if self.matrix is not None else 0
+                if built:
+                    # Same rows as last time plus appended ones: only the new rows are built, and the
+                    # old matrix is widened if they brought new topics
+                    old = csr_matrix((self.matrix.data, self.matrix.indices, self.matrix.indptr),
+                                     shape=(built, len(self.topic_index)))
+                    new = build_space_matrix(self.rows[built:], self.topic_index)
+                    self.matrix = vstack([old, new], format="csr")
+                    self.live_mask = np.concatenate([self.live_mask, np.array(self.live[built:], dtype=bool)])
+                else:
+                    self.matrix = build_space_matrix(self.rows, self.topic_index)
+                    self.live_mask = np.array(self.live, dtype=bool)
+                self.matrix_topics = dict(self.topic_index)
+                self.dirty = False
+            # The mask is copied because end/remove flip it in place
+            return self.matrix, self.space_ids, self.live_mask.copy(), self.matrix_topics, self.row_of
+
+    def _kill(self, row):
+        self.live[row] = False
+        if row < len(self.live_mask):
+            self.live_mask[row] = False
+
+    def get(self, space_id):
+        # Loads first, so a fresh worker does not report every space as unknown
+        with self.lock:
+            if not self.loaded:
+                self.reload()
+            return self.spaces.get(space_id)
+
+    def _apply(self, version, change):
+        # Apply a local write; if the graph version skipped ahead another worker wrote too, so reload lazily
+        with self.lock:
+            if not self.loaded:
+                return
+            if self.version is not None and version != self.version + 1:
+                self.loaded = False
+                return
+            change()
+            self.version = version
+
+    def add_spaces(self, spaces, version):
+        def change():
+            for space in spaces:
+                self._add(space)
+        self._apply(version, change)
+
+    def end_space(self, space_id, version):
+        def change():
+            row = self.row_of.get(space_id)
+            if row is not None:
+                self._kill(row)
+                self.spaces[space_id]['status'] = 'ended'
+        self._apply(version, change)
+
+    def remove_space(self, space_id, version):
+        def change():
+            row = self.row_of.pop(space_id, None)
+            if row is not None:
+                self._kill(row)
+                del self.spaces[space_id]
+                self.tombstones += 1
+        self._apply(version, change)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The app is a flat set of modules next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_db import MemoryDatabase  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    db = MemoryDatabase()
+    db.create_users_bulk([{'username': username, 'password': 'password', 'email': f"{username}@example.com"}
+                          for username in ("alice", "bob", "carol", "dave")])
+    return db
@@ -0,0 +1,71 @@
+import numpy as np
+
+from ann_index import SpaceIndex
+from space_cache import SpaceTopicCache
+
+
+def catalogue(count):
+    topics = ["music", "tech", "art", "sport", "food"]
+    return [{'id': f"space{i}", 'topics': [topics[i % 5], topics[(i * 3 + 1) % 5]]} for i in range(count)]
+
+
+def test_created_spaces_are_hashed_without_rehashing_the_catalogue(db):
+    db.enable_space_index(probes=4)
+    first = db.create_space("alice", "First", "", ["music"])
+    assert [space_id for space_id, _ in db.space_index.query({'music': 1.0}, 5)] == [first]
+
+    projected = []
+    project = db.space_index._project
+    db.space_index._project = lambda matrix: projected.append(matrix.shape[0]) or project(matrix)
+    second = db.create_space("bob", "Second", "", ["music", "tech"])
+    found = [space_id for space_id, _ in db.space_index.query({'music': 1.0, 'tech': 1.0}, 5)]
+    assert found[0] == second and set(found) == {first, second}
+    assert projected == [1]
+
+
+def test_ended_and_deleted_spaces_are_not_returned(db):
+    db.enable_space_index(probes=4)
+    ended = db.create_space("alice", "Ended", "", ["music"])
+    deleted = db.create_space("alice", "Deleted", "", ["music"])
+    live = db.create_space("alice", "Live", "", ["music"])
+    db.space_index.query({'music': 1.0}, 5)
+
+    db.end_space("alice", ended)
+    db.delete_space("alice", deleted)
+    assert [space_id for space_id, _ in db.space_index.query({'music': 1.0}, 5)] == [live]
+    assert db.space_index.query({'music': 1.0}, 5, exclude=[live]) == []
+
+
+def test_keys_are_saved_by_catalogue_version_and_reused_after_a_restart(tmp_path):
+    path = str(tmp_path / "space_index.npz")
+    spaces = catalogue(50)
+    index = SpaceIndex(SpaceTopicCache(lambda: spaces, lambda: 3), path=path)
+    expected = index.query({'music': 1.0}, 10)
+    keys = index.buffer[:index.size].copy()
+    with np.load(path) as state:
+        assert int(state['version']) == 3
+
+    restarted = SpaceIndex(SpaceTopicCache(lambda: spaces, lambda: 3), path=path)
+    restarted._project = lambda matrix: (_ for _ in ()).throw(AssertionError("rehashed a saved space"))
+    assert restarted.query({'music': 1.0}, 10) == expected
+    assert (restarted.buffer[:restarted.size] == keys).all()
+
+    # An older worker never overwrites a newer file
+    stale = SpaceIndex(SpaceTopicCache(lambda: spaces[:10], lambda: 2), path=path)
+    stale.refresh()
+    with np.load(path) as state:
+        assert int(state['version']) == 3 and len(state['space_ids']) == 50
+
+
+def test_index_follows_a_reload_after_another_worker_changes_the_catalogue():
+    spaces = catalogue(20)
+    version = [1]
+    cache = SpaceTopicCache(lambda: list(spaces), lambda: version[0], refresh_interval=0)
+    index = SpaceIndex(cache, probes=4)
+    index.refresh()
+
+    del spaces[0]
+    spaces.append({'id': "new", 'topics': ["jazz"]})
+    version[0] = 2
+    assert [space_id for space_id, _ in index.query({'jazz': 1.0}, 5)] == ["new"]
+    assert "space0" not in index.known and index.size == len(spaces)
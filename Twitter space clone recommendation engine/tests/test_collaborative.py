@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from collaborative import build_attendance_matrix, engagement_weight, item_neighbours, run
+
+
+def engagements(db):
+    return {(row['username'], row['space_id']): row for row in db.iter_space_engagements()}
+
+
+def test_open_memberships_and_hosts_count_the_hours_so_far(db):
+    space_id = db.create_space("alice", "Live", "", ["music"])
+    db.join_space("bob", space_id, "listener")
+    db.spaces[space_id]['created_at'] = (datetime.now() - timedelta(hours=2)).isoformat()
+    db.members[space_id]["bob"]['joined_at'] = (datetime.now() - timedelta(hours=1)).isoformat()
+
+    rows = engagements(db)
+    assert rows["alice", space_id]['hours'] == pytest.approx(2, abs=0.01)
+    assert rows["bob", space_id]['hours'] == pytest.approx(1, abs=0.01)
+    assert engagement_weight('JOINED_AS', 'listener', 1) > engagement_weight('JOINED_AS', 'listener', 0)
+
+    db.end_space("alice", space_id)
+    rows = engagements(db)
+    assert rows["alice", space_id]['hours'] == pytest.approx(db.spaces[space_id]['host_duration'] / 3600)
+    assert rows["bob", space_id]['kind'] == 'LEFT_AS'
+    assert rows["bob", space_id]['hours'] == pytest.approx(1, abs=0.01)
+
+
+def test_item_neighbours_follow_co_attendance():
+    rows = [{'username': username, 'space_id': space_id, 'kind': 'LEFT_AS', 'role': 'listener', 'hours': 1}
+            for username, space_id in [("a", "x"), ("a", "y"), ("b", "x"), ("b", "y"), ("c", "y"), ("c", "z")]]
+    rows.append({'username': "a", 'space_id': "x", 'kind': 'LEFT_AS', 'role': 'listener', 'hours': 1})
+    matrix, space_ids = build_attendance_matrix(rows)
+    # Repeat sessions in the same space add up
+    assert matrix.shape == (3, 3) and matrix.nnz == 6
+
+    neighbours = {space_ids[row]: {space_ids[column]: value for column, value in found}
+                  for row, found in item_neighbours(matrix, top_m=1)}
+    assert set(neighbours["x"]) == {"y"}
+    assert set(neighbours["z"]) == {"y"}
+    assert set(neighbours["y"]) == {"x"}
+
+
+def test_cf_scores_recommend_live_spaces_co_attended_with_the_users_own(db):
+    shared = db.create_space("alice", "Shared", "", ["music"])
+    next_door = db.create_space("alice", "Next door", "", ["tech"])
+    unrelated = db.create_space("bob", "Unrelated", "", ["art"])
+    for username in ("bob", "carol"):
+        db.join_space(username, shared, "listener")
+    db.join_space("carol", next_door, "speaker")
+    db.join_space("dave", shared, "listener")
+    run(db, top_m=10, min_score=0.01, block_size=2, write_batch_size=1)
+
+    scores = dict(db.get_item_cf_scores("dave"))
+    assert next_door in scores and unrelated in scores
+    assert scores[next_door] > scores[unrelated]
+    assert shared not in scores
+
+    db.end_space("alice", next_door)
+    assert next_door not in dict(db.get_item_cf_scores("dave"))
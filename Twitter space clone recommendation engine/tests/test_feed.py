@@ -0,0 +1,39 @@
+import pytest
+
+from models import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(1700000000, "post-1")
+    assert decode_cursor(cursor) == (1700000000, "post-1")
+    assert decode_cursor(encode_cursor("2024-01-01T00:00:00", 7), cast=str) == ("2024-01-01T00:00:00", "7")
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "", "W10=", encode_cursor("soon", "post-1")])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_get_all_posts_pages_through_ties(db):
+    # Several posts share a timestamp, so the cursor has to break ties on the id
+    db.add_posts_bulk([{'username': 'alice', 'text': f"post {i}", 'timestamp': 1700000000 + i // 3}
+                       for i in range(10)], fan_out=False)
+    seen, cursor = [], None
+    while True:
+        page = db.get_all_posts(limit=4, cursor=cursor)
+        seen.extend(post['post_id'] for post in page['posts'])
+        cursor = page['next']
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 10
+    keys = [(db.posts[post_id]['timestamp'], post_id) for post_id in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_page_size_is_clamped(db):
+    db.add_posts_bulk([{'username': 'bob', 'text': "hello", 'timestamp': 1700000000 + i} for i in range(3)],
+                      fan_out=False)
+    page = db.get_all_posts(limit=0)
+    assert len(page['posts']) == 1
+    assert page['next'] is not None
@@ -0,0 +1,27 @@
+def test_hydrate_posts_returns_a_whole_page_of_details(db):
+    first = db.add_post("alice", "first", [])
+    second = db.add_post("bob", "second", [])
+    for i in range(5):
+        db.add_comment("carol", first, f"comment {i}")
+    db.like_posts_bulk([{'username': "bob", 'post_id': first}, {'username': "carol", 'post_id': first}])
+    db.repost_post("dave", first)
+    db.follow_user("bob", "alice")
+
+    details = db.hydrate_posts([first, second, "missing"], viewer="bob", comment_limit=3)
+    assert set(details) == {first, second}
+    assert [comment['text'] for comment in details[first]['comments']] == ["comment 0", "comment 1", "comment 2"]
+    assert details[first]['comment_count'] == 5
+    assert details[first]['like_count'] == 2 and details[first]['repost_count'] == 1
+    assert details[first]['viewer_liked'] and details[first]['viewer_follows_author']
+    assert details[second] == {'post_id': second, 'comments': [], 'comment_count': 0, 'like_count': 0,
+                               'repost_count': 0, 'viewer_liked': False, 'viewer_follows_author': False}
+
+
+def test_hydrate_posts_without_a_viewer(db):
+    post = db.add_post("alice", "hello", [])
+    db.like_posts_bulk([{'username': "bob", 'post_id': post}])
+    for viewer in (None, "nobody"):
+        details = db.hydrate_posts([post], viewer=viewer)[post]
+        assert details['like_count'] == 1
+        assert not details['viewer_liked'] and not details['viewer_follows_author']
+    assert db.hydrate_posts([]) == {}
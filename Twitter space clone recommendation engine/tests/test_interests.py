@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from models import INTEREST_WEIGHTS, ROLE_WEIGHTS
+
+
+@pytest.fixture
+def space(db):
+    return db.create_space("alice", "Live", "", ["music", "tech"])
+
+
+def test_a_batch_is_summed_before_clamping(db, space):
+    db.update_space_interests([{'username': "bob", 'space_id': space, 'delta': 1.0}])
+    # Applied row by row this would clamp at zero after the first row and end at 3
+    db.update_space_interests([{'username': "bob", 'space_id': space, 'delta': -5.0},
+                               {'username': "bob", 'space_id': space, 'delta': 3.0}])
+    assert db.get_user_interest_profile("bob") == {}
+
+
+def test_join_and_duration_credits_add_up(db, space):
+    db.update_space_interests([{'username': "bob", 'space_id': space, 'delta': 1.5},
+                               {'username': "bob", 'space_id': space, 'delta': 0.5}])
+    profile = db.get_user_interest_profile("bob")
+    assert profile == {'music': pytest.approx(2.0), 'tech': pytest.approx(2.0)}
+
+
+def test_scores_halve_every_half_life(db, space):
+    db.update_space_interests([{'username': "bob", 'space_id': space, 'delta': 4.0}])
+    score, updated_at = db.interests["bob"]["music"]
+    db.interests["bob"]["music"] = (score, updated_at - db.interest_half_life)
+    assert db.get_user_interest_profile("bob")['music'] == pytest.approx(2.0, rel=1e-3)
+
+
+def test_write_paths_credit_posts_likes_and_joins(db, space):
+    (post_id,) = db.add_posts_bulk([{'username': "carol", 'text': "#jazz", 'tags': ["jazz"]}], fan_out=False)
+    db.like_post("bob", post_id)
+    db.join_space("bob", space, "speaker")
+    profile = db.get_user_interest_profile("bob")
+    assert profile['jazz'] == pytest.approx(INTEREST_WEIGHTS['like'], rel=1e-3)
+    assert profile['music'] == pytest.approx(ROLE_WEIGHTS['speaker'] * INTEREST_WEIGHTS['join'], rel=1e-3)
+    assert db.get_user_interest_profile("carol")['jazz'] == pytest.approx(INTEREST_WEIGHTS['post'], rel=1e-3)
+
+    db.unlike_post("bob", post_id)
+    assert 'jazz' not in db.get_user_interest_profile("bob")
+
+
+def test_rebuild_matches_the_incremental_profile(db, space):
+    db.add_posts_bulk([{'username': "bob", 'text': "#jazz", 'tags': ["jazz"], 'timestamp': time.time()}],
+                      fan_out=False)
+    db.join_space("bob", space, "listener")
+    incremental = db.get_user_interest_profile("bob")
+    db.rebuild_user_profiles()
+    assert db.get_user_interest_profile("bob") == pytest.approx(incremental, rel=1e-3)
@@ -0,0 +1,117 @@
+import pytest
+
+from presence import SpacePresence
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def presence(db, clock):
+    presence = SpacePresence(db, ttl=60, flush_interval=3600, clock=clock)
+    yield presence
+    presence.close()
+
+
+@pytest.fixture
+def space(db):
+    return db.create_space("alice", "Live", "", ["music"])
+
+
+def test_joins_reach_the_graph_on_flush(db, presence, space):
+    assert presence.join("bob", space, "listener")
+    assert not presence.join("bob", space, "listener")
+    assert presence.counts(space)['member_count'] == 1
+    assert not db.is_member_of_space("bob", space)
+
+    assert presence.flush() == 1
+    assert db.is_member_of_space("bob", space)
+    assert presence.pending() == 0
+
+
+def test_short_visits_are_written_as_one_interval(db, presence, clock, space):
+    presence.join("bob", space, "listener")
+    clock.now += 600
+    assert presence.leave("bob", space)
+    presence.flush()
+    assert not db.is_member_of_space("bob", space)
+    assert [row['duration'] for row in db.departures["bob"]] == [600]
+
+
+def test_leave_and_rejoin_between_flushes(db, presence, clock, space):
+    presence.join("bob", space, "listener")
+    presence.flush()
+    clock.now += 100
+    presence.leave("bob", space)
+    clock.now += 100
+    presence.join("bob", space, "speaker")
+    presence.flush()
+    assert db.is_member_of_space("bob", space)
+    assert db.members[space]["bob"]['role'] == "speaker"
+    assert [row['duration'] for row in db.departures["bob"]] == [100]
+    assert db.spaces[space]['member_count'] == 1
+
+
+def test_failed_flush_requeues_and_turns_orphaned_leaves_into_intervals(db, presence, clock, space, monkeypatch):
+    presence.join("bob", space, "listener")
+    presence.join("carol", space, "speaker")
+    write = db.join_spaces_bulk
+
+    def fail_once(rows):
+        monkeypatch.setattr(db, "join_spaces_bulk", write)
+        # Bob leaves while the batch with his join is being written
+        clock.now += 300
+        presence.leave("bob", space)
+        raise RuntimeError("graph unavailable")
+
+    monkeypatch.setattr(db, "join_spaces_bulk", fail_once)
+    assert presence.flush() == 0
+    assert presence.metrics()['errors'] == 1
+    assert [row['username'] for row in presence.intervals] == ["bob"]
+    assert presence.leaves == []
+    assert list(presence.joins) == [(space, "carol")]
+
+    presence.flush()
+    assert db.is_member_of_space("carol", space)
+    assert not db.is_member_of_space("bob", space)
+    assert [row['duration'] for row in db.departures["bob"]] == [300]
+
+
+def test_only_heartbeating_members_expire(presence, clock, space):
+    presence.join("bob", space, "listener")
+    presence.join("carol", space, "listener")
+    assert presence.heartbeat("bob", space)
+    assert not presence.heartbeat("dave", space)
+
+    clock.now += 61
+    assert presence.expire() == 1
+    assert [member['username'] for member in presence.participants(space)] == ["carol"]
+    assert presence.spaces_of("bob") == []
+
+
+def test_existing_edges_are_adopted_not_credited_again(db, presence, space):
+    db.join_space("bob", space, "listener")
+    profile = db.get_user_interest_profile("bob")
+    assert presence.join("bob", space, "listener")
+    assert presence.pending() == 0
+    assert db.get_user_interest_profile("bob")['music'] == pytest.approx(profile['music'], rel=1e-3)
+
+
+def test_ended_spaces_refuse_joins_and_drop_unwritten_ones(db, presence, space):
+    presence.join("bob", space, "listener")
+    db.end_space("alice", space)
+    presence.close_space(space)
+    presence.flush()
+    assert not db.is_member_of_space("bob", space)
+    with pytest.raises(ValueError, match="Space has ended"):
+        presence.join("carol", space, "listener")
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from memory_db import MemoryDatabase
+
+
+@pytest.fixture
+def counted(db):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+    return db, calls, lambda: db.recommendation_cache.get_or_compute("alice", 5, compute)
+
+
+def test_recommendations_are_cached_until_the_user_writes(counted):
+    db, calls, recommend = counted
+    assert recommend() == 1
+    assert recommend() == 1
+    db.follow_user("alice", "bob")
+    assert recommend() == 2
+    assert db.recommendation_cache.metrics()['stale'] == 1
+
+
+def test_other_users_writes_keep_the_entry(counted):
+    db, calls, recommend = counted
+    recommend()
+    db.follow_user("bob", "carol")
+    recommend()
+    assert calls == [1]
+
+
+def test_catalogue_changes_invalidate_every_user(counted):
+    db, calls, recommend = counted
+    recommend()
+    space_id = db.create_space("bob", "New", "", ["music"])
+    assert recommend() == 2
+    db.end_space("bob", space_id)
+    assert recommend() == 3
+
+
+def test_entries_expire_after_the_ttl():
+    db = MemoryDatabase(recommendation_cache_ttl=0)
+    db.create_user("alice", "password", "alice@example.com")
+    calls = []
+    for _ in range(2):
+        db.recommendation_cache.get_or_compute("alice", 5, lambda: calls.append(time.time()))
+    assert len(calls) == 2
+    assert db.recommendation_cache.metrics()['expired'] == 1
@@ -0,0 +1,69 @@
+import pytest
+
+from recommendation import ACTIVE, NEW, SOCIAL, RecommendationService
+
+
+@pytest.fixture
+def service(db):
+    return RecommendationService(db)
+
+
+def ids(result):
+    return [space['id'] for space in result['spaces']]
+
+
+def test_users_are_classified_by_activity_then_follows(db, service):
+    assert service.classify("dave")['state'] == NEW
+    db.follow_user("dave", "alice")
+    assert service.classify("dave")['state'] == SOCIAL
+    db.add_post("dave", "hello", ["music"])
+    user = service.classify("dave")
+    assert user['state'] == ACTIVE and user['following'] == 1
+    assert service.classify("nobody")['state'] == NEW
+
+
+def test_new_users_get_trending_then_latest_spaces(db, service):
+    quiet = db.create_space("alice", "Quiet", "", ["music"])
+    result = service.run("dave")
+    assert result['state'] == NEW and result['source'] == "latest_candidates"
+    assert ids(result) == [quiet]
+
+    busy = db.create_space("bob", "Busy", "", ["tech"])
+    db.join_space("carol", busy, "listener")
+    result = service.run("dave")
+    assert result['source'] == "trending_candidates" and ids(result) == [busy]
+
+
+def test_social_users_see_where_the_people_they_follow_are(db, service):
+    db.create_space("alice", "Elsewhere", "", ["art"])
+    friends = db.create_space("alice", "Friends", "", ["music"])
+    db.join_space("bob", friends, "speaker")
+    db.follow_user("dave", "bob")
+    result = service.run("dave")
+    assert result['state'] == SOCIAL and result['source'] == "friend_candidates"
+    assert ids(result) == [friends]
+
+
+def test_stale_precomputed_rows_fall_through_to_online_scoring(db, service):
+    ended = db.create_space("alice", "Ended", "", ["music"])
+    live = db.create_space("alice", "Live", "", ["music"])
+    db.write_recommendations([{'username': "dave", 'space_id': ended, 'score': 1.0, 'rank': 0}], 1, "2024-01-01")
+    db.add_post("dave", "hello", ["music"])
+    assert service.run("dave")['source'] == "precomputed_candidates"
+
+    db.end_space("alice", ended)
+    result = service.run("dave")
+    assert result['state'] == ACTIVE and result['source'] == "behaviour_candidates"
+    assert ids(result) == [live]
+    assert service.metrics()['served'] == {"active:precomputed_candidates": 1, "active:behaviour_candidates": 1}
+
+
+def test_filter_drops_duplicates_ended_and_joined_spaces(db, service):
+    joined = db.create_space("alice", "Joined", "", ["music"])
+    ended = db.create_space("alice", "Ended", "", ["music"])
+    live = db.create_space("alice", "Live", "", ["music"])
+    db.join_space("dave", joined, "listener")
+    db.end_space("alice", ended)
+    user = service.classify("dave")
+    ranked = [(joined, 0.9), (live, 0.8), (ended, 0.7), (live, 0.6)]
+    assert service.filter_candidates(user, ranked) == [(live, 0.8)]
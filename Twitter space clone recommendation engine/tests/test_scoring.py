@@ -0,0 +1,43 @@
+import numpy as np
+
+from scoring import build_space_matrix, build_topic_index, build_user_vector, score, top_k
+
+
+def test_rows_are_unit_length_and_binary():
+    topic_lists = [["music", "tech"], ["music"], ["tech", "tech"]]
+    topic_index = build_topic_index(topic_lists)
+    matrix = build_space_matrix(topic_lists, topic_index).toarray()
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+    assert np.allclose(matrix[0], [2 ** -0.5, 2 ** -0.5])
+    assert np.allclose(matrix[2], [0.0, 1.0])
+
+
+def test_score_is_cosine_similarity():
+    topic_lists = [["music", "tech"], ["music"], ["art"]]
+    topic_index = build_topic_index(topic_lists)
+    matrix = build_space_matrix(topic_lists, topic_index)
+    # Unknown topics are dropped from the user vector
+    scores = score(matrix, build_user_vector({'music': 3.0, 'tech': 4.0, 'unknown': 10.0}, topic_index))
+    assert np.allclose(scores, [7 / (5 * 2 ** 0.5), 3 / 5, 0.0])
+
+
+def test_top_k():
+    scores = np.array([0.1, 0.9, 0.5, 0.9, 0.0])
+    assert list(top_k(scores, 2)) == [1, 3]
+    assert list(top_k(scores, 3)) == [1, 3, 2]
+    assert list(top_k(scores, 10)) == [1, 3, 2, 0, 4]
+    assert len(top_k(scores, 0)) == 0
+    assert len(top_k(np.array([]), 3)) == 0
+
+
+def test_rank_spaces_by_topic_skips_ended_and_excluded(db):
+    music = db.create_space("alice", "Music", "", ["music"])
+    mixed = db.create_space("alice", "Mixed", "", ["music", "tech"])
+    ended = db.create_space("bob", "Old music", "", ["music"])
+    db.create_space("bob", "Tech", "", ["tech"])
+    db.end_space("bob", ended)
+
+    ranked = db.rank_spaces_by_topic({'music': 1.0}, 10)
+    assert [space_id for space_id, _ in ranked][:2] == [music, mixed]
+    assert ended not in dict(ranked)
+    assert music not in dict(db.rank_spaces_by_topic({'music': 1.0}, 10, exclude=[music]))
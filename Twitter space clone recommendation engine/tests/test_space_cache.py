@@ -0,0 +1,55 @@
+from scoring import build_space_matrix
+from space_cache import SpaceTopicCache
+
+
+def test_local_writes_update_the_space_cache_without_reloading(db):
+    first = db.create_space("alice", "First", "", ["music"])
+    db.space_cache.snapshot()
+    loads = []
+    load_spaces = db.space_cache.load_spaces
+    db.space_cache.load_spaces = lambda: loads.append(1) or load_spaces()
+
+    second = db.create_space("alice", "Second", "", ["tech"])
+    matrix, space_ids, live, topic_index, row_of = db.space_cache.snapshot()
+    assert loads == []
+    assert set(space_ids) == {first, second}
+    assert "tech" in topic_index
+
+    db.end_space("alice", first)
+    _, _, live, _, row_of = db.space_cache.snapshot()
+    assert not live[row_of[first]] and live[row_of[second]]
+    assert db.space_cache.get(first)['status'] == 'ended'
+
+    db.delete_space("alice", second)
+    _, _, _, _, row_of = db.space_cache.snapshot()
+    assert second not in row_of
+    assert loads == []
+
+
+def test_space_cache_reloads_when_another_worker_bumps_the_version():
+    spaces = [{'id': "a", 'topics': ["music"]}]
+    version = [1]
+    cache = SpaceTopicCache(lambda: list(spaces), lambda: version[0], refresh_interval=0)
+    assert cache.snapshot()[1] == ["a"]
+
+    spaces.append({'id': "b", 'topics': ["tech"]})
+    version[0] = 2
+    assert cache.snapshot()[1] == ["a", "b"]
+
+    # A local write that skips a version means someone else wrote in between
+    cache.add_spaces([{'id': "c", 'topics': ["art"]}], 4)
+    assert not cache.loaded
+    assert cache.snapshot()[1] == ["a", "b"]
+
+
+def test_appended_rows_match_a_full_rebuild():
+    cache = SpaceTopicCache(lambda: [{'id': "a", 'topics': ["music"]}], lambda: 1)
+    cache.snapshot()
+    cache.add_spaces([{'id': "b", 'topics': ["music", "tech"]}], 2)
+    cache.end_space("a", 3)
+    matrix, space_ids, live, topic_index, _ = cache.snapshot()
+
+    expected = build_space_matrix([["music"], ["music", "tech"]], topic_index)
+    assert matrix.shape == (2, 2)
+    assert (matrix != expected).nnz == 0
+    assert space_ids == ["a", "b"] and live.tolist() == [False, True]
@@ -0,0 +1,62 @@
+import pytest
+
+
+@pytest.fixture
+def space(db):
+    space_id = db.create_space("alice", "Live", "", ["music"])
+    db.join_space("bob", space_id, "speaker")
+    db.join_space("carol", space_id, "listener")
+    return space_id
+
+
+def test_end_space_moves_every_member_to_left_as(db, space):
+    stats = db.end_space("alice", space)
+    assert stats['members'] == 2 and not stats['resumed']
+    assert stats['host_duration'] >= 0
+
+    assert db.spaces[space]['status'] == 'ended'
+    assert db.members.get(space, {}) == {}
+    assert db.spaces[space]['member_count'] == 0
+    for username in ("bob", "carol"):
+        assert not db.is_member_of_space(username, space)
+        (departure,) = [row for row in db.departures[username] if row['space_id'] == space]
+        assert departure['left_at'] == stats['ended_at']
+        assert departure['duration'] >= 0
+    durations = {row['relationship_type']: row for row in db.get_user_space_durations("alice")}
+    assert durations['HOSTS']['left_at'] is not None
+
+
+def test_ending_twice_resumes_without_crediting_the_host_again(db, space):
+    first = db.end_space("alice", space)
+    profile = db.get_user_interest_profile("alice")
+    second = db.end_space("alice", space)
+    assert second['resumed'] and second['members'] == 0
+    assert second['ended_at'] == first['ended_at']
+    assert db.get_user_interest_profile("alice")['music'] == pytest.approx(profile['music'])
+
+
+def test_only_the_host_can_end_a_space(db, space):
+    with pytest.raises(ValueError, match="not the host"):
+        db.end_space("bob", space)
+    with pytest.raises(ValueError, match="Space not found"):
+        db.end_space("alice", "missing")
+
+
+def test_no_joins_after_the_end(db, space):
+    db.end_space("alice", space)
+    with pytest.raises(ValueError, match="Space has ended"):
+        db.join_space("dave", space, "listener")
+
+    db.join_spaces_bulk([{'username': "dave", 'space_id': space, 'role': "listener"}])
+    assert not db.is_member_of_space("dave", space)
+    assert db.spaces[space]['member_count'] == 0
+    # Finished intervals are history, so they are still recorded
+    db.join_spaces_bulk([{'username': "dave", 'space_id': space, 'role': "listener",
+                          'joined_at': "2024-01-01T10:00:00", 'left_at': "2024-01-01T11:00:00"}])
+    assert [row['duration'] for row in db.departures["dave"]] == [3600]
+
+
+def test_ended_spaces_leave_the_trending_counters(db, space):
+    assert space in dict(db.trending.top(10))
+    db.end_space("alice", space)
+    assert space not in dict(db.trending.top(10))
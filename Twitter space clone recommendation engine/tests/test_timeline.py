@@ -0,0 +1,45 @@
+def feed_ids(db, username, limit=20):
+    return [post['post_id'] for post in db.get_following_feed(username, limit=limit)['posts']]
+
+
+def test_posts_fan_out_to_followers_and_timelines_stay_bounded(db):
+    db.timeline_max_length = 3
+    db.follow_user("bob", "alice")
+    posts = db.add_posts_bulk([{'username': "alice", 'text': f"post {i}", 'timestamp': 1700000000 + i}
+                               for i in range(5)])
+    assert set(db.timelines["bob"]) == set(posts[2:])
+    assert set(db.timelines["alice"]) == set(posts[2:])
+    assert feed_ids(db, "bob") == posts[:1:-1]
+    assert feed_ids(db, "carol") == []
+
+
+def test_following_backfills_and_unfollowing_removes_the_authors_posts(db):
+    first = db.add_post("alice", "before", [])
+    db.follow_user("bob", "alice")
+    assert feed_ids(db, "bob") == [first]
+
+    db.unfollow_user("bob", "alice")
+    assert feed_ids(db, "bob") == []
+    assert "bob" not in db.timeline_owners[first]
+
+
+def test_celebrity_posts_are_merged_in_at_read_time(db):
+    db.celebrity_threshold = 1
+    db.follow_user("bob", "alice")
+    db.follow_user("carol", "alice")
+    db.follow_user("bob", "dave")
+    celebrity = db.add_post("alice", "to everyone", [])
+    regular = db.add_post("dave", "to bob", [])
+    db.posts[regular]['timestamp'] = db.posts[celebrity]['timestamp'] + 1
+
+    # Over the threshold nothing is pushed, but followers still see the post
+    assert celebrity not in db.timelines["bob"] and celebrity in db.timelines["alice"]
+    assert regular in db.timelines["bob"]
+    assert feed_ids(db, "bob") == [regular, celebrity]
+    assert feed_ids(db, "carol") == [celebrity]
+
+    # Paging carries on across both sources
+    page = db.get_following_feed("bob", limit=1)
+    assert [post['post_id'] for post in page['posts']] == [regular]
+    page = db.get_following_feed("bob", limit=1, cursor=page['next'])
+    assert [post['post_id'] for post in page['posts']] == [celebrity]
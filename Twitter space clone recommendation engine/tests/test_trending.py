@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+
+from trending import TrendingSpaces
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def trending(clock):
+    return TrendingSpaces(window=600, bucket=60, top_k=2, clock=clock)
+
+
+def test_joins_slide_out_of_the_window_but_members_still_count(trending, clock):
+    trending.record_join("a", "listener")
+    trending.record_join("a", "speaker")
+    trending.record_leave("a", "listener")
+    clock.now += 300
+    trending.record_join("b", "listener")
+    # a: 2 joins + 1 member + 1 speaker; b: 1 join + 1 member
+    assert trending.top() == [("a", 4.5), ("b", 1.5)]
+
+    clock.now += 360
+    assert trending.top() == [("a", 2.5), ("b", 1.5)]
+    clock.now += 300
+    assert trending.top() == [("a", 2.5), ("b", 0.5)]
+    assert trending.metrics()['buckets'] == 0
+
+
+def test_top_is_capped_and_ended_spaces_drop_out(trending):
+    for space_id, joins in (("a", 3), ("b", 2), ("c", 1)):
+        for _ in range(joins):
+            trending.record_join(space_id, "listener")
+    assert [space_id for space_id, _ in trending.top()] == ["a", "b"]
+    assert trending.top(exclude={"a"}) == [("b", 3.0)]
+
+    trending.remove("a")
+    assert [space_id for space_id, _ in trending.top()] == ["b", "c"]
+
+
+def test_warm_replays_stored_memberships(trending, clock):
+    def at(seconds_ago):
+        return datetime.fromtimestamp(clock.now - seconds_ago).isoformat()
+    rows = [{'space_id': "a", 'role': "listener", 'joined_at': at(900), 'left_at': None},
+            {'space_id': "a", 'role': "speaker", 'joined_at': at(30), 'left_at': at(10)},
+            {'space_id': "b", 'role': "listener", 'joined_at': at(120), 'left_at': None}]
+    assert trending.warm(rows) == 3
+    # The join from 15 minutes ago is outside the window, but that listener is still in the space
+    assert trending.top() == [("a", 1.5), ("b", 1.5)]
+
+
+def test_snapshot_is_served_from_the_graph_on_a_fresh_worker(db):
+    live = db.create_space("alice", "Live", "", ["music"])
+    ended = db.create_space("alice", "Ended", "", ["music"])
+    for username in ("bob", "carol"):
+        db.join_space(username, live, "listener")
+    db.join_space("dave", ended, "listener")
+    assert db.trending.snapshot(db.write_trending_snapshot) == 2
+    db.end_space("alice", ended)
+    assert db.get_trending_snapshot() == [(live, 3.0)]
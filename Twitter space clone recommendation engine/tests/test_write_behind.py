@@ -0,0 +1,75 @@
+import pytest
+
+from write_behind import LIKE, WriteBehindQueue
+
+
+@pytest.fixture
+def queue(db):
+    queue = WriteBehindQueue(db, flush_interval=3600, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def post(db):
+    return db.add_post("alice", "hello", ["music"])
+
+
+def test_toggles_on_the_same_pair_collapse_to_the_final_state(db, queue, post):
+    queue.set_like("bob", post, True)
+    queue.set_like("bob", post, False)
+    queue.set_like("bob", post, True)
+    queue.set_follow("bob", "alice", True)
+    queue.set_follow("bob", "alice", False)
+    metrics = queue.metrics()
+    assert metrics['enqueued'] == 5 and metrics['coalesced'] == 3 and metrics['queue_depth'] == 2
+
+    # Reads see the unwritten state
+    row = queue.overlay_posts("bob", [{'post_id': post, 'viewer_liked': False, 'like_count': 0}])[0]
+    assert row['viewer_liked'] and row['like_count'] == 1
+    assert queue.following_state("bob", "alice", True, ["bob"]) == (False, [])
+
+    assert queue.flush() == 2
+    assert post in db.likes["bob"]
+    assert not db.is_following("bob", "alice")
+    assert queue.pending_state(LIKE, "bob", post) is None
+
+
+def test_a_failing_row_is_retried_then_parked_without_blocking_the_rest(db, queue, post):
+    like_posts_bulk = db.like_posts_bulk
+
+    def like_posts(rows):
+        if any(row['username'] == "carol" for row in rows):
+            raise RuntimeError("constraint violation")
+        like_posts_bulk(rows)
+    db.like_posts_bulk = like_posts
+
+    queue.set_like("carol", post, True)
+    queue.set_like("bob", post, True)
+    assert queue.flush() == 1
+    assert post in db.likes["bob"] and post not in db.likes["carol"]
+    assert queue.depth() == 1
+
+    assert queue.flush() == 0
+    metrics = queue.metrics()
+    assert metrics['parked_rows'] == 1 and metrics['queue_depth'] == 0 and metrics['errors'] == 2
+
+    db.like_posts_bulk = like_posts_bulk
+    assert queue.retry_parked() == 1
+    assert queue.flush() == 1
+    assert post in db.likes["carol"]
+
+
+def test_a_newer_toggle_replaces_a_failed_one(db, queue, post):
+    def like_posts(rows):
+        if rows:
+            raise RuntimeError("down")
+    db.like_posts_bulk = like_posts
+
+    queue.set_like("bob", post, True)
+    assert queue.flush() == 0
+    # The unlike supersedes the like waiting for its retry, and only the unlike is written
+    queue.set_like("bob", post, False)
+    assert queue.flush() == 1
+    assert queue.metrics()['parked_rows'] == 0 and queue.depth() == 0
+    assert queue.attempts == {}
@@ -0,0 +1,157 @@
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+# Trending score = joins inside the window + a weight per member currently in the space + one per speaker
+TRENDING_WEIGHTS = {"joins": 1.0, "listeners": 0.5, "speakers": 2.0}
+SPEAKER_ROLES = ("speaker", "moderator")
+
+logger = logging.getLogger(__name__)
+
+
+class TrendingSpaces:
+    # Popularity of live spaces, kept in memory from join/leave/end events:
+    #   joins      -> per-bucket counts over a sliding window; whole buckets expire from the front
+    #   listeners  -> members currently in the space
+    #   speakers   -> members currently holding a speaker or moderator role
+    # top() serves a top_k list that is only rebuilt (one K-sized heap pass) after a score changed.
+    # Counters only see this worker's events; start_snapshots() writes them to the graph as this
+    # worker's share, and the graph ranking sums the shares of every worker that is still writing.
+
+    def __init__(self, window=3600, bucket=60, top_k=100, clock=time.time):
+        self.window = window
+        self.bucket = bucket
+        self.top_k = top_k
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = deque()
+        self.joins = Counter()
+        self.listeners = Counter()
+        self.speakers = Counter()
+        self.ranked = []
+        self.dirty = False
+        self.thread = None
+        self.stopped = threading.Event()
+        self.stats = {'events': 0, 'rebuilds': 0, 'snapshots': 0, 'errors': 0, 'last_snapshot_at': None}
+
+    def _advance(self, now):
+        # Drop buckets that have slid out of the window
+        cutoff = now - self.window
+        while self.buckets and self.buckets[0][0] + self.bucket <= cutoff:
+            _, counts = self.buckets.popleft()
+            for space_id, joins in counts.items():
+                self.joins[space_id] -= joins
+                if self.joins[space_id] <= 0:
+                    del self.joins[space_id]
+            self.dirty = True
+
+    def record_join(self, space_id, role, at=None):
+        now = self.clock()
+        at = now if at is None else at
+        with self.lock:
+            self._advance(now)
+            if at > now - self.window:
+                start = at - at % self.bucket
+                # Late events land in the newest bucket, so they expire at most one window late
+                if not self.buckets or self.buckets[-1][0] < start:
+                    self.buckets.append((start, Counter()))
+                self.buckets[-1][1][space_id] += 1
+                self.joins[space_id] += 1
+            self.listeners[space_id] += 1
+            if role in SPEAKER_ROLES:
+                self.speakers[space_id] += 1
+            self.stats['events'] += 1
+            self.dirty = True
+
+    def record_leave(self, space_id, role):
+        with self.lock:
+            for gauge, counted in ((self.listeners, True), (self.speakers, role in SPEAKER_ROLES)):
+                if counted and gauge[space_id] > 0:
+                    gauge[space_id] -= 1
+                if gauge[space_id] <= 0:
+                    gauge.pop(space_id, None)
+            self.stats['events'] += 1
+            self.dirty = True
+
+    def remove(self, space_id):
+        # Ended and deleted spaces stop trending at once
+        with self.lock:
+            for _, counts in self.buckets:
+                counts.pop(space_id, None)
+            for counter in (self.joins, self.listeners, self.speakers):
+                counter.pop(space_id, None)
+            self.stats['events'] += 1
+            self.dirty = True
+
+    def _score(self, space_id):
+        return (TRENDING_WEIGHTS['joins'] * self.joins[space_id] +
+                TRENDING_WEIGHTS['listeners'] * self.listeners[space_id] +
+                TRENDING_WEIGHTS['speakers'] * self.speakers[space_id])
+
+    def top(self, n=None, exclude=()):
+        # [(space_id, score)] best first, at most top_k long before exclusions
+        with self.lock:
+            self._advance(self.clock())
+            if self.dirty:
+                scored = ((space_id, self._score(space_id)) for space_id in self.joins.keys() | self.listeners.keys())
+                self.ranked = heapq.nsmallest(self.top_k, ((space_id, value) for space_id, value in scored
+                                                           if value > 0), key=lambda pair: (-pair[1], pair[0]))
+                self.dirty = False
+                self.stats['rebuilds'] += 1
+            ranked = self.ranked
+        kept = [(space_id, value) for space_id, value in ranked if space_id not in exclude]
+        return kept if n is None else kept[:n]
+
+    def warm(self, rows):
+        # Rebuild the window and gauges from stored memberships, oldest first, after a restart
+        rows = sorted(rows, key=lambda row: row['joined_at'])
+        for row in rows:
+            self.record_join(row['space_id'], row['role'], at=datetime.fromisoformat(row['joined_at']).timestamp())
+            if row['left_at']:
+                self.record_leave(row['space_id'], row['role'])
+        return len(rows)
+
+    def snapshot(self, write):
+        computed_at = datetime.now().isoformat()
+        rows = [{'space_id': space_id, 'rank': rank, 'score': value}
+                for rank, (space_id, value) in enumerate(self.top(), start=1)]
+        try:
+            write(rows, computed_at)
+        except Exception:
+            with self.lock:
+                self.stats['errors'] += 1
+            logger.exception("Trending snapshot failed")
+            return 0
+        with self.lock:
+            self.stats['snapshots'] += 1
+            self.stats['last_snapshot_at'] = computed_at
+        return len(rows)
+
+    def start_snapshots(self, write, interval=300):
+        if self.thread is not None:
+            return
+
+        def run():
+            while not self.stopped.wait(interval):
+                self.snapshot(write)
+
+        self.thread = threading.Thread(target=run, name="trending-snapshot", daemon=True)
+        self.thread.start()
+        atexit.register(self.close, write)
+
+    def close(self, write):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.snapshot(write)
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+            metrics.update(tracked=len(self.joins.keys() | self.listeners.keys()), buckets=len(self.buckets),
+                           window=self.window, bucket=self.bucket, top_k=self.top_k)
+        return metrics
@@ -0,0 +1,189 @@
+import atexit
+import logging
+import threading
+import time
+
+
+LIKE = "like"
+FOLLOW = "follow"
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    # Buffers like/follow toggles in memory and writes them to Neo4j in batches.
+    # Repeated toggles on the same (user, target) pair collapse to the final state,
+    # so a like -> unlike -> like burst costs one write instead of three.
+    # Reads overlay the viewer's unwritten toggles (overlay_posts, following_state), so a reload
+    # inside the flush window still shows them. A failed batch is retried row by row; a row that
+    # keeps failing is parked after max_attempts instead of blocking every later batch.
+
+    def __init__(self, db, batch_size=500, flush_interval=1.0, max_attempts=5):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.pending = {}
+        self.inflight = {}
+        self.attempts = {}
+        self.parked = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.stats = {
+            'enqueued': 0,
+            'coalesced': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'errors': 0,
+            'parked': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def set_like(self, username, post_id, liked):
+        return self._put(LIKE, username, post_id, liked)
+
+    def set_follow(self, username, target_username, following):
+        return self._put(FOLLOW, username, target_username, following)
+
+    def pending_state(self, kind, username, target):
+        # The newest toggle not yet in the graph, or None; a batch being written still counts
+        with self.lock:
+            key = (kind, username, target)
+            return self.pending.get(key, self.inflight.get(key))
+
+    def overlay_posts(self, username, posts):
+        # Feed rows from hydrate_posts: viewer_liked and like_count as they will be after the flush
+        for post in posts:
+            liked = self.pending_state(LIKE, username, post['post_id'])
+            if liked is not None and liked != bool(post.get('viewer_liked')):
+                post['viewer_liked'] = liked
+                post['like_count'] = max((post.get('like_count') or 0) + (1 if liked else -1), 0)
+        return posts
+
+    def following_state(self, username, target_username, following, followers):
+        # (is_following, followers of target) for a profile page, with a pending toggle applied
+        state = self.pending_state(FOLLOW, username, target_username)
+        if state is None or state == following:
+            return following, followers
+        if state:
+            return True, followers + [username]
+        return False, [follower for follower in followers if follower != username]
+
+    def depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.stats)
+            metrics['queue_depth'] = len(self.pending)
+            metrics['parked_rows'] = len(self.parked)
+        return metrics
+
+    def retry_parked(self):
+        # Give parked rows another max_attempts, e.g. once the cause has been fixed
+        with self.lock:
+            for key, state in self.parked.items():
+                self.pending.setdefault(key, state)
+            count = len(self.parked)
+            self.parked = {}
+        if count:
+            self.wakeup.set()
+        return count
+
+    def _put(self, kind, username, target, state):
+        with self.lock:
+            key = (kind, username, target)
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            self.pending[key] = bool(state)
+            self.stats['enqueued'] += 1
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+        return bool(state)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def _write(self, batch):
+        likes, unlikes, follows, unfollows = [], [], [], []
+        for (kind, username, target), state in batch.items():
+            if kind == LIKE:
+                (likes if state else unlikes).append({'username': username, 'post_id': target})
+            else:
+                (follows if state else unfollows).append({'username': username, 'target': target})
+        self.db.like_posts_bulk(likes)
+        self.db.unlike_posts_bulk(unlikes)
+        self.db.follow_users_bulk(follows)
+        self.db.unfollow_users_bulk(unfollows)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.inflight = batch
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            failed = {}
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Write-behind flush of %d rows failed", len(batch))
+                if len(batch) == 1:
+                    failed = dict(batch)
+                # Retry one row at a time so a single bad row does not hold back the rest
+                for key, state in (batch.items() if len(batch) > 1 else ()):
+                    try:
+                        self._write({key: state})
+                    except Exception:
+                        failed[key] = state
+            elapsed = time.perf_counter() - started
+
+            with self.lock:
+                self.inflight = {}
+                for key in batch:
+                    if key not in failed:
+                        self.attempts.pop(key, None)
+                for key, state in failed.items():
+                    if key in self.pending:
+                        # A newer toggle replaces the failed one and gets its own attempts
+                        self.attempts.pop(key, None)
+                        continue
+                    self.attempts[key] = self.attempts.get(key, 0) + 1
+                    if self.attempts[key] >= self.max_attempts:
+                        del self.attempts[key]
+                        self.parked[key] = state
+                        self.stats['parked'] += 1
+                        logger.error("Write-behind parked %s after %d failed attempts", key, self.max_attempts)
+                    else:
+                        self.pending[key] = state
+                if failed:
+                    self.stats['errors'] += 1
+                self.stats['flushed'] += len(batch) - len(failed)
+                self.stats['flushes'] += 1
+                self.stats['last_flush_seconds'] = elapsed
+                self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+            return len(batch) - len(failed)
+
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join(timeout=self.flush_interval + 5)
+        # Drain whatever arrived after the last background flush
+        while self.depth():
+            if not self.flush():
+                break